@@ -0,0 +1,262 @@
+'''
+
+Author: Kian Mortimer
+Date: 18/10/26
+
+Description:
+Benchmark for the queries in database.py, before and after the migrations.
+Seeds a separate database with synthetic players, accounts and flags, then
+shows the query plan (EXPLAIN) and times each query on the schema without
+the migrations, applies the migrations (see migrations.py) and does the same.
+
+Usage: python benchmark_database.py [players]
+The benchmark database is dropped and created again on every run, the real
+database (data.DATABASE_CONNECTION) is never touched.
+
+'''
+
+
+# IMPORTS
+import mysql.connector
+import random
+import sys
+import time
+
+import data
+import migrations
+
+
+BENCHMARK_DATABASE = "rocket_league_benchmark"
+REPEATS = 200 # Times each query is run for the latencies
+
+'''
+The tables as the queries in database.py use them, without any indexes
+beyond the primary keys (the worst case for a database that has grown
+without any thought given to them).
+'''
+SCHEMA = [
+    "CREATE TABLE region ("
+    "ID INT AUTO_INCREMENT PRIMARY KEY, "
+    "Code VARCHAR(8) NOT NULL)",
+
+    "CREATE TABLE players ("
+    "ID INT AUTO_INCREMENT PRIMARY KEY, "
+    "Name VARCHAR(64) NOT NULL, "
+    "Region INT NOT NULL DEFAULT 1, "
+    "Original VARCHAR(64) NULL)",
+
+    "CREATE TABLE accounts ("
+    "ID INT AUTO_INCREMENT PRIMARY KEY, "
+    "PlayerID INT NOT NULL, "
+    "AccountID VARCHAR(64) NOT NULL, "
+    "Platform VARCHAR(8) NOT NULL, "
+    "Main TINYINT NOT NULL, "
+    "FOV INT, Distance INT, Height INT, Angle INT, "
+    "Stiffness DECIMAL(3,2), SwivelSpeed DECIMAL(3,1), TransitionSpeed DECIMAL(3,1), "
+    "SteeringSensitivity DECIMAL(4,2), "
+    "DateUpdated VARCHAR(32))",
+
+    "CREATE TABLE flags ("
+    "ID INT AUTO_INCREMENT PRIMARY KEY, "
+    "PlayerID INT NOT NULL, "
+    "Special TINYINT NOT NULL DEFAULT 0, Game TINYINT NOT NULL DEFAULT 0, "
+    "RLCS TINYINT NOT NULL DEFAULT 0, SixMans TINYINT NOT NULL DEFAULT 0, "
+    "ODL TINYINT NOT NULL DEFAULT 0, Boosting TINYINT NOT NULL DEFAULT 0, "
+    "Service TINYINT NOT NULL DEFAULT 0, Hacking TINYINT NOT NULL DEFAULT 0)"
+]
+
+'''
+The queries, as (name, query before the migrations, query after, function
+giving random parameters). The queries are the ones in database.py.
+'''
+def queries(players, accounts):
+    account = lambda rnd: rnd.choice(accounts)
+    name = lambda rnd: (rnd.choice(players).lower(),)
+    prefix = lambda rnd: (rnd.choice(players)[:4].lower(),)
+    player_id = lambda rnd: (rnd.randint(1, len(players)),)
+    return [
+        (
+            "identify: account",
+            "SELECT players.Name, accounts.Main, players.ID, players.Original "
+            "FROM accounts INNER JOIN players ON accounts.PlayerID=players.ID "
+            "WHERE accounts.Platform=%s AND accounts.AccountID=%s",
+            None,
+            account
+        ),
+        (
+            "identify: flags",
+            "SELECT * FROM flags WHERE PlayerID = %s",
+            None,
+            player_id
+        ),
+        (
+            "get: name prefix",
+            "SELECT players.Name, region.Code, players.Original, "
+            "accounts.Platform, accounts.AccountID, accounts.Main "
+            "FROM players INNER JOIN region ON players.Region=region.ID "
+            "LEFT JOIN accounts ON players.ID=accounts.PlayerID "
+            "WHERE UPPER(players.Name) LIKE UPPER(CONCAT(%s, '%')) "
+            "ORDER BY players.Name ASC, accounts.Main DESC, accounts.Platform DESC",
+            "SELECT players.Name, region.Code, players.Original, "
+            "accounts.Platform, accounts.AccountID, accounts.Main "
+            "FROM players INNER JOIN region ON players.Region=region.ID "
+            "LEFT JOIN accounts ON players.ID=accounts.PlayerID "
+            "WHERE players.NameKey LIKE CONCAT(UPPER(%s), '%') "
+            "ORDER BY players.Name ASC, accounts.Main DESC, accounts.Platform DESC",
+            prefix
+        ),
+        (
+            "set/flag: name",
+            "SELECT ID FROM players WHERE UPPER(Name) = UPPER(%s)",
+            "SELECT ID FROM players WHERE NameKey = UPPER(%s)",
+            name
+        ),
+        (
+            "flag: player",
+            "SELECT ID FROM flags WHERE PlayerID = %s",
+            None,
+            player_id
+        ),
+        (
+            "update_account",
+            "UPDATE accounts SET DateUpdated=%s WHERE Platform=%s AND AccountID=%s",
+            None,
+            lambda rnd: ("2023-01-01",) + account(rnd)
+        )
+    ]
+
+def seed(con, count, seed=0):
+    '''
+    @param
+     - con   : Connection to the (empty) benchmark database
+     - count : Int number of players
+
+    @return
+     - List of the player names
+     - List of the accounts (platform, id)
+
+    Most players have one account (their main) and some have a few alts.
+    '''
+    rnd = random.Random(seed)
+    cursor = con.cursor()
+    for statement in SCHEMA:
+        cursor.execute(statement)
+    cursor.executemany("INSERT INTO region (Code) VALUES (%s)", [(code,) for code in ["OCE", "NA", "EU", "SAM", "ME", "ASIA"]])
+
+    players = [f"player{i}_{rnd.randint(0, 9999)}" for i in range(count)]
+    accounts = []
+    player_rows, account_rows, flag_rows = [], [], []
+    for i in range(count):
+        player_rows.append((players[i], rnd.randint(1, 6)))
+        for alt in range(rnd.choice([1, 1, 1, 2, 3])):
+            platform = rnd.choice(["steam", "epic", "xbox", "ps4"])
+            account_id = str(76561198000000000 + len(accounts)) if platform == "steam" else f"id{len(accounts)}"
+            accounts.append((platform, account_id))
+            account_rows.append((
+                i + 1, account_id, platform, 1 if alt == 0 else 0,
+                rnd.randint(100, 110), rnd.choice(range(240, 300, 10)), rnd.choice(range(90, 130, 10)), rnd.randint(-5, -2),
+                round(rnd.random(), 2), round(rnd.uniform(1, 10), 1), round(rnd.uniform(1, 2), 1), round(rnd.uniform(1, 2.5), 2),
+                "2022-12-17"
+            ))
+        if rnd.random() < 0.01: flag_rows.append((i + 1, 1))
+
+    # Multi-row inserts in batches
+    for start in range(0, len(player_rows), 5000):
+        cursor.executemany("INSERT INTO players (Name, Region) VALUES (%s, %s)", player_rows[start:start + 5000])
+    for start in range(0, len(account_rows), 5000):
+        cursor.executemany(
+            "INSERT INTO accounts (PlayerID, AccountID, Platform, Main, FOV, Distance, Height, Angle, "
+            "Stiffness, SwivelSpeed, TransitionSpeed, SteeringSensitivity, DateUpdated) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            account_rows[start:start + 5000]
+        )
+    cursor.executemany("INSERT INTO flags (PlayerID, Game) VALUES (%s, %s)", flag_rows)
+    con.commit()
+    cursor.execute("ANALYZE TABLE region, players, accounts, flags")
+    cursor.fetchall()
+    cursor.close()
+    return players, accounts
+
+def explain(con, query, params):
+    '''
+    @return
+     - List of strings describing the plan of each table in the query
+    '''
+    cursor = con.cursor(dictionary=True)
+    cursor.execute("EXPLAIN " + query, params)
+    plan = [f"{row['table']}: {row['type']} key={row['key']} rows={row['rows']} {row['Extra'] or ''}".strip() for row in cursor.fetchall()]
+    cursor.close()
+    return plan
+
+def timed(con, query, params_for, rnd):
+    '''
+    @return
+     - Float mean milliseconds of the query
+     - Float 95th percentile milliseconds of the query
+
+    The query is prepared once and run REPEATS times (as database.py does).
+    '''
+    cursor = con.cursor(prepared=True)
+    times = []
+    for i in range(REPEATS):
+        params = params_for(rnd)
+        start = time.perf_counter()
+        cursor.execute(query, params)
+        if cursor.with_rows: cursor.fetchall()
+        times.append((time.perf_counter() - start) * 1000)
+    con.rollback()
+    cursor.close()
+    times.sort()
+    return sum(times) / len(times), times[int(len(times) * 0.95)]
+
+def report(con, players, accounts, after):
+    '''
+    @return
+     - Dictionary of the mean milliseconds of each query {name: ms}
+    '''
+    rnd = random.Random(1)
+    means = {}
+    for name, before_query, after_query, params_for in queries(players, accounts):
+        query = after_query if after and after_query is not None else before_query
+        print(f" > {name}")
+        for line in explain(con, query, params_for(rnd)):
+            print(f"   - {line}")
+        mean, p95 = timed(con, query, params_for, rnd)
+        print(f"   - {mean:.3f}ms mean, {p95:.3f}ms p95")
+        means[name] = mean
+    return means
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    connection = dict(data.DATABASE_CONNECTION)
+    del connection["database"]
+    con = mysql.connector.connect(**connection)
+    cursor = con.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS {BENCHMARK_DATABASE}")
+    cursor.execute(f"CREATE DATABASE {BENCHMARK_DATABASE}")
+    cursor.execute(f"USE {BENCHMARK_DATABASE}")
+    cursor.close()
+
+    print(f" > Seeding {count} players")
+    start = time.perf_counter()
+    players, accounts = seed(con, count)
+    print(f" - {len(accounts)} accounts in {time.perf_counter() - start:.1f}s")
+
+    print("\n## BEFORE ##")
+    before = report(con, players, accounts, False)
+
+    print("\n## MIGRATIONS ##")
+    start = time.perf_counter()
+    version = migrations.migrate(con)
+    print(f" - Version {version} in {time.perf_counter() - start:.1f}s")
+
+    print("\n## AFTER ##")
+    after = report(con, players, accounts, True)
+
+    print("\n## SUMMARY ##")
+    for name in before:
+        print(f" > {name.ljust(20)} {before[name]:8.3f}ms -> {after[name]:8.3f}ms  ({before[name] / after[name]:.0f}x)")
+
+    con.close()
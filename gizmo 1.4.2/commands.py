@@ -100,10 +100,7 @@ def load(bot):
     @utility.developer()
     async def recondition(ctx):
         await ctx.respond(' > Updating all database records')
-        db = database.Database()
-        if db.connect():
-            response = db.recondition()
-            db.close()
+        online, response = await database.run(database.Database.recondition)
 
     # GET DATABASE RECORD
     @bot.slash_command(
@@ -119,9 +116,8 @@ def load(bot):
     @utility.developer()
     async def get(ctx, player):
         embed = None
-        db = database.Database()
-        if db.connect():
-            response = db.get(player)
+        online, response = await database.run(database.Database.get, player)
+        if online:
             if response is None:
                 # Create the failed Discord embed
                 embed = discord.Embed(
@@ -155,7 +151,6 @@ def load(bot):
                     value=accounts,
                     inline=False
                 )
-            db.close()
         else:
             # Database Offline
             embed = discord.Embed(
@@ -189,9 +184,8 @@ def load(bot):
     @utility.developer()
     async def set(ctx, account, player):
         embed = None
-        db = database.Database()
-        if db.connect():
-            response = db.set(account, player)
+        online, response = await database.run(database.Database.set, account, player)
+        if online:
             if not response:
                 # Create the failed Discord embed
                 embed = discord.Embed(
@@ -206,7 +200,6 @@ def load(bot):
                     description=f"```{account}``` → {player}",
                     color=data.GREEN
                 )
-                db.close()
         else:
             # Database Offline
             embed = discord.Embed(
@@ -233,9 +226,9 @@ def load(bot):
     @utility.developer()
     async def flag(ctx, player):
         embed = None
-        db = database.Database()
-        if db.connect():
-            response, player_id = db.flag(player)
+        online, result = await database.run(database.Database.flag, player)
+        if online:
+            response, player_id = result
             if player_id is None:
                 # "Failed" Discord embed: Unknown error
                     embed = discord.Embed(
@@ -265,8 +258,6 @@ def load(bot):
                     description=f"**{player_id}**: [Edit Record](http://localhost/phpmyadmin/tbl_select.php?db=rocket_league&table=flags)",
                     color=data.GREEN
                 )
-            
-            db.close()
         else:
             # Database Offline
             embed = discord.Embed(
@@ -57,6 +57,19 @@ FLAGS_TEXT = [
     f"{PLAYER_FLAG_ORANGE}   Suspected of using **Hack Clients**"
 ]
 
+# DATABASE
+DATABASE_CONNECTION = {
+    "host": "localhost",
+    "user": "root",
+    "password": "",
+    "database": "rocket_league"
+}
+DATABASE_POOL_SIZE = 4 # Connections kept open to the database (and commands that can query it at once)
+DATABASE_IDENTIFY_TOP = 5 # Closest players identify() returns (one spare for ANONYMISE)
+DATABASE_MATRIX_REFRESH = 60 * 60 # Seconds before the camera matrix is reloaded, to pick up edits made outside the bot
+DATABASE_TREE_MIN = 10000 # Players in the camera matrix before identify() only scores the closest leaves (see database.CameraTree)
+DATABASE_BATCH_SIZE = 100 # Accounts /recondition updates in each transaction
+
 # MISCELLANEOUS
 BOT_FOOTER_TEXT = "Powered by Buncha Hunkas"
 
@@ -11,9 +11,454 @@ Interact with the local database.
 
 # IMPORTS
 import mysql.connector
-
+import mysql.connector.pooling
+import numpy as np
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import data
+import migrations
 import scraping # Only for getting player object for reconditioning
 
+## CAMERA SIMILARITY ##
+
+'''
+How identify() scores the camera similarity of an account to the target
+The equation here is completely arbitrary and just an
+interpretation of how to calculate similarity.
+
+Start at 0
+for each relevant setting:
+    total_percentage += (weight - max(0, abs(setting1 - setting2) * normal_variance))
+
+Broken down:
+1: abs(setting1 - setting2) 
+    Gets the difference between the two values and makes sure its positive
+2: X * normal_variance
+    This determines a normal variance for a setting (i.e. 1 is a big variance in terms of fov but not distance)
+    Thus with a difference of 1 in fov (109 vs 110) the percentage added to the total will be 10 out of a possible 15
+    And a difference of 2 would give 5/15 | 3 would give 0/15 | 4 would give 0/15
+3: max(0, X)
+    Makes sure the added percentage is never less than 0
+    (There is a bug in here that makes negative similarities possible but it doesnt really matter)
+4: weight - X
+    The weight just determines the importance of a setting (i.e. fov is more important than swivel speed etc.)
+
+What can be improved?
+1: The bug allowing for negative values is just an oversight where I have not specified that the maximum value 
+    should be equal to the weight (i.e. min(max(0,X), weight) )
+2: The weight and normal_variance variables are arbitrarily decided on by me
+3: There are certain values that are actually more important than normal
+    If the player in question has a steering sensitivity of 1.83 and a player in the database has the 
+    same steering sensitivity of 1.83 it makes them way more likely to be the same player. But the same 
+    cannot be said for someone with a steering sensitivity of 1.5 as this is far more common.
+4: Some values have too much importance
+    People often have random swivel speeds across their accounts because it's an arbitrary setting 
+    and with the current formula, this could make someone's similarity go from 100% to 90% and stop 
+    them from showing up in the top 4. I do not know what the best solutions for these issues are.
+'''
+
+'''
+Weights and variances of the camera settings for the similarity
+Columns: FOV, Distance, Height, Pitch, Stiffness, SwivelSpeed, TransitionSpeed, SteeringSensitivity
+ - CAMERA_WEIGHTS : The weight of a setting (the most it can add to the similarity)
+ - CAMERA_SCALES  : The normal variance of a setting (similarity lost per unit of difference)
+'''
+CAMERA_WEIGHTS = np.array([15, 15, 15, 15, 10, 10, 10, 10], dtype=np.float32)
+CAMERA_SCALES = np.array([5, 0.5, 0.5, 5, 20, 10, 20, 20], dtype=np.float32)
+CAMERA_TOTAL = float(CAMERA_WEIGHTS.sum())
+
+# Most rows in a CameraTree leaf before it is split in two (a leaf splits at twice this after inserts)
+LEAF_SIZE = 64
+# Leaves a CameraTree search scores at a time, before checking whether it can stop
+LEAF_BATCH = 8
+
+class CameraTree(object):
+    '''
+    Class holding the rows of a CameraMatrix in the leaves of a KD-tree
+
+    The settings are scaled so that the distance between two rows is the
+    similarity lost between them. The rows are split in half on the
+    setting that varies most, again and again, until every leaf holds at
+    most LEAF_SIZE rows, and each leaf keeps the box its rows fall in.
+    A leaf can be skipped once its box is further from the target than
+    the k closest rows found so far, so a search only scores the rows of
+    a few leaves instead of the whole matrix.
+
+    Only the leaves are kept (not the splits above them), so the boxes
+    of every leaf are compared with the target in one pass. A new row
+    goes in the leaf with the closest box, which splits once it gets too
+    big, and a row that moves is taken out of its leaf and put back in.
+    '''
+
+    def __init__(self):
+        self.leaves = []                                    # Rows in each leaf, by number
+        self.arrays = {}                                    # {leaf number: rows as an array}, until the leaf changes
+        self.row_leaves = []                                # Leaf number of each row
+        self.lows = np.zeros((0, len(CAMERA_WEIGHTS)), dtype=np.float32)   # Lowest corner of each leaf's box
+        self.highs = np.zeros((0, len(CAMERA_WEIGHTS)), dtype=np.float32)  # Highest corner of each leaf's box
+
+    @classmethod
+    def build(cls, matrix):
+        '''
+        @param
+         - matrix : CameraMatrix.matrix to hold the rows of
+
+        @return
+         - CameraTree of every row of the matrix
+        '''
+        tree = cls()
+        tree.row_leaves = [0] * len(matrix)
+        scaled = matrix * CAMERA_SCALES
+        leaves = []
+        groups = [np.arange(len(matrix))]
+        while groups:
+            rows = groups.pop()
+            if len(rows) <= LEAF_SIZE:
+                if len(rows): leaves.append(rows)
+                continue
+            points = scaled[rows]
+            dimension = np.argmax(points.max(axis=0) - points.min(axis=0))
+            order = np.argpartition(points[:, dimension], len(rows) // 2)
+            groups.append(rows[order[:len(rows) // 2]])
+            groups.append(rows[order[len(rows) // 2:]])
+        tree.leaves = [None] * len(leaves)
+        tree.lows = np.zeros((len(leaves), len(CAMERA_WEIGHTS)), dtype=np.float32)
+        tree.highs = np.zeros((len(leaves), len(CAMERA_WEIGHTS)), dtype=np.float32)
+        for number in range(len(leaves)):
+            tree.set_leaf(number, leaves[number].tolist(), scaled[leaves[number]])
+        return tree
+
+    def set_leaf(self, number, rows, points):
+        '''
+        @param
+         - number : Int number of the leaf
+         - rows   : List of rows in the leaf
+         - points : Array of the scaled settings of the rows
+        '''
+        if number == len(self.leaves):
+            self.leaves.append(None)
+            self.lows = np.vstack((self.lows, np.zeros((1, len(CAMERA_WEIGHTS)), dtype=np.float32)))
+            self.highs = np.vstack((self.highs, np.zeros((1, len(CAMERA_WEIGHTS)), dtype=np.float32)))
+        self.leaves[number] = rows
+        self.arrays.pop(number, None)
+        self.lows[number] = points.min(axis=0)
+        self.highs[number] = points.max(axis=0)
+        for row in rows:
+            self.row_leaves[row] = number
+
+    def gaps(self, point):
+        '''
+        @param
+         - point : Array of scaled settings
+
+        @return
+         - Array of the least similarity lost between the point and any row of each leaf
+        '''
+        return np.maximum(0, np.maximum(self.lows - point, point - self.highs)).sum(axis=1)
+
+    def insert(self, matrix, row):
+        '''
+        @param
+         - matrix : CameraMatrix.matrix the row belongs to
+         - row    : Int row of the matrix (new, or taken out by move())
+        '''
+        point = matrix[row] * CAMERA_SCALES
+        if row == len(self.row_leaves): self.row_leaves.append(None)
+        if len(self.leaves) == 0:
+            self.set_leaf(0, [row], point[np.newaxis])
+            return
+        number = int(np.argmin(self.gaps(point)))
+        self.leaves[number].append(row)
+        self.arrays.pop(number, None)
+        self.lows[number] = np.minimum(self.lows[number], point)
+        self.highs[number] = np.maximum(self.highs[number], point)
+        self.row_leaves[row] = number
+
+        # Split a leaf that has got too big, on the setting that varies most
+        if len(self.leaves[number]) > LEAF_SIZE * 2:
+            rows = np.array(self.leaves[number])
+            points = matrix[rows] * CAMERA_SCALES
+            dimension = np.argmax(points.max(axis=0) - points.min(axis=0))
+            order = np.argsort(points[:, dimension], kind="stable")
+            half = len(rows) // 2
+            self.set_leaf(number, rows[order[:half]].tolist(), points[order[:half]])
+            self.set_leaf(len(self.leaves), rows[order[half:]].tolist(), points[order[half:]])
+
+    def move(self, matrix, row):
+        '''
+        @param
+         - matrix : CameraMatrix.matrix the row belongs to
+         - row    : Int row of the matrix, whose settings have changed
+
+        The box of the old leaf isn't shrunk, which only makes it a little
+        less likely to be skipped.
+        '''
+        number = self.row_leaves[row]
+        self.leaves[number].remove(row)
+        self.arrays.pop(number, None)
+        self.insert(matrix, row)
+
+    def nearest(self, matrix, vector, k):
+        '''
+        @param
+         - matrix : CameraMatrix.matrix the rows belong to
+         - vector : Array of settings of the target
+         - k      : Number of closest rows needed
+
+        @return
+         - Array of rows that includes the k rows closest to the target
+
+        Leaves are taken closest first, a few at a time. Once they hold k
+        rows, the k-th closest of them is as far away as the k closest rows
+        can be, so the search stops at the first leaf further than that.
+        '''
+        gaps = self.gaps(vector * CAMERA_SCALES)
+        order = np.argsort(gaps)
+        rows = np.zeros(0, dtype=np.int64)
+        distances = np.zeros(0, dtype=np.float32)
+        limit = np.inf
+        taken = 0
+        while taken < len(order) and gaps[order[taken]] <= limit:
+            batch = order[taken:taken + LEAF_BATCH]
+            taken += LEAF_BATCH
+            batch_rows = np.concatenate([self.rows(number) for number in batch[gaps[batch] <= limit]])
+            rows = np.concatenate((rows, batch_rows))
+            distances = np.concatenate((distances, np.abs(matrix[batch_rows] - vector) @ CAMERA_SCALES))
+            if len(rows) >= k: limit = np.partition(distances, k - 1)[k - 1]
+        return rows
+
+    def rows(self, number):
+        '''
+        @param
+         - number : Int number of the leaf
+
+        @return
+         - Array of the rows in the leaf
+        '''
+        if number not in self.arrays:
+            self.arrays[number] = np.array(self.leaves[number], dtype=np.int64)
+        return self.arrays[number]
+
+class CameraMatrix(object):
+    '''
+    Class holding the camera settings of every main account in memory
+
+    identify() compares the target with every main account on each /info,
+    so rather than reading the whole accounts table and scoring the rows
+    one by one, the settings are kept as one float32 matrix (a row per
+    player) and scored in a single pass. Only the top few are sorted.
+    Past data.DATABASE_TREE_MIN players, only the rows in the leaves of
+    the CameraTree around the target are scored.
+
+    The matrix is loaded on the first identify() and kept up to date by
+    set() and update_account(). It is reloaded every
+    data.DATABASE_MATRIX_REFRESH seconds to pick up edits made outside
+    the bot (phpMyAdmin).
+    '''
+
+    def __init__(self):
+        self.names = []                                     # Player name of each row
+        self.players = {}                                   # {player name: row}
+        self.accounts = {}                                  # {(platform, account id): row}
+        self.matrix = np.zeros((0, len(CAMERA_WEIGHTS)), dtype=np.float32)
+        self.tree = CameraTree()                            # The rows in the leaves of a KD-tree
+        self.loaded = time.monotonic()
+
+    @classmethod
+    def load(cls, db):
+        '''
+        @param
+         - db : Connected Database to read the accounts with
+
+        @return
+         - CameraMatrix of every main account in the database
+        '''
+        query_main_accounts = (
+            "SELECT accounts.Platform, accounts.AccountID, players.Name, "
+            "accounts.FOV, accounts.Distance, accounts.Height, accounts.Angle, "
+            "accounts.Stiffness, accounts.SwivelSpeed, accounts.TransitionSpeed, "
+            "accounts.SteeringSensitivity FROM accounts "
+            "INNER JOIN players ON accounts.PlayerID=players.ID "
+            "INNER JOIN region ON players.Region=region.ID "
+            "WHERE accounts.Main = 1"
+        )
+        results = db.query(query_main_accounts)
+
+        camera_matrix = cls()
+        settings = []
+        for result in results:
+            # A name with more than one main account keeps the last one (as identify() always has)
+            row = camera_matrix.players.setdefault(result[2], len(camera_matrix.names))
+            if row == len(camera_matrix.names):
+                camera_matrix.names.append(result[2])
+                settings.append(None)
+            settings[row] = result[3:]
+            camera_matrix.accounts[(result[0], result[1])] = row
+        camera_matrix.matrix = np.array(settings, dtype=np.float32).reshape(-1, len(CAMERA_WEIGHTS))
+        camera_matrix.matrix[:, 3] = np.abs(camera_matrix.matrix[:, 3])
+        camera_matrix.tree = CameraTree.build(camera_matrix.matrix)
+        return camera_matrix
+
+    @staticmethod
+    def vector(player_object):
+        '''
+        @param
+         - player_object : Dictionary of player data from replay
+
+        @return
+         - Array of the player's settings in the order of the matrix columns
+        '''
+        camera = player_object["camera"]
+        return np.array([
+            camera["fov"], camera["distance"], camera["height"], abs(camera["pitch"]),
+            camera["stiffness"], camera["swivel_speed"], camera["transition_speed"],
+            player_object["steering_sensitivity"]
+        ], dtype=np.float32)
+
+    def insert(self, player, player_object):
+        '''
+        @param
+         - player        : String name of the player
+         - player_object : Dictionary of player data from replay of their new main account
+        '''
+        vector = self.vector(player_object)
+        row = self.players.get(player)
+        if row is None:
+            row = len(self.names)
+            self.names.append(player)
+            self.players[player] = row
+            self.matrix = np.vstack((self.matrix, vector))
+            self.tree.insert(self.matrix, row)
+        else:
+            self.matrix[row] = vector
+            self.tree.move(self.matrix, row)
+        self.accounts[(player_object['id']['platform'], player_object['id']['id'])] = row
+
+    def update(self, player_object):
+        '''
+        @param
+         - player_object : Dictionary of player data from replay
+
+        Only main accounts are in the matrix, so other accounts are ignored.
+        '''
+        row = self.accounts.get((player_object['id']['platform'], player_object['id']['id']))
+        if row is not None:
+            self.matrix[row] = self.vector(player_object)
+            self.tree.move(self.matrix, row)
+
+    def top(self, player_object, k):
+        '''
+        @param
+         - player_object : Dictionary of player data from replay
+         - k             : Number of players to return
+
+        @return
+         - Dictionary of the k most similar players to their similarity
+         - List of the same players sorted by similarity (ASC)
+
+        Every setting adds its weight less the weighted difference (see
+        the note above), which is the total of the weights less the weighted
+        sum of all the differences (a matrix-vector product).
+        '''
+        k = min(k, len(self.names))
+        if k == 0: return {}, []
+        vector = self.vector(player_object)
+
+        # Only score the rows that could be among the closest (see CameraTree)
+        if len(self.names) >= data.DATABASE_TREE_MIN:
+            candidates = self.tree.nearest(self.matrix, vector, k)
+        else:
+            candidates = np.arange(len(self.names))
+        similarities = CAMERA_TOTAL - np.abs(self.matrix[candidates] - vector) @ CAMERA_SCALES
+        rows = np.argpartition(similarities, len(candidates) - k)[len(candidates) - k:]
+        rows = rows[np.argsort(similarities[rows], kind="stable")]
+        similarities, rows = similarities[rows], candidates[rows]
+        sorted_keys = [self.names[row] for row in rows]
+        return dict(zip(sorted_keys, similarities.tolist())), sorted_keys
+
+# Shared by every Database object (see get_camera_matrix)
+camera_matrix = None
+camera_lock = threading.Lock() # Database objects are used from several threads at once (see run)
+
+def get_camera_matrix(db):
+    '''
+    @param
+     - db : Connected Database to load the matrix with if it isn't loaded
+
+    @return
+     - CameraMatrix shared by every Database object
+
+    camera_lock must be held while the matrix is used.
+    '''
+    global camera_matrix
+    if camera_matrix is None or time.monotonic() - camera_matrix.loaded > data.DATABASE_MATRIX_REFRESH:
+        camera_matrix = CameraMatrix.load(db)
+    return camera_matrix
+
+## CONNECTION POOL ##
+
+# Connections shared by every Database object (see get_pool)
+pool = None
+pool_lock = threading.Lock()
+
+# Every command runs its queries in here, off the event loop. There is a thread
+# for each connection in the pool, so a thread never waits for a connection.
+executor = ThreadPoolExecutor(max_workers=data.DATABASE_POOL_SIZE, thread_name_prefix="database")
+
+def get_pool():
+    '''
+    @return
+     - MySQLConnectionPool shared by every Database object
+
+    The pool opens all of its connections at once, so it is created on the
+    first connect() rather than on import, and the schema is brought up to
+    date before it is used (see migrations.py). If the database is offline
+    or a migration fails then it raises, and the next connect() tries again.
+    '''
+    global pool
+    with pool_lock:
+        if pool is None:
+            new_pool = mysql.connector.pooling.MySQLConnectionPool(
+                pool_name="rocket_league",
+                pool_size=data.DATABASE_POOL_SIZE,
+                pool_reset_session=False, # Resetting would throw away the prepared statements
+                **data.DATABASE_CONNECTION
+            )
+            con = new_pool.get_connection()
+            try:
+                migrations.migrate(con)
+            finally:
+                con.close()
+            pool = new_pool
+        return pool
+
+## PREPARED STATEMENTS ##
+
+def get_statements(con):
+    '''
+    @param
+     - con : PooledMySQLConnection borrowed from the pool
+
+    @return
+     - Dictionary of the statements prepared on the connection {query: cursor}
+
+    The statements are kept on the connection the pool holds on to (a new
+    PooledMySQLConnection wraps it on every get_connection()), so they are
+    only ever used by the thread that has borrowed it and go when it does.
+    A reconnect keeps the same connection object but opens a new session
+    (_cmysql in the C extension, _socket in pure Python) that has none of
+    the old statements, so they are thrown away when the session changes.
+    '''
+    cnx = con._cnx
+    session = getattr(cnx, "_cmysql", None) or getattr(cnx, "_socket", None)
+    cached = getattr(cnx, "gizmo_statements", None)
+    if cached is None or cached[0] is not session:
+        cached = cnx.gizmo_statements = (session, {})
+    return cached[1]
+
 ## DATABASE CLASS ##
 
 class Database(object):
@@ -23,6 +468,7 @@ class Database(object):
 
     def __init__(self):
         self.con = None
+        self.statements = None
 
     ''' UTILITY '''
 
@@ -30,25 +476,69 @@ class Database(object):
         '''
         @return
          - Boolean indicating if connection was successful
+
+        The connection is borrowed from the pool, which checks it is still
+        alive (the server drops connections that are idle for too long) and
+        reconnects it if not.
         '''
         
         try:
-            self.con = mysql.connector.connect(
-                host="localhost",
-                user="root",
-                password="",
-                database="rocket_league"
-            )
+            self.con = get_pool().get_connection()
+            self.statements = get_statements(self.con)
         except:
             print(" ! Database Offline")
+            if self.con is not None: self.close()
             return False
         return True
 
     def close(self):
         '''
         It is COMPULSORY to close the connection after use.
+        This hands the connection back to the pool.
         '''
-        self.con.close()
+        try:
+            # End the transaction the queries started, so the next command sees any new rows
+            self.con.rollback()
+        except:
+            # The connection has dropped, it is reconnected on its next use
+            print(" ! Database connection dropped")
+        finally:
+            # Always hand it back, otherwise the pool runs out of connections
+            try:
+                self.con.close()
+            except:
+                print(" ! Database connection not returned to the pool")
+            self.con = None
+
+    def prepare(self, query):
+        '''
+        @param
+         - query : String query with %s in place of each value
+
+        @return
+         - Cursor with the query prepared on the connection
+
+        The server keeps a prepared statement (and its plan) for as long as
+        the connection is open, so the cursor is kept for the next command
+        that uses the same connection. The query must always be the same
+        string (a literal), as the cursor only reuses the statement for it.
+        '''
+        if query not in self.statements:
+            self.statements[query] = self.con.cursor(prepared=True)
+        return self.statements[query]
+
+    def query(self, query, params=()):
+        '''
+        @param
+         - query  : String query with %s in place of each value
+         - params : Tuple of values for the query
+
+        @return
+         - List of the rows returned (empty for statements that return none)
+        '''
+        cursor = self.prepare(query)
+        cursor.execute(query, params)
+        return cursor.fetchall() if cursor.with_rows else []
 
     ''' QUERY '''
 
@@ -61,64 +551,6 @@ class Database(object):
          - List of relevant information (3 elements)
         '''
 
-        def to_percent(record, player_object):
-            '''
-            @param
-             - record        : Player information from database record
-             - player_object : Dictionary of player data from replay
-
-            @return
-             - Float representing the camera similarity
-
-            The equation here is completely arbitrary and just an
-            interpretation of how to calculate similarity.
-            '''
-
-            ''' 
-            Start at 0
-            for each relevant setting:
-                total_percentage += (weight - max(0, abs(setting1 - setting2) * normal_variance))
-
-            Broken down:
-            1: abs(setting1 - setting2) 
-                Gets the difference between the two values and makes sure its positive
-            2: X * normal_variance
-                This determines a normal variance for a setting (i.e. 1 is a big variance in terms of fov but not distance)
-                Thus with a difference of 1 in fov (109 vs 110) the percentage added to the total will be 10 out of a possible 15
-                And a difference of 2 would give 5/15 | 3 would give 0/15 | 4 would give 0/15
-            3: max(0, X)
-                Makes sure the added percentage is never less than 0
-                (There is a bug in here that makes negative similarities possible but it doesnt really matter)
-            4: weight - X
-                The weight just determines the importance of a setting (i.e. fov is more important than swivel speed etc.)
-
-            What can be improved?
-            1: The bug allowing for negative values is just an oversight where I have not specified that the maximum value 
-                should be equal to the weight (i.e. min(max(0,X), weight) )
-            2: The weight and normal_variance variables are arbitrarily decided on by me
-            3: There are certain values that are actually more important than normal
-                If the player in question has a steering sensitivity of 1.83 and a player in the database has the 
-                same steering sensitivity of 1.83 it makes them way more likely to be the same player. But the same 
-                cannot be said for someone with a steering sensitivity of 1.5 as this is far more common.
-            4: Some values have too much importance
-                People often have random swivel speeds across their accounts because it's an arbitrary setting 
-                and with the current formula, this could make someone's similarity go from 100% to 90% and stop 
-                them from showing up in the top 4. I do not know what the best solutions for these issues are.
-            '''
-            
-            total_percentage = 0
-            total_percentage = total_percentage + (15 - max(0, abs(player_object["camera"]["fov"] - record[5]) / 1 * 5))
-            total_percentage = total_percentage + (15 - max(0, abs(player_object["camera"]["distance"] - record[6]) / 10 * 5))
-            total_percentage = total_percentage + (15 - max(0, abs(player_object["camera"]["height"] - record[7]) / 10 * 5))
-            total_percentage = total_percentage + (15 - max(0, abs(abs(player_object["camera"]["pitch"]) - abs(record[8])) / 1 * 5))
-            total_percentage = total_percentage + (10 - max(0, abs(player_object["camera"]["stiffness"] - record[9]) * 10 * 2))
-            total_percentage = total_percentage + (10 - max(0, abs(player_object["camera"]["swivel_speed"] - record[10]) * 10 * 1))
-            total_percentage = total_percentage + (10 - max(0, abs(player_object["camera"]["transition_speed"] - record[11]) * 10 * 2))
-            total_percentage = total_percentage + (10 - max(0, abs(player_object["steering_sensitivity"] - record[12]) * 100 * 0.2))
-            return total_percentage
-            
-        # Create the cursor
-        cursor = self.con.cursor()
         identify_results = [None, None]
         flags_player_id = None
         player_original = None
@@ -128,11 +560,10 @@ class Database(object):
             "SELECT players.Name, accounts.Main, players.ID, players.Original "
             "FROM accounts "
             "INNER JOIN players ON accounts.PlayerID=players.ID "
-            f"WHERE accounts.Platform='{player_object['id']['platform']}' "
-            f"AND accounts.AccountID='{player_object['id']['id']}'"
+            "WHERE accounts.Platform=%s "
+            "AND accounts.AccountID=%s"
         )
-        cursor.execute(operation=query_does_player_exist)
-        results = cursor.fetchall()
+        results = self.query(query_does_player_exist, (player_object['id']['platform'], player_object['id']['id']))
         if len(results) > 0:
             identify_results[0] = results[0][0]
             identify_results[1] = results[0][1]
@@ -141,64 +572,23 @@ class Database(object):
 
         # Second query to get flags for the account
         flags = None
-        try:
+        if flags_player_id is not None:
             query_get_flags = (
                 "SELECT * FROM flags "
-                f"WHERE PlayerID = {flags_player_id}"
+                "WHERE PlayerID = %s"
             )
-            cursor.execute(operation=query_get_flags)
-            flags = cursor.fetchall()
+            flags = self.query(query_get_flags, (flags_player_id,))
             if len(flags) == 0: flags = None
-        except:
-            pass
         
-        # Third query to get all accounts for comparing
-        query_all_accounts = (
-            "SELECT accounts.*, players.Name, region.Code FROM accounts "
-            "INNER JOIN players ON accounts.PlayerID=players.ID "
-            "INNER JOIN region ON players.Region=region.ID "
-        )
-        cursor.execute(operation=query_all_accounts)
-        results = cursor.fetchall()
-
-        # Close cursor
-        cursor.close()
+        with camera_lock:
+            # Compare against the main account of every player (loaded on the first identify)
+            camera_matrix = get_camera_matrix(self)
 
-        if len(results) == 0: return [None, None, None, None, None, None]
+            if len(camera_matrix.names) == 0: return [None, None, None, None, None, None]
 
-        '''
-        [2] > AccountID
-        [3] > Platform
-        [4] > Main
-        [5:12] > Camera
-        [13] > Date
-        [14] > Player
-        [15] > Region
-        
-        for i in range(0,len(results[0])):
-            print(f"{i} > {results[0][i]}")
-        '''
-        
-        # Dictionary Creation
-        player_dict = {
-            results[i][4] == 1 and results[i][14] : results[i] for i in range(0,len(results))
-        }
-
-        # Convert to similarity percentages
-        player_dict_as_percentages = dict(
-            map(lambda item: (
-                    item[0], to_percent(item[1], player_object)
-                ),
-                player_dict.items()
-            )
-        )
+            # Similarity percentages of the closest players only, sorted by similarity (ASC)
+            player_dict_as_percentages, sorted_keys = camera_matrix.top(player_object, data.DATABASE_IDENTIFY_TOP)
         identify_results.append(player_dict_as_percentages)
-
-        # Sort dictionary by similarity (ASC)
-        sorted_keys = sorted(
-            player_dict_as_percentages,
-            key=player_dict_as_percentages.get
-        )
         identify_results.append(sorted_keys)
         identify_results.append(flags)
         identify_results.append(player_original)
@@ -217,7 +607,6 @@ class Database(object):
         '''
         if player == None: return None
         player = player.strip()
-        cursor = self.con.cursor()
 
         # Generate the query
         query = (
@@ -226,15 +615,11 @@ class Database(object):
             "FROM players "
             "INNER JOIN region ON players.Region=region.ID "
             "LEFT JOIN accounts ON players.ID=accounts.PlayerID "
-            f"WHERE UPPER(players.Name) LIKE UPPER('{player}%') "
+            "WHERE players.NameKey LIKE CONCAT(UPPER(%s), '%') "
             "ORDER BY players.Name ASC, accounts.Main DESC, "
             "accounts.Platform DESC"
         )
-        cursor.execute(operation=query)
-        results = cursor.fetchall()
-        
-        # Close cursor
-        cursor.close()
+        results = self.query(query, (player,))
         
         return results if len(results) > 0 else None
 
@@ -249,52 +634,60 @@ class Database(object):
         '''
         if player == None: return False
         player = player.strip()
-        cursor = self.con.cursor()
         
         # Get player object
         player_object, date_updated = scraping.get_player_object(account)
 
         # Does player exist (not account)
         player_exists = True
-        query_get_player_id = f"SELECT ID FROM players WHERE UPPER(Name) = UPPER('{player}')"
-        cursor.execute(operation=query_get_player_id)
-        player_id = cursor.fetchall()
+        query_get_player_id = "SELECT ID FROM players WHERE NameKey = UPPER(%s)"
+        player_id = self.query(query_get_player_id, (player,))
         if player_id != None and len(player_id) != 0:
             player_id = player_id[0][0]
         else:
             # Create new player record
-            query_create_player = f"INSERT INTO players (Name) VALUES ('{player}')"
-            cursor.execute(operation=query_create_player)
-            cursor.execute(operation=query_get_player_id)
-            player_id = cursor.fetchall()[0][0]
+            query_create_player = "INSERT INTO players (Name) VALUES (%s)"
+            self.query(query_create_player, (player,))
+            player_id = self.query(query_get_player_id, (player,))[0][0]
             player_exists = False
         
         # INSERT INTO accounts
         camera = player_object['camera']
-        fields = (
-            "PlayerID, AccountID, Platform, "
+        query_create_account = (
+            "INSERT INTO accounts (PlayerID, AccountID, Platform, "
             "Main, FOV, Distance, Height, Angle, Stiffness, "
             "SwivelSpeed, TransitionSpeed, "
-            "SteeringSensitivity, DateUpdated"
-        )
-        values = (
-            f"{player_id}, '{player_object['id']['id']}', "
-            f"'{player_object['id']['platform']}', "
-            f"{0 if player_exists else 1}, "
-            f"{camera['fov']}, {camera['distance']}, "
-            f"{camera['height']}, {camera['pitch']}, "
-            f"{camera['stiffness']}, {camera['swivel_speed']}, "
-            f"{camera['transition_speed']}, "
-            f"{player_object['steering_sensitivity']}, '{date_updated}'"
-        )
-        query_create_account = (
-            f"INSERT INTO accounts ({fields}) VALUES ({values})"
+            "SteeringSensitivity, DateUpdated) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
         )
-        cursor.execute(operation=query_create_account)
-
-        # Commit and close
-        cursor.close()
+        self.query(query_create_account, (
+            player_id, player_object['id']['id'],
+            player_object['id']['platform'],
+            0 if player_exists else 1,
+            camera['fov'], camera['distance'],
+            camera['height'], camera['pitch'],
+            camera['stiffness'], camera['swivel_speed'],
+            camera['transition_speed'],
+            player_object['steering_sensitivity'], date_updated
+        ))
+
+        # Commit
         self.con.commit()
+
+        # identify() only compares players with a region (see CameraMatrix.load), so the same goes for the matrix
+        has_region = False
+        if not player_exists:
+            query_has_region = (
+                "SELECT players.ID FROM players "
+                "INNER JOIN region ON players.Region=region.ID "
+                "WHERE players.ID = %s"
+            )
+            has_region = len(self.query(query_has_region, (player_id,))) > 0
+
+        with camera_lock:
+            # A new player's account is their main, so it is compared in identify() from now on
+            if camera_matrix is not None and has_region:
+                camera_matrix.insert(player, player_object)
         return True
     
     def flag(self, player):
@@ -308,33 +701,27 @@ class Database(object):
         '''
         if player == None: return False, None
         player = player.strip()
-        cursor = self.con.cursor()
 
         # Does player exist (not account)
-        query_get_player_id = f"SELECT ID FROM players WHERE UPPER(Name) = UPPER('{player}')"
-        cursor.execute(operation=query_get_player_id)
-        player_id = cursor.fetchall()
+        query_get_player_id = "SELECT ID FROM players WHERE NameKey = UPPER(%s)"
+        player_id = self.query(query_get_player_id, (player,))
         if player_id != None and len(player_id) != 0:
             player_id = player_id[0][0]
         else:
             # Player doesn't exist: return false
-            cursor.close()
             return False, 0
             
         # Already in flag table?
-        query_get_id_from_player_id = f"SELECT ID FROM flags WHERE PlayerID = {player_id}"
-        cursor.execute(operation=query_get_id_from_player_id)
-        flag_id = cursor.fetchall()
+        query_get_id_from_player_id = "SELECT ID FROM flags WHERE PlayerID = %s"
+        flag_id = self.query(query_get_id_from_player_id, (player_id,))
         if flag_id != None and len(flag_id) != 0: # Player already in flag table
-            cursor.close()
             return False, player_id
         else:
             # Add the player to the flag table
-            query_create_player = f"INSERT INTO flags (PlayerID) VALUES ('{player_id}')"
-            cursor.execute(operation=query_create_player)
+            query_create_player = "INSERT INTO flags (PlayerID) VALUES (%s)"
+            self.query(query_create_player, (player_id,))
 
-        # Commit and close
-        cursor.close()
+        # Commit
         self.con.commit()
         return True, player_id
 
@@ -342,18 +729,17 @@ class Database(object):
         '''
         @return
          - Boolean indicating if/when reconditioning successful
+
+        The updates are written data.DATABASE_BATCH_SIZE accounts at a time
+        (see update_accounts).
         '''
-        
-        # Create cursor
-        cursor = self.con.cursor()
 
         # Query to get all the accounts
-        query_all_accounts = f"SELECT Platform, AccountID FROM accounts"
-        cursor.execute(operation=query_all_accounts)
-        results = cursor.fetchall()
-        cursor.close()
+        query_all_accounts = "SELECT Platform, AccountID FROM accounts"
+        results = self.query(query_all_accounts)
         
         print(f" - Number to recondition: {len(results)}")
+        updates = []
         for i in range(0, len(results)):
             if i % (len(results)/10) == 0:
                 print(f" - {int(i / len(results) * 100)}%")
@@ -363,11 +749,15 @@ class Database(object):
             except:
                 print(f" ! get_player_object {results[i][0]}:{results[i][1]}")
                 continue
-            response = self.update_account(player_object, date_updated)
-            if response:
-                print(f" - {i}  {results[i][0]}:{results[i][1]}")
-            else:
+            if player_object is None:
                 print(f" ! update_account {results[i][0]}:{results[i][1]}")
+                continue
+            updates.append((player_object, date_updated))
+            print(f" - {i}  {results[i][0]}:{results[i][1]}")
+            if len(updates) == data.DATABASE_BATCH_SIZE:
+                self.update_accounts(updates)
+                updates = []
+        self.update_accounts(updates)
 
         print(f" - 100%")
         return True
@@ -383,25 +773,80 @@ class Database(object):
         '''
 
         if player_object == None: return False
-        cursor = self.con.cursor()
+        return self.update_accounts([(player_object, date_updated)])
+
+    def update_accounts(self, updates):
+        '''
+        @param
+         - updates : List of tuples (player_object, date_updated) as for update_account
+         
+        @return
+         - Boolean indicating if update was successful
+
+        Every account is updated by the same prepared statement in one
+        transaction.
+        '''
+
+        if len(updates) == 0: return True
 
         # Query to update account with the new information gained
-        camera = player_object['camera']
         query_update_account = (
-            f"UPDATE accounts "
-            f"SET FOV='{camera['fov']}', Distance='{camera['distance']}', "
-            f"Height='{camera['height']}', "
-            f"Angle='{camera['pitch']}', Stiffness='{camera['stiffness']}', "
-            f"SwivelSpeed='{camera['swivel_speed']}', "
-            f"TransitionSpeed='{camera['transition_speed']}', "
-            f"SteeringSensitivity='{player_object['steering_sensitivity']}', "
-            f"DateUpdated='{date_updated}' "
-            f"WHERE Platform='{player_object['id']['platform']}' "
-            f"AND AccountID='{player_object['id']['id']}'"
+            "UPDATE accounts "
+            "SET FOV=%s, Distance=%s, "
+            "Height=%s, "
+            "Angle=%s, Stiffness=%s, "
+            "SwivelSpeed=%s, "
+            "TransitionSpeed=%s, "
+            "SteeringSensitivity=%s, "
+            "DateUpdated=%s "
+            "WHERE Platform=%s "
+            "AND AccountID=%s"
         )
-        cursor.execute(operation=query_update_account)
+        self.prepare(query_update_account).executemany(query_update_account, [(
+            player_object['camera']['fov'], player_object['camera']['distance'],
+            player_object['camera']['height'],
+            player_object['camera']['pitch'], player_object['camera']['stiffness'],
+            player_object['camera']['swivel_speed'],
+            player_object['camera']['transition_speed'],
+            player_object['steering_sensitivity'],
+            date_updated,
+            player_object['id']['platform'],
+            player_object['id']['id']
+        ) for player_object, date_updated in updates])
     
-        # Commit and close
-        cursor.close()
+        # Commit
         self.con.commit()
+
+        with camera_lock:
+            # Keep identify() comparing against the new settings
+            if camera_matrix is not None:
+                for player_object, date_updated in updates:
+                    camera_matrix.update(player_object)
         return True
+
+
+## ASYNC INTERFACE ##
+
+async def run(method, *args):
+    '''
+    @param
+     - method : Method of the Database class to run (e.g. Database.get)
+     - args   : Arguments for the method
+
+    @return
+     - Boolean indicating if the database was online
+     - Result of the method (None if the database was offline)
+
+    Connects, runs the method and closes again in the database executor,
+    so that the queries don't hold up the event loop.
+    '''
+
+    def run_in_thread():
+        db = Database()
+        if not db.connect(): return False, None
+        try:
+            return True, method(db, *args)
+        finally:
+            db.close()
+
+    return await asyncio.get_running_loop().run_in_executor(executor, run_in_thread)
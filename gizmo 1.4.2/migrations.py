@@ -0,0 +1,113 @@
+''' 
+
+Author: Kian Mortimer
+Date: 18/10/26
+
+Description:
+Versioned changes to the schema of the local database.
+
+'''
+
+
+# IMPORTS
+import mysql.connector
+from mysql.connector import errorcode
+
+
+## MIGRATIONS ##
+
+'''
+Each migration is (version, description, statement) and is applied once,
+in order, with the version recorded in the schema_version table.
+A migration makes a single change (one column or one index) so that it
+either applies in full or not at all, and once released it must never be
+changed (add another).
+'''
+MIGRATIONS = [
+    (
+        1, "Index accounts by platform and id (identify, update_account)",
+        # Not unique: set() never checked for an existing account, so there may be duplicates
+        "ALTER TABLE accounts ADD INDEX accounts_platform_id (Platform, AccountID)"
+    ),
+    (
+        2, "Index accounts by player, mains first (get, the camera matrix)",
+        "ALTER TABLE accounts ADD INDEX accounts_player_main (PlayerID, Main)"
+    ),
+    (
+        3, "Index flags by player (identify, flag)",
+        "ALTER TABLE flags ADD INDEX flags_player (PlayerID)"
+    ),
+    (
+        4, "Upper case copy of player names for case-insensitive lookups and prefix search (get, set, flag)",
+        "ALTER TABLE players ADD COLUMN NameKey VARCHAR(255) AS (UPPER(Name)) STORED"
+    ),
+    (
+        5, "Index players by the upper case copy of their name",
+        "ALTER TABLE players ADD INDEX players_name_key (NameKey)"
+    )
+]
+
+'''
+MySQL commits an ALTER TABLE by itself, before the version is recorded, so
+a run that stops in between (or an index added by hand) leaves a change in
+place that the schema_version table doesn't know about. Running it again
+fails with one of these, which means the change is already there.
+'''
+ALREADY_APPLIED = [
+    errorcode.ER_DUP_FIELDNAME, # Duplicate column name
+    errorcode.ER_DUP_KEYNAME    # Duplicate key name
+]
+
+def current_version(con):
+    '''
+    @param
+     - con : Connection to the database
+
+    @return
+     - Int version of the schema (0 before any migrations)
+    '''
+    cursor = con.cursor()
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "Version INT PRIMARY KEY, "
+        "Description VARCHAR(255) NOT NULL, "
+        "DateApplied DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    )
+    cursor.execute("SELECT MAX(Version) FROM schema_version")
+    version = cursor.fetchall()[0][0]
+    cursor.close()
+    return version if version is not None else 0
+
+def migrate(con):
+    '''
+    @param
+     - con : Connection to the database
+
+    @return
+     - Int version of the schema once migrated
+
+    Raises the error of a migration that fails, leaving the schema at the
+    version before it. The queries in database.py expect the latest
+    version, so the database counts as offline until it is fixed.
+    '''
+    version = current_version(con)
+    cursor = con.cursor()
+    for migration_version, description, statement in MIGRATIONS:
+        if migration_version <= version: continue
+        print(f" - Migration {migration_version}: {description}")
+        try:
+            cursor.execute(statement)
+        except Exception as e:
+            if not isinstance(e, mysql.connector.Error) or e.errno not in ALREADY_APPLIED:
+                print(f" ! Migration {migration_version} failed")
+                cursor.close()
+                raise
+            print(f" - Migration {migration_version} was already applied")
+        cursor.execute(
+            "INSERT INTO schema_version (Version, Description) VALUES (%s, %s)",
+            (migration_version, description)
+        )
+        con.commit()
+        version = migration_version
+    cursor.close()
+    return version
@@ -61,10 +61,9 @@ async def command_info(ctx, target):
 
     # Identify player through database
     identify_results = [None, None, None, None, None, None]
-    db = database.Database()
-    if db.connect():
-        identify_results = db.identify(player_object)
-        db.close()
+    online, results = await database.run(database.Database.identify, player_object)
+    if online:
+        identify_results = results
 
     # Format results from database query
     player_verification = ""
@@ -74,9 +73,9 @@ async def command_info(ctx, target):
     player_original = f"\n`AKA: {identify_results[5]}`" if identify_results[5] is not None else ''
     camera_similarity_full = ""
     if identify_results[3] is not None:
-        if platform_player_id in data.ANONYMISE:
+        if platform_player_id in data.ANONYMISE and "joryx" in identify_results[3]:
             identify_results[3].remove("joryx")
-        for i in range(1,5):
+        for i in range(1, min(5, len(identify_results[3]) + 1)):
             pcnt_padded = f"{identify_results[2][identify_results[3][-i]]:.0f}% ".ljust(7, ' ')
             name_padded = f" {identify_results[3][-i]}".ljust(10, ' ')
             camera_similarity_full = f"{camera_similarity_full}\n`{pcnt_padded}{name_padded}`"
@@ -0,0 +1,118 @@
+'''
+
+Author: Kian Mortimer
+Date: 18/10/26
+
+Description:
+Checks that the camera matrix (and its KD-tree) finds the same closest
+players as scoring every main account one by one, as identify() used to.
+
+Usage: python -m pytest test_camera_matrix.py
+
+'''
+
+
+# IMPORTS
+import random
+import sys
+import types
+import numpy as np
+
+import data
+# scraping connects to ballchasing.com when imported, and is only used by set() and recondition()
+sys.modules.setdefault("scraping", types.ModuleType("scraping"))
+import database
+
+SETTINGS = ("fov", "distance", "height", "pitch", "stiffness", "swivel_speed", "transition_speed")
+
+def random_player_object(rng, account_id):
+    '''
+    @param
+     - rng        : random.Random to draw the settings from
+     - account_id : String id of the account
+
+    @return
+     - Dictionary of player data in the format of a replay
+    '''
+    camera = {
+        "fov": rng.randint(100, 110), "distance": rng.choice(range(240, 290, 10)),
+        "height": rng.choice(range(90, 120, 10)), "pitch": rng.randint(-5, -2),
+        "stiffness": round(rng.random(), 2), "swivel_speed": round(rng.uniform(1, 10), 1),
+        "transition_speed": round(rng.uniform(1, 2), 1)
+    }
+    return {"id": {"platform": "steam", "id": account_id}, "camera": camera, "steering_sensitivity": round(rng.uniform(1, 2.5), 2)}
+
+def similarity(player_object, other):
+    '''
+    @param
+     - player_object : Dictionary of player data of the target
+     - other         : Dictionary of player data of a main account
+
+    @return
+     - Float similarity of the two, one setting at a time (see the note in database.py)
+    '''
+    values = [player_object["camera"][s] for s in SETTINGS] + [player_object["steering_sensitivity"]]
+    others = [other["camera"][s] for s in SETTINGS] + [other["steering_sensitivity"]]
+    values[3], others[3] = abs(values[3]), abs(others[3])
+    total = 0
+    for weight, scale, value, other_value in zip(database.CAMERA_WEIGHTS, database.CAMERA_SCALES, values, others):
+        total += weight - max(0, abs(value - other_value) * scale)
+    return float(total)
+
+def brute_force(players, player_object, k):
+    '''
+    @return
+     - List of the k highest similarities to the target, highest first
+    '''
+    return sorted((similarity(player_object, other) for other in players.values()), reverse=True)[:k]
+
+def check_top(camera_matrix, players, rng, k=5, targets=50):
+    for i in range(targets):
+        target = random_player_object(rng, f"target {i}")
+        percentages, sorted_keys = camera_matrix.top(target, k)
+        # Sorted ASC, and each similarity is the player's own
+        assert sorted_keys == sorted(sorted_keys, key=percentages.get)
+        for name in sorted_keys:
+            assert abs(percentages[name] - similarity(target, players[name])) < 1e-3
+        # The same similarities as scoring every player (names may differ on ties)
+        assert np.allclose(sorted(percentages.values(), reverse=True), brute_force(players, target, k), atol=1e-3)
+
+def build(players):
+    camera_matrix = database.CameraMatrix()
+    camera_matrix.names = list(players)
+    camera_matrix.players = {name: row for row, name in enumerate(players)}
+    camera_matrix.matrix = np.array([database.CameraMatrix.vector(p) for p in players.values()], dtype=np.float32)
+    camera_matrix.tree = database.CameraTree.build(camera_matrix.matrix)
+    for row, player_object in enumerate(players.values()):
+        camera_matrix.accounts[(player_object["id"]["platform"], player_object["id"]["id"])] = row
+    return camera_matrix
+
+def test_tree_matches_brute_force(monkeypatch):
+    rng = random.Random(1)
+    players = {f"p{i}": random_player_object(rng, str(i)) for i in range(3000)}
+    camera_matrix = build(players)
+    for tree_min in (0, len(players) + 1): # With and without the tree
+        monkeypatch.setattr(data, "DATABASE_TREE_MIN", tree_min)
+        check_top(camera_matrix, players, rng)
+
+def test_tree_matches_brute_force_after_changes(monkeypatch):
+    monkeypatch.setattr(data, "DATABASE_TREE_MIN", 0)
+    rng = random.Random(2)
+    players = {f"p{i}": random_player_object(rng, str(i)) for i in range(1000)}
+    camera_matrix = build(players)
+
+    # New players (enough to split leaves) and changed settings of existing ones
+    for i in range(1000, 1500):
+        players[f"p{i}"] = random_player_object(rng, str(i))
+        camera_matrix.insert(f"p{i}", players[f"p{i}"])
+    for i in rng.sample(range(1500), 300):
+        players[f"p{i}"] = random_player_object(rng, str(i))
+        camera_matrix.update(players[f"p{i}"])
+    check_top(camera_matrix, players, rng)
+
+def test_top_with_fewer_players_than_k():
+    rng = random.Random(3)
+    players = {f"p{i}": random_player_object(rng, str(i)) for i in range(3)}
+    percentages, sorted_keys = build(players).top(random_player_object(rng, "target"), 5)
+    assert sorted(sorted_keys) == sorted(players)
+    assert database.CameraMatrix().top(random_player_object(rng, "target"), 5) == ({}, [])
@@ -0,0 +1,114 @@
+'''
+
+Author: Kian Mortimer
+Date: 18/10/26
+
+Description:
+Checks the bookkeeping of migrations.migrate() with a stand-in connection
+that records the statements instead of running them. The statements
+themselves still need running against a real MySQL server (see
+benchmark_database.py).
+
+Usage: python -m pytest test_migrations.py
+
+'''
+
+
+# IMPORTS
+import mysql.connector
+from mysql.connector import errorcode
+import pytest
+
+import migrations
+
+class Connection(object):
+    '''
+    Stand-in for a MySQL connection, keeping the schema_version table in a list
+     - fail : {statement: errno} of the statements that fail
+    '''
+
+    def __init__(self, fail=None):
+        self.fail = fail or {}
+        self.versions = []                                  # Versions recorded in schema_version
+        self.applied = []                                   # ALTER TABLE statements run
+        self.commits = 0
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+class Cursor(object):
+
+    def __init__(self, con):
+        self.con = con
+        self.rows = []
+
+    def execute(self, statement, params=()):
+        if statement in self.con.fail:
+            raise mysql.connector.Error(errno=self.con.fail[statement])
+        if statement.startswith("SELECT MAX(Version)"):
+            self.rows = [(max(self.con.versions) if self.con.versions else None,)]
+        elif statement.startswith("INSERT INTO schema_version"):
+            self.con.versions.append(params[0])
+        elif statement.startswith("ALTER TABLE"):
+            self.con.applied.append(statement)
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+LATEST = migrations.MIGRATIONS[-1][0]
+
+def statement(version):
+    return next(s for v, _, s in migrations.MIGRATIONS if v == version)
+
+def test_versions_are_in_order():
+    versions = [version for version, _, _ in migrations.MIGRATIONS]
+    assert versions == list(range(1, len(versions) + 1))
+
+def test_migrates_from_nothing_once():
+    con = Connection()
+    assert migrations.migrate(con) == LATEST
+    assert con.versions == list(range(1, LATEST + 1))
+    assert con.applied == [s for _, _, s in migrations.MIGRATIONS]
+
+    # Nothing left to do the second time
+    assert migrations.migrate(con) == LATEST
+    assert con.versions == list(range(1, LATEST + 1))
+    assert len(con.applied) == LATEST
+
+def test_change_already_in_place_is_recorded():
+    con = Connection(fail={statement(1): errorcode.ER_DUP_KEYNAME, statement(4): errorcode.ER_DUP_FIELDNAME})
+    assert migrations.migrate(con) == LATEST
+    assert con.versions == list(range(1, LATEST + 1))
+
+def test_failure_stops_at_the_version_before():
+    con = Connection(fail={statement(3): errorcode.ER_NO_SUCH_TABLE})
+    with pytest.raises(mysql.connector.Error):
+        migrations.migrate(con)
+    assert con.versions == [1, 2]
+
+    # Carries on from there once fixed
+    con.fail = {}
+    assert migrations.migrate(con) == LATEST
+    assert con.versions == list(range(1, LATEST + 1))
+    assert con.applied.count(statement(1)) == 1
+
+def test_other_errors_are_raised():
+    class Broken(Connection):
+        def cursor(self):
+            cursor = Cursor(self)
+            execute = cursor.execute
+            def fail_alter(statement, params=()):
+                if statement.startswith("ALTER TABLE"): raise RuntimeError("lost connection")
+                execute(statement, params)
+            cursor.execute = fail_alter
+            return cursor
+    con = Broken()
+    with pytest.raises(RuntimeError):
+        migrations.migrate(con)
+    assert con.versions == []
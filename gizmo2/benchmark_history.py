@@ -0,0 +1,234 @@
+'''
+Author: Kian Mortimer
+Date: 18/10/26
+
+Description:
+Benchmark for the /deep history aggregation (history.History)
+Builds synthetic replay histories of increasing size, checks that History
+produces the same stats as the original list based aggregation, and times both.
+Also checks the duplicate check with copies of matches uploaded out of order.
+
+Usage: python benchmark_history.py [largest size]
+With linear aggregation the time per replay stays flat as the history doubles,
+whereas the original grows with the size of the history. The benchmark fails
+if the time of History grows clearly faster than the size (see check_linear).
+'''
+
+# IMPORTS
+import math
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+import pytz
+
+# MY IMPORTS
+from history import History
+
+TARGET = "steam:76561198000000000"
+
+''' Build a history of n replays (newest first) in the format of a deep=False search '''
+def synthetic_replays(n: int, seed: int = 0) -> list:
+    rnd = random.Random(seed)
+    platform, player_id = TARGET.split(":")
+
+    # Grinders meet a lot of different people, and a few regulars very often
+    pool = [f"epic:{i}" for i in range(max(50, n * 2))]
+    regulars = pool[:20]
+    names = {i: [f"{i[5:]}_{k}" for k in range(rnd.randint(1, 4))] for i in pool}
+    pros = set(rnd.sample(pool, len(pool) // 100))
+    aliases = ["target", "target", "target", "alias", "smurf"]
+
+    def member(account):
+        player = {"id": {"platform": account.split(":")[0], "id": account.split(":")[1]}, "name": rnd.choice(names[account])}
+        if account in pros: player["pro"] = True
+        return player
+
+    date = datetime(2020, 1, 1)
+    replays = []
+    for i in range(n):
+        date = date + timedelta(seconds=rnd.randint(240, 3600))
+        size = rnd.choice([1, 2, 3])
+        others = rnd.sample(pool, size * 2 - 1)
+        if size > 1 and rnd.random() < 0.5: others[0] = rnd.choice(regulars)
+        blue = [{"id": {"platform": platform, "id": player_id}, "name": rnd.choice(aliases)}] + [member(a) for a in others[:size - 1]]
+        orange = [member(a) for a in others[size - 1:]]
+        replays.append({
+            "id": f"replay-{i}",
+            "date": date.isoformat() + "+10:00",
+            "created": (date + timedelta(hours=1)).isoformat() + "Z",
+            "blue": {"players": blue},
+            "orange": {"players": orange}
+        })
+    return replays[::-1]
+
+''' The duplicate check as it was originally written (only compares consecutive replays) '''
+def is_same_time(x, y) -> bool:
+    if x is None or y is None:
+        return False
+    tz = pytz.timezone("Australia/Melbourne")
+    x = datetime.fromisoformat(x.removesuffix("Z"))
+    y = datetime.fromisoformat(y.removesuffix("Z"))
+    if x.tzinfo is None or x.tzinfo.utcoffset(x) is None:
+        x = tz.localize(x)
+    if y.tzinfo is None or y.tzinfo.utcoffset(y) is None:
+        y = tz.localize(y)
+    return abs((x-y).total_seconds()) < 60
+
+''' The aggregation as it was originally written in Player.update_history (lists of names) '''
+def reference_aggregates(replays: list) -> dict:
+    player_id = TARGET.split(":")[1]
+    names_time, team_names_raw, team_pro, opp_names_raw, opp_pro = {}, {}, {}, {}, {}
+    state = {"is_pro": False, "replay_count": 0}
+
+    def iter_teams(replay, colour):
+        is_player_team = False
+        team_members = []
+        for player in replay[colour]['players']:
+            team_members.append((f"{player['id']['platform']}:{player['id']['id']}", player['name'], True if "pro" in player.keys() else False))
+            if player['id']['id'] == player_id:
+                names_time[replay['date']] = player['name']
+                if not state["is_pro"]: state["is_pro"] = True if "pro" in player.keys() else False
+                is_player_team = True
+        raw, pros = (team_names_raw, team_pro) if is_player_team else (opp_names_raw, opp_pro)
+        for i in range(0, len(replay[colour]['players'])):
+            if is_player_team and team_members[i][0] == TARGET: continue
+            name_list = []
+            pro = True if team_members[i][2] else False
+            if team_members[i][0] in raw.keys():
+                name_list = raw[team_members[i][0]]
+                pro = True if pro or pros[team_members[i][0]] else False
+            raw[team_members[i][0]] = name_list + [team_members[i][1]]
+            pros[team_members[i][0]] = pro
+
+    last_replay_date = None
+    for replay in replays:
+        if is_same_time(last_replay_date, replay['date']): continue
+        last_replay_date = replay['date']
+        state["replay_count"] += 1
+        iter_teams(replay, "blue")
+        iter_teams(replay, "orange")
+
+    names_time = dict(sorted(names_time.items(), key=lambda i: i, reverse=False))
+    return {
+        "replay_count": state["replay_count"],
+        "names_time": names_time,
+        "names_count": dict(sorted( {i: list(names_time.values()).count(i) for i in names_time.values()}.items(), key=lambda i: i[1], reverse=True)),
+        "is_pro": state["is_pro"],
+        "team_names": { i: max(set(team_names_raw[i]), key=list(team_names_raw[i]).count) for i in team_names_raw.keys()},
+        "team_count": dict(sorted( {i: len(list(team_names_raw[i])) for i in team_names_raw.keys()}.items(), key=lambda i: i[1], reverse=True)),
+        "team_pro": team_pro,
+        "opp_names": { i: max(set(opp_names_raw[i]), key=list(opp_names_raw[i]).count) for i in opp_names_raw.keys()},
+        "opp_count": dict(sorted( {i: len(list(opp_names_raw[i])) for i in opp_names_raw.keys()}.items(), key=lambda i: i[1], reverse=True)),
+        "opp_pro": opp_pro,
+        # Needed to check the popular names, as ties can be broken either way
+        "team_names_raw": team_names_raw,
+        "opp_names_raw": opp_names_raw
+    }
+
+''' Aggregate with history.History '''
+def history_aggregates(replays: list) -> dict:
+    history = History(TARGET)
+    for replay in replays:
+        history.add_replay(replay)
+    return history.aggregates()
+
+''' Raise an AssertionError if History disagrees with the original aggregation '''
+def check_same(expected: dict, actual: dict) -> None:
+    for key in ["replay_count", "names_time", "names_count", "is_pro", "team_count", "team_pro", "opp_count", "opp_pro"]:
+        assert expected[key] == actual[key], f"{key} differs"
+        if isinstance(expected[key], dict):
+            assert list(expected[key]) == list(actual[key]), f"{key} is ordered differently"
+    # The most popular name must be one of the most used names (the original breaks ties arbitrarily)
+    for names, raw in [("team_names", "team_names_raw"), ("opp_names", "opp_names_raw")]:
+        assert expected[names].keys() == actual[names].keys(), f"{names} differs"
+        for i, name in actual[names].items():
+            assert expected[raw][i].count(name) == max(expected[raw][i].count(n) for n in expected[raw][i]), f"{names} differs for {i}"
+
+''' Raise an AssertionError if History miscounts matches uploaded more than once '''
+def check_duplicates(n: int = 2000, seed: int = 0) -> None:
+    '''
+    Every third match gets one or two more copies (as if from other
+    uploaders) a few seconds either side, interleaved at random with the
+    rest, and some matches get a different match close behind them with one
+    player swapped. Each match must be counted once, and the close matches
+    with different players must still count on their own.
+    '''
+    rnd = random.Random(seed)
+    matches = synthetic_replays(n, seed)
+
+    distinct = []
+    for i, replay in enumerate(matches[::7]):
+        close = {**replay, "id": f"close-{i}", "orange": {"players": list(replay["orange"]["players"])}}
+        close["date"] = (datetime.fromisoformat(replay["date"]) + timedelta(seconds=rnd.randint(1, 30))).isoformat()
+        close["orange"]["players"][0] = {"id": {"platform": "epic", "id": f"swapped-{i}"}, "name": f"swapped_{i}"}
+        distinct.append(close)
+
+    copies = []
+    for i, replay in enumerate(matches[::3]):
+        for k in range(rnd.randint(1, 2)):
+            copy = {**replay, "id": f"copy-{i}-{k}"}
+            copy["date"] = (datetime.fromisoformat(replay["date"]) + timedelta(seconds=rnd.randint(-25, 25))).isoformat()
+            copies.append(copy)
+
+    uploads = matches + distinct + copies
+    rnd.shuffle(uploads)
+    actual = history_aggregates(uploads)
+    expected = history_aggregates(matches + distinct)
+    for key in ["replay_count", "names_count", "team_count", "opp_count"]:
+        assert expected[key] == actual[key], f"{key} differs with duplicates"
+    assert actual["replay_count"] == len(matches) + len(distinct), "replay_count differs with duplicates"
+    # The original only compared neighbours, so it counts most of the copies
+    print(f"{len(matches)} matches, {len(distinct)} close but different, {len(copies)} copies interleaved: "
+          f"History counted {actual['replay_count']}, the original {reference_aggregates(uploads)['replay_count']}")
+
+''' Time a function, returning (seconds, result) '''
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+''' Time a function a few times, returning (fastest seconds, result), as one run can be held up by anything '''
+def best_of(repeats: int, func, *args):
+    runs = [timed(func, *args) for _ in range(repeats)]
+    return min(run[0] for run in runs), runs[0][1]
+
+''' Raise an AssertionError if the time grows clearly faster than the size '''
+def check_linear(timings: dict, limit: float = 1.3) -> float:
+    '''
+    timings is {size: seconds}. The growth is the slope of log(time) against
+    log(size) between the smallest and largest sizes: 1 is linear time and
+    2 quadratic (like the original), so the limit leaves room for noise and
+    the garbage collector but not for anything worse than linear.
+    '''
+    smallest, largest = min(timings), max(timings)
+    growth = math.log(timings[largest] / timings[smallest]) / math.log(largest / smallest)
+    assert growth < limit, f"time grows as size^{growth:.2f} from {smallest} to {largest} replays"
+    return growth
+
+
+# MAIN
+if __name__ == '__main__':
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 64000
+    reference_limit = 8000 # The original is too slow to be worth timing beyond this
+
+    print(f"{'replays':>8} {'History':>10} {'per replay':>11} {'original':>10} {'per replay':>11}")
+    size = 1000
+    timings = {}
+    while size <= largest:
+        replays = synthetic_replays(size)
+        history_time, actual = best_of(3, history_aggregates, replays)
+        timings[size] = history_time
+        line = f"{size:>8} {history_time:>9.3f}s {history_time / size * 1e6:>9.1f}us"
+        if size <= reference_limit:
+            reference_time, expected = timed(reference_aggregates, replays)
+            check_same(expected, actual)
+            line += f" {reference_time:>9.3f}s {reference_time / size * 1e6:>9.1f}us"
+        print(line)
+        size *= 2
+    print("Results match the original aggregation")
+    if len(timings) > 1:
+        print(f"History time grows as size^{check_linear(timings):.2f} (linear is 1)")
+
+    check_duplicates()
+    print("Interleaved duplicates are counted once")
@@ -0,0 +1,91 @@
+'''
+Author: Kian Mortimer
+Date: 18/10/26
+
+Description:
+A small persistent cache on local disk (SQLite)
+Used to remember lookups between commands and restarts
+'''
+
+# IMPORTS
+import sqlite3
+import json
+import time
+import threading
+
+# MY IMPORTS
+import config
+
+# Returned by get() when there is no entry, as None is a valid (negative) cached value
+MISSING = object()
+
+class Cache():
+    '''
+    Key/value store where every entry belongs to a namespace and has its own expiry
+    Values are stored as JSON, so they must be made of dicts, lists, strings, numbers and None
+    '''
+    def __init__(self, path: str) -> None:
+        # The lookups run in worker threads, so the connection is shared behind a lock
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.con.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "namespace TEXT NOT NULL, "
+                "key TEXT NOT NULL, "
+                "value TEXT, "
+                "expires REAL, " # NULL never expires
+                "PRIMARY KEY (namespace, key))"
+            )
+            # Clear out anything that expired while the bot was offline
+            self.con.execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+            self.con.commit()
+
+    ''' Get a cached value, or the default if it is missing or expired '''
+    def get(self, namespace: str, key: str, default=None):
+        with self.lock:
+            row = self.con.execute(
+                "SELECT value, expires FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return default
+        return json.loads(row[0])
+
+    ''' Cache a value for ttl seconds (None to keep it until it is replaced) '''
+    def set(self, namespace: str, key: str, value, ttl: float | None) -> None:
+        expires = None if ttl is None else time.time() + ttl
+        with self.lock:
+            self.con.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), expires)
+            )
+            self.con.commit()
+
+    ''' Remove a cached value '''
+    def delete(self, namespace: str, key: str) -> None:
+        with self.lock:
+            self.con.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+            self.con.commit()
+
+
+## Module interface ##
+# The cache is opened on first use rather than on import
+_cache: Cache = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> Cache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = Cache(config.CACHE_PATH)
+    return _cache
+
+def get(namespace: str, key: str, default=None):
+    return get_cache().get(namespace, key, default)
+
+def set(namespace: str, key: str, value, ttl: float | None) -> None:
+    get_cache().set(namespace, key, value, ttl)
+
+def delete(namespace: str, key: str) -> None:
+    get_cache().delete(namespace, key)
@@ -16,6 +16,7 @@ import config
 import checks
 import actions
 import rocketleague
+import prewarm
 
 
 # LOAD THE BOT COMMANDS
@@ -71,10 +72,11 @@ def load(bot):
         print(f" + Command: /balls {str(target)}")
         print(f"   + User : {interaction.user.name}")
         print(f"   + Guild: {interaction.guild.name}")
-        await actions.update_presence(bot, config.ACTIVITY["Thinking"])
         await interaction.response.defer()
+        await actions.update_presence(bot, config.ACTIVITY["Thinking"])
 
-        await rocketleague.run_shallow_search(interaction, target)
+        player = await rocketleague.run_shallow_search(interaction, target)
+        if player is not None: await prewarm.record(player.platform_player_id)
 
         await actions.reset_presence(bot)
 
@@ -83,18 +85,21 @@ def load(bot):
         description="Go balls deep into the archives"
     )
     @checks.everyone()
-    async def deep(interaction: discord.Interaction, target: str = None) -> None:
-        print(f" + Command: /deep {str(target)}")
+    async def deep(interaction: discord.Interaction, target: str = None, quick: bool = False) -> None:
+        print(f" + Command: /deep {str(target)}{' quick' if quick else ''}")
         print(f"   + User : {interaction.user.name}")
         print(f"   + Guild: {interaction.guild.name}")
-        await actions.update_presence(bot, config.ACTIVITY["Thinking"])
         await interaction.response.defer()
+        await actions.update_presence(bot, config.ACTIVITY["Thinking"])
 
         player = await rocketleague.run_shallow_search(interaction, target)
         if player is not None:
+            await prewarm.record(player.platform_player_id)
             more_coming = await interaction.followup.send(" > More coming **↓** (This might take a minute)")
-            await rocketleague.run_deep_search(interaction, player)
-            await more_coming.delete()
+            if quick:
+                await rocketleague.run_quick_deep_search(interaction, player, more_coming)
+            else:
+                await rocketleague.run_deep_search(interaction, player, more_coming)
 
         await actions.reset_presence(bot)
 
@@ -8,6 +8,7 @@ Data such as guilds, users and colours.
 
 # IMPORTS
 import discord
+from datetime import timedelta
 
 # PREFIX
 PREFIX = "." # Only applies to non-slash commands
@@ -111,6 +112,76 @@ REPLAY_PLAYLIST_EXTRAS = [
 PLATFORMS = [
     "steam", "epic", "xbox", "ps4"
 ]
+BALLCHASING_PATRON_TIER = None # None uses the tier reported by ballchasing.com
+BALLCHASING_RATE_LIMITS = { # tier: (calls per second, calls per hour or None if unlimited)
+    "regular": (2, 500),
+    "gold": (2, 1000),
+    "diamond": (2, 2000),
+    "champion": (8, None),
+    "gc": (16, None)
+}
+BALLCHASING_POOL_SIZE = 32 # Keep-alive connections shared by all lookups
+BALLCHASING_RETRIES = 3 # Retries on a server error (5xx)
+BALLCHASING_BACKGROUND_RESERVE = 0.25 # Share of each rate limit that deep searches leave for other lookups
+
+# LOOKUPS
+LOOKUP_WORKERS = 8 # Threads available for blocking ballchasing/Steam requests
+LOCATE_CONCURRENT = True # Run the locate_target searches concurrently instead of one by one
+LOCATE_WORKERS = 16 # Threads available for the concurrent locate_target searches
+
+# STEAM
+STEAM_BATCH_SIZE = 100 # Most steamids GetPlayerSummaries accepts in one call
+STEAM_BATCH_DELAY = 0.05 # Seconds to wait for other summary requests to join a batch
+STEAM_SUMMARY_TTL = 6 * 60 * 60 # Seconds to remember a steamid's profile URL and avatar
+STEAM_TIMEOUT = 10 # Seconds before a Steam request is abandoned
+
+# CACHE
+CACHE_PATH = "cache.sqlite3"
+CACHE_TTL_TARGET = 7 * 24 * 60 * 60 # Seconds to remember which account a target resolved to
+CACHE_TTL_TARGET_MISS = 60 * 60 # Seconds to remember that a target wasn't found
+CACHE_TTL_VANITY = 30 * 24 * 60 * 60 # Seconds to remember a Steam vanity URL's steamid
+CACHE_TTL_VANITY_MISS = 24 * 60 * 60 # Seconds to remember that a Steam vanity URL doesn't exist
+CACHE_TTL_HISTORY = 90 * 24 * 60 * 60 # Seconds to keep a player's synced history after their last /deep
+CACHE_TTL_PROFILE_LATEST = 5 * 60 # Seconds to trust the id of a player's latest replay before searching for it again
+CACHE_TTL_PROFILE_REPLAY = 30 * 24 * 60 * 60 # Seconds to keep a player's camera, car etc. (refetched sooner if they have a newer replay)
+CACHE_TTL_PROFILE_LINKS = 24 * 60 * 60 # Seconds to remember a player's links and avatar
+CACHE_TTL_PROFILE_UPLOADER = 24 * 60 * 60 # Seconds to remember whether a player uploads replays
+CACHE_TTL_EMBEDS = 15 * 60 # Seconds to reuse a rendered /balls or /deep response while the player has no new replays (/balls checks for one once CACHE_TTL_PROFILE_LATEST is up)
+CACHE_TTL_CHECKPOINT = 24 * 60 * 60 # Seconds to keep the progress of a /deep that was cut short, to carry on from
+
+# PREWARM
+PREWARM = True # Refresh the caches of the most looked up players in the background while the bot is idle
+PREWARM_TOP = 20 # How many of the most looked up players to keep warm
+PREWARM_BUDGET = 0.1 # Share of the ballchasing.com rate limit that pre-warming may use
+PREWARM_INTERVAL = 60 # Seconds between rounds of pre-warming
+PREWARM_IDLE = 30 # Seconds without a lookup before the bot counts as idle
+PREWARM_HALF_LIFE = 3 * 24 * 60 * 60 # Seconds for a lookup to count half as much towards a player's popularity
+PREWARM_HISTORY_INTERVAL = 30 * 60 # Seconds between syncs of a popular player's stored history
+
+# ROSTER
+ROSTER = True # Keep a local index of pro players (see roster.py) instead of searching the pro replays for every name
+ROSTER_INTERVAL = 6 * 60 * 60 # Seconds between refreshes of the index with the newest pro replays
+ROSTER_BOOTSTRAP = 10000 # Pro replays read back to build the index the first time
+ROSTER_BUDGET = 0.05 # Share of the ballchasing.com rate limit that refreshing the index may use
+
+# HISTORY
+HISTORY_SYNC = True # Store histories so that a repeat /deep only fetches new uploads
+HISTORY_PARTITIONS = 8 # Most date ranges a first /deep is split into (1 fetches it in one go)
+HISTORY_PARTITION_MIN_SPAN = timedelta(days=60) # Shortest date range worth fetching separately
+HISTORY_PARTITION_WORKERS = 8 # Threads available for fetching date ranges
+HISTORY_TOP_K = None # Only keep about this many of the most frequent friends and opps (fixed memory, counts may run low), None to keep everyone
+
+# DEEP
+DEEP_PROGRESSIVE = True # Edit the /deep message with the totals so far (and a stop button) while fetching
+DEEP_PROGRESS_INTERVAL = 2 # Seconds between edits of the /deep message, to stay well inside Discord's limits
+DEEP_CONCURRENT = 4 # Most history fetches running at once (the rest wait in a queue)
+DEEP_PER_GUILD = 2 # Most history fetches running at once for one guild
+DEEP_PER_USER = 1 # Most history fetches running at once for one user
+DEEP_SAMPLE_STRATA = 12 # Date ranges a quick /deep takes its sample from
+DEEP_SAMPLE_SIZE = 600 # Replays a quick /deep samples in all (at most 200 from each date range)
+DEEP_SAMPLE_SLICE = 15 # Replays in each slice of time a quick /deep picks at random (fewer means more requests, tighter margins)
+DEEP_UPGRADE_TIMEOUT = 15 * 60 # Seconds the button to run the full search stays under a quick /deep
+DEEP_CHECKPOINT_INTERVAL = 2000 # Replays fetched between checkpoints of each date range of a first /deep
 
 BOT_NAMES = [
     "Armstrong",
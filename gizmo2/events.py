@@ -12,6 +12,10 @@ by them if the commands fail or other.
 # IMPORTS
 import discord.ext.commands as slash_commands
 
+# MY IMPORTS
+import prewarm
+import roster
+
 # LOAD THE BOT EVENTS
 def load(bot):
     ''' This function should only be accessed from bot.py and only once. '''
@@ -19,6 +23,10 @@ def load(bot):
     @bot.event
     async def on_ready():
         print(f" > Logged in as {bot.user}")
+        # Keep the caches of the most looked up players warm while the bot is idle
+        prewarm.start()
+        # Keep the index of pro players up to date with the newest pro replays
+        roster.start()
 
     @bot.event
     async def on_command_error(ctx, error):
@@ -0,0 +1,740 @@
+'''
+Author: Kian Mortimer
+Date: 18/10/26
+
+Description:
+Aggregation of a player's replay history (names, teammates and opponents)
+Kept apart from the API calls so that a history can be stored and added to later
+'''
+
+# IMPORTS
+from array import array
+import base64
+from collections import Counter
+from datetime import datetime, timezone
+from functools import lru_cache
+import numpy as np
+import pytz
+import zlib
+
+# Bump when the format of to_state() changes, so stored histories are rebuilt rather than misread
+STATE_VERSION = 7
+
+# How close together replays have to be to be considered duplicates
+# We would use the match GUID, but the simple search we're using from ballchasing doesn't include that
+# and a deep search would take 20x as long
+DUPLICATE_ALLOWANCE = 60 # seconds
+
+# Names kept for each teammate or opponent in top-k mode (see TopCounter)
+TOP_K_NAMES = 8
+
+# Matches kept for the duplicate check in top-k mode (see History.trim_matches)
+TOP_K_MATCHES = 1000
+
+# z-score of the margins of error given with sampled estimates (95% confidence)
+CONFIDENCE_Z = 1.96
+
+class History():
+    '''
+    Running totals built from the replays that the target appears in
+    Replays are added one at a time with add_replay(), and the stats
+    shown by /deep are produced from the totals with aggregates()
+
+    Every teammate and opponent met is kept as a row of Appearances, so the
+    totals are worked out by grouping the rows when they are needed.
+
+    In top-k mode only the top_k most frequent teammates and opponents
+    (and their most used names) are kept, in fixed memory. Their counts
+    are the appearances that are certain, which may be short by up to the
+    number of appearances / top_k. The target's names are counted rather
+    than kept for every replay, and the duplicate check only remembers the
+    newest matches and the last matches added (see trim_matches), so a copy
+    of an old match that turns up out of order may be counted twice.
+    '''
+    def __init__(self, platform_player_id: str, top_k: int = None) -> None:
+        self.platform_player_id: str = platform_player_id
+        self.player_id: str = platform_player_id.split(":", 1)[1]
+
+        # Player stats
+        self.replay_count: int = 0          # Number of replays excluding duplicates
+        self.names_time: dict = {}          # dict: {timestamp: playername} (empty in top-k mode)
+        self.is_pro: bool = False           # Is the player listed as a pro?
+        # Team and opponent stats
+        self.appearances: Appearances = None if top_k else Appearances()
+        # Top-k mode, where the teammates and opponents are kept in these instead of the appearances
+        self.top_k: int = top_k
+        self.names: Counter = Counter() if top_k else None # The target's names: {playername: count}
+        self.team_names_raw: dict = {}      # dict: {teamid: TopCounter(names)}
+        self.team_pro: dict = {}            # dict: {teamid: isPro}
+        self.opp_names_raw: dict = {}       # dict: {oppid: TopCounter(names)}
+        self.opp_pro: dict = {}             # dict: {oppid: isPro}
+        self.team_top: TopCounter = TopCounter(top_k) if top_k else None  # Appearances of the top teammates
+        self.opp_top: TopCounter = TopCounter(top_k) if top_k else None   # Appearances of the top opponents
+
+        # Sync state
+        self.matches: dict = {}             # dict: {match_key(minute, participants): epoch} of every replay added (the newest in top-k mode)
+        self.recent: dict = {} if top_k else None # dict: {match_key(minute, participants): epoch} of the last replays added (top-k mode)
+        self.held: list = []                # Replays held back until every date range has been merged
+        self.last_created: str = None       # Upload date of the newest replay seen
+        self.last_created_ids: list = []    # Replays uploaded at exactly last_created
+
+    ''' Add a replay (from a deep=False search) to the totals '''
+    def add_replay(self, replay: dict) -> bool:
+        '''
+        Returns False if the replay was skipped as a duplicate
+        '''
+
+        # Several uploaders may have uploaded the same match, in any order
+        if (fingerprint := match_fingerprint(replay)) is not None:
+            if self.is_duplicate(*fingerprint): return False
+            self.add_match(*fingerprint)
+        epoch = fingerprint[0] if fingerprint is not None else 0
+
+        # Print a value every 1000 replays for monitoring purposes
+        if self.replay_count % 1000 == 0: print(f"   - {self.replay_count}: {replay['date']}")
+        self.replay_count += 1
+
+        # Use helper func to iterate through the blue and orange team, getting relevant stats
+        self.iter_teams(replay, "blue", epoch)
+        self.iter_teams(replay, "orange", epoch)
+        return True
+
+    ''' Remember how far through the uploads we are, for the next sync '''
+    def mark_synced(self, replay: dict) -> None:
+        created = replay.get('created')
+        if created is None:
+            return
+        if self.last_created is None or created > self.last_created:
+            self.last_created = created
+            self.last_created_ids = [replay.get('id')]
+        elif created == self.last_created:
+            self.last_created_ids.append(replay.get('id'))
+
+    ''' Has a match with these participants been added within the allowance? '''
+    def is_duplicate(self, epoch: int, participants: int) -> bool:
+        # The match can only be in the same minute bucket or the ones either side of it
+        minute = epoch // DUPLICATE_ALLOWANCE
+        for bucket in (minute - 1, minute, minute + 1):
+            key = match_key(bucket, participants)
+            other = self.matches.get(key)
+            if other is None and self.recent is not None: other = self.recent.get(key)
+            if other is not None and abs(epoch - other) < DUPLICATE_ALLOWANCE:
+                return True
+        return False
+
+    ''' Remember a match for the duplicate check '''
+    def add_match(self, epoch: int, participants: int) -> None:
+        # A bucket is narrower than the allowance, so it never holds more than one match
+        key = match_key(epoch // DUPLICATE_ALLOWANCE, participants)
+        self.matches[key] = epoch
+        if self.top_k:
+            self.recent[key] = epoch
+            self.trim_matches()
+
+    ''' Forget all but the newest and the last added TOP_K_MATCHES matches (top-k mode) '''
+    def trim_matches(self, recent: bool = True) -> None:
+        '''
+        A date range is fetched in order of date, so the copies of a match
+        turn up close together and the last matches added will catch them.
+        A sync adds the latest uploads, which are mostly copies of the
+        newest matches. The newest are sorted out in batches rather than on
+        every match, so there are up to twice as many between batches.
+        '''
+        if len(self.matches) > 2 * TOP_K_MATCHES:
+            self.matches = dict(sorted(self.matches.items(), key=lambda i: i[1])[-TOP_K_MATCHES:])
+        while recent and len(self.recent) > TOP_K_MATCHES:
+            del self.recent[next(iter(self.recent))]
+
+    ''' Add the totals of another date range '''
+    def merge(self, other: 'History') -> None:
+        '''
+        Replays on the edge of a date range may be duplicates of replays in
+        the neighbouring range, so they are held back by the range and only
+        added by add_held() once every range has been merged.
+        '''
+        self.replay_count += other.replay_count
+        self.names_time.update(other.names_time)
+        self.is_pro = self.is_pro or other.is_pro
+        if self.top_k:
+            self.names.update(other.names)
+            merge_top(self.team_top, self.team_names_raw, self.team_pro, other.team_top, other.team_names_raw, other.team_pro)
+            merge_top(self.opp_top, self.opp_names_raw, self.opp_pro, other.opp_top, other.opp_names_raw, other.opp_pro)
+        else:
+            self.appearances.merge(other.appearances)
+        merge_matches(self.matches, other.matches)
+        if self.top_k:
+            # The last matches of every range are kept until the held replays have been added
+            merge_matches(self.recent, other.recent)
+            self.trim_matches(recent=False)
+        self.held += other.held
+
+        # Keep the sync state of whichever range holds the newest upload
+        if other.last_created is not None:
+            if self.last_created is None or other.last_created > self.last_created:
+                self.last_created = other.last_created
+                self.last_created_ids = list(other.last_created_ids)
+            elif other.last_created == self.last_created:
+                self.last_created_ids += other.last_created_ids
+
+    ''' Add the replays that were held back, now that every neighbouring match is known '''
+    def add_held(self) -> None:
+        '''
+        In top-k mode the last matches of every range are kept until the
+        held replays have been checked against them, and trimmed after.
+        '''
+        held, self.held = self.held, []
+        for replay in held:
+            self.add_replay(replay)
+        if self.top_k: self.trim_matches()
+
+    ''' Has this replay been seen by a previous sync? '''
+    def is_synced(self, replay: dict) -> bool:
+        return replay.get('created') == self.last_created and replay.get('id') in self.last_created_ids
+
+    ''' Helper function defining how to parse the teams in a replay object '''
+    def iter_teams(self, replay: dict, colour: str, epoch: int = 0) -> None:
+        is_player_team = False
+        team_members = [] # List of players in this team
+
+        try:
+            # Loop through the players in this team
+            for player in (replay[colour]['players']):
+                    try:
+                        # Add the relevant player information to the team_members list
+                        team_members.append((f"{player['id']['platform']}:{player['id']['id']}", player['name'], True if "pro" in player.keys() else False))
+
+                        if player['id']['id'] == self.player_id:
+                            ''' Perform actions on TARGET '''
+                            if self.names is not None: self.names[player['name']] += 1
+                            else: self.names_time[replay['date']] = player['name']
+
+                            # Is the target a pro, or listed as a pro already?
+                            if not self.is_pro: self.is_pro = True if "pro" in player.keys() else False
+                            ''' End actions on TARGET '''
+
+                            # Set the flag to confirm that we are currently looping through the target's team
+                            is_player_team = True
+                            continue
+
+                    except KeyError:
+                        ''' Occasionally, a ghost player exists in a replay that does not appear in the team,
+                        but does make the "team size" greater - often if someone spectates or changes team '''
+                        continue
+        except KeyError:
+            ''' In rare instances, there are no players present on a team
+            We need to make sure the code just skips along if this happens '''
+            return
+
+
+        if is_player_team:
+            ''' Perform actions on TEAM '''
+            # Loop back through the players
+            for member_id, name, pro in team_members:
+                # Skip the target player since they aren't their own teammate
+                if member_id == self.platform_player_id: continue
+                if self.team_top is not None:
+                    count_top(self.team_top, self.team_names_raw, self.team_pro, member_id, name, pro)
+                    continue
+                self.appearances.add(epoch, member_id, name, True, pro)
+            ''' End actions on TEAM '''
+
+        else:
+            ''' Perform actions on OPPOSITION '''
+            # Loop back through the players
+            for member_id, name, pro in team_members:
+                if self.opp_top is not None:
+                    count_top(self.opp_top, self.opp_names_raw, self.opp_pro, member_id, name, pro)
+                    continue
+                self.appearances.add(epoch, member_id, name, False, pro)
+            ''' End actions on OPPOSITION '''
+
+    ''' Develop the stats profile shown by /deep from the raw totals '''
+    def aggregates(self) -> dict:
+        # Data transformations to develop stats profile from raw data
+
+        '''{date: name}         =>      {asc(date): name}
+        names_time = {          =>      names_time = {
+            "date2": "name1",                "date1": "name1",
+            "date1": "name1",                "date2": "name1",
+            "date3": "name2",                "date3": "name2",
+            "date4": "name3"                 "date4"...
+        }                               }'''
+        names_time = dict(sorted(self.names_time.items(), key=lambda i: i, reverse=False))
+
+        '''{date: name}         =>      {name: count(names)}    =>      {name: desc(count(names))}
+        names_time = {          =>      names_count = {                 names_count = {
+            "date": "name2",                "name1": "1",                   "name2": "2",
+            "date": "name1",                "name2": "2",                   "name1": "1",
+            "date": "name2",                "name3": "1",                   "name3": "1",
+            "date": "name3"                 "name4": ...                    "name4": ...
+        }                               }                               }'''
+        # most_common() is a stable sort, so equal counts keep the order the names were first used
+        names_count = dict((self.names if self.names is not None else Counter(names_time.values())).most_common())
+
+        # Group the teammates and opponents by id (see Appearances.group, or kept as it goes in top-k mode)
+        team, opp = self.appearances.group() if self.appearances is not None else (
+            ({i: names.most_common(1)[0][0] for i, names in self.team_names_raw.items()}, self.team_top.certain(), dict(self.team_pro)),
+            ({i: names.most_common(1)[0][0] for i, names in self.opp_names_raw.items()}, self.opp_top.certain(), dict(self.opp_pro))
+        )
+
+        '''(id, name) rows                  =>      {id: popular(name)}
+        appearances = [                     =>      team_names = {
+            ("id1", "name1"),                           "id1": "name1",
+            ("id2", "name5"),                           "id2": "name5",
+            ("id1", "name1"),                           "id3": "name2",
+            ("id3", "name2")                            "id": ...
+        ]                                           }'''
+        team_names, middle, team_pro = team
+
+        '''(id, name) rows                  =>      {id: count(rows)}       =>      {id: desc(count(rows))}
+        appearances = [                     =>      middle = {              =>     team_count = {
+            ("id1", "name1"),                           "id1": "2",                     "id1": "2",
+            ("id2", "name5"),                           "id2": "1",                     "id2": "1",
+            ("id1", "name1"),                           "id3": "1",                     "id3": "1",
+            ("id3", "name2")                            "id": ...                       "id": ...
+        ]                                           }                               }'''
+        team_count = dict(sorted(middle.items(), key=lambda i: i[1], reverse=True))
+
+        # The same again for the opposition
+        opp_names, middle, opp_pro = opp
+        opp_count = dict(sorted(middle.items(), key=lambda i: i[1], reverse=True))
+
+        return {
+            "replay_count": self.replay_count,
+            "names_time": names_time,
+            "names_count": names_count,
+            "is_pro": self.is_pro,
+            "team_names": team_names,
+            "team_count": team_count,
+            "team_pro": team_pro,
+            "opp_names": opp_names,
+            "opp_count": opp_count,
+            "opp_pro": opp_pro
+        }
+
+    ''' Convert the totals into plain data that can be stored (see cache.py) '''
+    def to_state(self) -> dict:
+        return {
+            "version": STATE_VERSION,
+            "platform_player_id": self.platform_player_id,
+            "replay_count": self.replay_count,
+            "names_time": self.names_time,
+            "is_pro": self.is_pro,
+            "appearances": self.appearances.to_state() if self.appearances is not None else None,
+            "top_k": self.top_k,
+            "names": dict(self.names) if self.top_k else None,
+            "team_names_raw": {teamid: names.to_state() for teamid, names in self.team_names_raw.items()},
+            "team_pro": self.team_pro,
+            "opp_names_raw": {oppid: names.to_state() for oppid, names in self.opp_names_raw.items()},
+            "opp_pro": self.opp_pro,
+            "team_top": self.team_top.to_state() if self.top_k else None,
+            "opp_top": self.opp_top.to_state() if self.top_k else None,
+            "matches": [[epoch, key & 0xFFFFFFFF] for key, epoch in sorted({**(self.recent or {}), **self.matches}.items(), key=lambda i: i[1])],
+            "last_created": self.last_created,
+            "last_created_ids": self.last_created_ids,
+            "held": self.held
+        }
+
+    ''' Rebuild a history from the output of to_state() '''
+    @classmethod
+    def from_state(cls, state: dict) -> 'History':
+        # A history keeps the mode it was started in, whatever config.HISTORY_TOP_K is now
+        history = cls(state["platform_player_id"], state["top_k"])
+        history.replay_count = state["replay_count"]
+        history.names_time = state["names_time"]
+        history.is_pro = state["is_pro"]
+        if history.top_k:
+            history.names = Counter(state["names"])
+            history.team_names_raw = {teamid: TopCounter.from_state(TOP_K_NAMES, names) for teamid, names in state["team_names_raw"].items()}
+            history.opp_names_raw = {oppid: TopCounter.from_state(TOP_K_NAMES, names) for oppid, names in state["opp_names_raw"].items()}
+            history.team_top = TopCounter.from_state(history.top_k, state["team_top"])
+            history.opp_top = TopCounter.from_state(history.top_k, state["opp_top"])
+            history.team_pro = state["team_pro"]
+            history.opp_pro = state["opp_pro"]
+        else:
+            history.appearances = Appearances.from_state(state["appearances"])
+        for epoch, participants in state["matches"]:
+            history.add_match(epoch, participants)
+        history.last_created = state["last_created"]
+        history.last_created_ids = state["last_created_ids"]
+        history.held = state["held"]
+        return history
+
+
+class Appearances():
+    '''
+    Every teammate and opponent met in a history, one row per appearance
+    The same ids and names come up again and again, so each is stored once
+    and numbered (interned), and the rows are typed columns of numbers:
+    the time of the replay, the player's id and name, which side they were
+    on and whether they were listed as a pro. That is 18 bytes a row, where
+    dicts of Counters took several times that for every player met.
+
+    The totals are group-bys over the columns with numpy (see group), rather
+    than counted row by row in Python.
+    '''
+    def __init__(self) -> None:
+        # Interned values
+        self.ids: list = []                 # list: [platform:id] by number
+        self.id_numbers: dict = {}          # dict: {platform:id: number}
+        self.names: list = []               # list: [name] by number
+        self.name_numbers: dict = {}        # dict: {name: number}
+        # Columns (one entry per row)
+        self.time = array('q')              # Epoch of the replay
+        self.player = array('i')            # Number of the player's id
+        self.name = array('i')              # Number of the name they used
+        self.team = array('b')              # 1 if a teammate, 0 if an opponent
+        self.pro = array('b')               # 1 if listed as a pro in the replay
+
+    ''' Add a row '''
+    def add(self, epoch: int, member_id: str, name: str, team: bool, pro: bool) -> None:
+        self.time.append(epoch)
+        self.player.append(intern(self.id_numbers, self.ids, member_id))
+        self.name.append(intern(self.name_numbers, self.names, name))
+        self.team.append(team)
+        self.pro.append(pro)
+
+    ''' Add the rows of another set of appearances, renumbering their ids and names '''
+    def merge(self, other: 'Appearances') -> None:
+        players = [intern(self.id_numbers, self.ids, i) for i in other.ids]
+        names = [intern(self.name_numbers, self.names, name) for name in other.names]
+        self.time.extend(other.time)
+        self.player.extend(map(players.__getitem__, other.player))
+        self.name.extend(map(names.__getitem__, other.name))
+        self.team.extend(other.team)
+        self.pro.extend(other.pro)
+
+    ''' Group the rows by player: ({id: popular(name)}, {id: count}, {id: isPro}) for teammates, then opponents '''
+    def group(self) -> tuple:
+        '''
+        Players are in the order they were first met and a player's most
+        popular name is the first used of their most used, as with Counter.
+        The columns are read as numpy arrays without copying them.
+        '''
+        if not self.player:
+            return ({}, {}, {}), ({}, {}, {})
+        player = np.frombuffer(self.player, dtype=np.intc).astype(np.int64)
+        name = np.frombuffer(self.name, dtype=np.intc).astype(np.int64)
+        team = np.frombuffer(self.team, dtype=np.int8)
+        pro = np.frombuffer(self.pro, dtype=np.int8)
+
+        # Each player on each side gets a group: their number * 2 + 1 as a teammate (+ 0 as an opponent)
+        group = player * 2 + team
+        groups, first, counts = np.unique(group, return_index=True, return_counts=True)
+        is_pro = np.zeros(len(self.ids) * 2, dtype=bool)
+        is_pro[group[pro == 1]] = True
+
+        # Count the names used in each group, and keep the most used (the first used among equals)
+        pairs, pair_first, pair_counts = np.unique(group * len(self.names) + name, return_index=True, return_counts=True)
+        order = np.lexsort((pair_first, -pair_counts, pairs // len(self.names)))
+        pairs = pairs[order]
+        popular = pairs[np.flatnonzero(np.diff(pairs // len(self.names), prepend=-1))] % len(self.names)
+
+        sides = []
+        for side in (1, 0):
+            # Both are in order of group, so the same mask picks out the side from each
+            mask = groups % 2 == side
+            met = np.argsort(first[mask], kind="stable")
+            member_ids = [self.ids[i] for i in (groups[mask][met] // 2).tolist()]
+            sides.append((
+                dict(zip(member_ids, map(self.names.__getitem__, popular[mask][met].tolist()))),
+                dict(zip(member_ids, counts[mask][met].tolist())),
+                dict(zip(member_ids, is_pro[groups[mask][met]].tolist()))
+            ))
+        return tuple(sides)
+
+    ''' Convert the rows into plain data that can be stored (columns as base64 of their bytes) '''
+    def to_state(self) -> dict:
+        state = {"ids": self.ids, "names": self.names}
+        for column in ("time", "player", "name", "team", "pro"):
+            state[column] = base64.b64encode(getattr(self, column).tobytes()).decode()
+        return state
+
+    ''' Rebuild the rows from the output of to_state() '''
+    @classmethod
+    def from_state(cls, state: dict) -> 'Appearances':
+        appearances = cls()
+        appearances.ids = state["ids"]
+        appearances.id_numbers = {member_id: number for number, member_id in enumerate(appearances.ids)}
+        appearances.names = state["names"]
+        appearances.name_numbers = {name: number for number, name in enumerate(appearances.names)}
+        for column in ("time", "player", "name", "team", "pro"):
+            getattr(appearances, column).frombytes(base64.b64decode(state[column]))
+        return appearances
+
+
+''' Merge the matches of one History into another's, keeping the earliest copy of a match both have seen '''
+def merge_matches(matches: dict, other: dict) -> None:
+    for key, epoch in other.items():
+        if key not in matches or epoch < matches[key]: matches[key] = epoch
+
+''' Key of a minute bucket in History.matches (one int rather than a tuple, as there is one for every replay) '''
+def match_key(minute: int, participants: int) -> int:
+    return minute << 32 | participants
+
+''' Number a value, the same number every time it comes up (see Appearances) '''
+def intern(numbers: dict, values: list, value) -> int:
+    number = numbers.get(value)
+    if number is None:
+        number = numbers[value] = len(values)
+        values.append(value)
+    return number
+
+
+class TopCounter():
+    '''
+    Approximate counts of the most frequent keys in fixed memory (Space-Saving)
+    At most "capacity" keys are tracked. When a new key arrives and the counter
+    is full, it takes the place of the key with the lowest count and inherits
+    that count as its error. Every count is then at most its error too high,
+    and any key seen more than total / capacity times is always tracked.
+    '''
+    def __init__(self, capacity: int) -> None:
+        self.capacity: int = capacity
+        self.counts: dict = {}              # dict: {key: count}
+        self.errors: dict = {}              # dict: {key: most the count can be too high by}
+        self.buckets: dict = {}             # dict: {count: {key: None}} keys by count, oldest first
+        self.min: int = 0                   # Lowest count tracked
+
+    ''' Count a key, returning the key it replaced (if any) '''
+    def add(self, key, amount: int = 1):
+        evicted = None
+        count = self.counts.get(key)
+        if count is None:
+            if len(self.counts) < self.capacity:
+                count, error = 0, 0
+            else:
+                # Replace the longest standing key with the lowest count
+                count = self.min
+                evicted = next(iter(self.buckets[count]))
+                del self.counts[evicted], self.errors[evicted]
+                self.unbucket(evicted, count)
+                error = count
+            self.errors[key] = error
+        else:
+            self.unbucket(key, count)
+
+        self.counts[key] = count + amount
+        self.buckets.setdefault(count + amount, {})[key] = None
+        if len(self.counts) == 1 or count + amount < self.min:
+            self.min = count + amount
+        elif count == self.min and count not in self.buckets:
+            # Counting one more only moves the lowest count up by one
+            self.min = count + amount if amount == 1 else min(self.buckets)
+        return evicted
+
+    ''' Take a key out of its count bucket (helper for add) '''
+    def unbucket(self, key, count: int) -> None:
+        bucket = self.buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[count]
+
+    ''' The counts less their errors, which every key is certain to have been seen: {key: count} '''
+    def certain(self) -> dict:
+        return {key: count - self.errors[key] for key, count in self.counts.items()}
+
+    ''' The n keys with the highest counts, as (key, count) '''
+    def most_common(self, n: int = None) -> list:
+        return sorted(self.counts.items(), key=lambda i: i[1], reverse=True)[:n]
+
+    ''' Add the counts of another counter, returning the keys that are no longer tracked '''
+    def merge(self, other: 'TopCounter') -> list:
+        '''
+        A key that a full counter isn't tracking may still have been seen up to
+        its lowest count, so that is what it is taken to be (and its error).
+        '''
+        floor = self.min if len(self.counts) >= self.capacity else 0
+        other_floor = other.min if len(other.counts) >= other.capacity else 0
+        merged = {}
+        for key in list(self.counts) + [key for key in other.counts if key not in self.counts]:
+            merged[key] = (
+                self.counts.get(key, floor) + other.counts.get(key, other_floor),
+                self.errors.get(key, floor) + other.errors.get(key, other_floor)
+            )
+        kept = sorted(merged.items(), key=lambda i: i[1][0], reverse=True)[:self.capacity]
+        kept_keys = {key for key, _ in kept}
+        dropped = [key for key in self.counts if key not in kept_keys]
+
+        self.counts, self.errors, self.buckets = {}, {}, {}
+        for key, (count, error) in kept:
+            self.counts[key] = count
+            self.errors[key] = error
+            self.buckets.setdefault(count, {})[key] = None
+        self.min = min(self.buckets) if self.buckets else 0
+        return dropped
+
+    ''' Convert the counter into plain data that can be stored '''
+    def to_state(self) -> list:
+        return [[key, count, self.errors[key]] for key, count in self.counts.items()]
+
+    ''' Rebuild a counter from the output of to_state() '''
+    @classmethod
+    def from_state(cls, capacity: int, state: list) -> 'TopCounter':
+        counter = cls(capacity)
+        for key, count, error in state:
+            counter.counts[key] = count
+            counter.errors[key] = error
+            counter.buckets.setdefault(count, {})[key] = None
+        counter.min = min(counter.buckets) if counter.buckets else 0
+        return counter
+
+
+''' Count a teammate or opponent in top-k mode, forgetting whoever they replace '''
+def count_top(top: TopCounter, names_raw: dict, pros: dict, member_id: str, name: str, pro: bool) -> None:
+    evicted = top.add(member_id)
+    if evicted is not None:
+        del names_raw[evicted]
+        del pros[evicted]
+    names = names_raw.get(member_id)
+    if names is None:
+        names = names_raw[member_id] = TopCounter(TOP_K_NAMES)
+    names.add(name)
+    pros[member_id] = pro or pros.get(member_id, False)
+
+''' Add the top-k teammates or opponents of another history '''
+def merge_top(top: TopCounter, names_raw: dict, pros: dict, other_top: TopCounter, other_names_raw: dict, other_pros: dict) -> None:
+    for member_id in top.merge(other_top):
+        del names_raw[member_id]
+        del pros[member_id]
+    for member_id in top.counts:
+        if member_id not in other_names_raw:
+            continue
+        if member_id in names_raw:
+            names_raw[member_id].merge(other_names_raw[member_id])
+        else:
+            names_raw[member_id] = other_names_raw[member_id]
+        pros[member_id] = pros.get(member_id, False) or other_pros[member_id]
+
+''' Estimate the stats profile of a whole history from samples of it (see Player.sample_history) '''
+def estimate_aggregates(platform_player_id: str, strata: list) -> dict:
+    '''
+    strata is a list of (clusters, slices) for each date range sampled: the
+    range was cut into slices equal slices of time, and clusters holds a
+    (history, fetched, total) for each slice picked at random: the history of
+    its replays, the number of replays fetched from it (before duplicates
+    were skipped) and the number of replays in it.
+
+    Every count is scaled up range by range from the slices picked, by the
+    number of slices over the number picked (a stratified cluster sample).
+    The "*_error" dicts hold the margin of error of each count at 95%
+    confidence, from the variance between the slices picked with the finite
+    population correction, so a range that was fetched in full adds no error.
+    '''
+    sampled = History(platform_player_id)
+    replay_count = 0.0
+    totals = {"names_count": {}, "team_count": {}, "opp_count": {}} # dict: {key: [estimate, variance]}
+
+    for clusters, slices in strata:
+        picked = len(clusters)
+        if picked == 0: continue
+        correction = 1 - picked / slices
+
+        # The counts of each slice picked: {counts: {key: count}}
+        slice_counts = []
+        for history, fetched, total in clusters:
+            sampled.merge(history)
+            # A slice with more replays than were fetched is scaled up, taking duplicates to be as common in the rest
+            weight = total / fetched if fetched else 1.0
+            replay_count += slices / picked * history.replay_count * weight
+            (_, team_count, _), (_, opp_count, _) = history.appearances.group()
+            slice_counts.append({
+                "names_count": {name: appearances * weight for name, appearances in Counter(history.names_time.values()).items()},
+                "team_count": {teamid: appearances * weight for teamid, appearances in team_count.items()},
+                "opp_count": {oppid: appearances * weight for oppid, appearances in opp_count.items()}
+            })
+
+        for counts, estimates in totals.items():
+            for key in set().union(*(i[counts] for i in slice_counts)):
+                values = [i[counts].get(key, 0.0) for i in slice_counts]
+                mean = sum(values) / picked
+                estimate = estimates.setdefault(key, [0.0, 0.0])
+                estimate[0] += slices * mean
+                if picked > 1: estimate[1] += slices * slices * correction * sum((v - mean) ** 2 for v in values) / (picked - 1) / picked
+
+    # Names and pros come from the sample, the counts from the estimates
+    stats = sampled.aggregates()
+    stats["replay_count"] = round(replay_count)
+    stats["sample_count"] = sampled.replay_count
+    for key, counts in totals.items():
+        ordered = sorted(counts.items(), key=lambda i: i[1][0], reverse=True)
+        stats[key] = {i: round(estimate) for i, (estimate, _) in ordered}
+        stats[key.replace("_count", "_error")] = {i: CONFIDENCE_Z * variance ** 0.5 for i, (_, variance) in ordered}
+    return stats
+
+''' Convert a replay date into a timezone aware datetime '''
+def replay_datetime(date: str) -> datetime:
+    # Replays without timezone info are treated as Melbourne time, as in replay_epoch()
+    date = datetime.fromisoformat(date.removesuffix("Z") + ("+00:00" if date.endswith("Z") else ""))
+    if date.tzinfo is None or date.tzinfo.utcoffset(date) is None:
+        date = pytz.timezone("Australia/Melbourne").localize(date)
+    return date
+
+''' Format a datetime for the ballchasing.com date filters '''
+def rfc3339(date: datetime) -> str:
+    return date.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+''' Helper function to fingerprint the match in a replay for the duplicate check '''
+def match_fingerprint(replay: dict) -> tuple | None:
+    '''
+    Returns (epoch, participants) where participants is a hash of the ids of
+    everyone in the match, or None if the date can't be read (never a duplicate)
+    '''
+    epoch = replay_epoch(replay['date'])
+    if epoch is None:
+        return None
+
+    ids = []
+    for colour in ("blue", "orange"):
+        for player in replay.get(colour, {}).get('players', []) or []:
+            try:
+                ids.append(f"{player['id']['platform']}:{player['id']['id']}")
+            except (KeyError, TypeError):
+                continue # Ghost players (see iter_teams)
+    # A stable hash rather than hash(), as the fingerprints are stored between restarts
+    return epoch, zlib.crc32(",".join(sorted(ids)).encode())
+
+''' Convert a replay date ("2023-05-01T20:31:11+10:00") into seconds since the epoch '''
+def replay_epoch(date: str) -> int | None:
+    '''
+    Parsed by hand as it runs for every replay in a history. Replays without
+    timezone info are treated as Melbourne time (Most OCE are in Melbourne timezone).
+    '''
+    try:
+        days = days_from_civil(int(date[0:4]), int(date[5:7]), int(date[8:10]))
+        epoch = days * 86400 + int(date[11:13]) * 3600 + int(date[14:16]) * 60 + int(date[17:19])
+
+        # Skip any fraction of a second to find the timezone
+        zone = date[19:].lstrip(".0123456789")
+        if zone == "Z":
+            return epoch
+        if zone[:1] in ("+", "-") and len(zone) == 6:
+            offset = int(zone[1:3]) * 3600 + int(zone[4:6]) * 60
+            return epoch - offset if zone[0] == "+" else epoch + offset
+        if zone == "":
+            return epoch - melbourne_offset(date[:13])
+    except ValueError:
+        pass
+
+    # Anything unusual goes the slow way
+    try:
+        return int(replay_datetime(date).timestamp())
+    except (TypeError, ValueError):
+        ''' Catches instances where the date is in an invalid format '''
+        return None
+
+''' Days since 1970-01-01 of a date in the proleptic Gregorian calendar '''
+def days_from_civil(year: int, month: int, day: int) -> int:
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+''' UTC offset in seconds of Melbourne at the given hour ("2023-05-01T20") '''
+@lru_cache(maxsize=4096)
+def melbourne_offset(hour: str) -> int:
+    # Only changes with daylight saving, so one lookup per hour is plenty
+    date = pytz.timezone("Australia/Melbourne").localize(datetime.fromisoformat(hour + ":00:00"))
+    return int(date.utcoffset().total_seconds())
@@ -0,0 +1,317 @@
+'''
+Author: Kian Mortimer
+Date: 18/10/26
+
+Description:
+Shared clients for the external APIs (ballchasing.com, Steam)
+One client is used for the whole process so that connections are reused
+and every lookup shares the same rate limits
+'''
+
+# IMPORTS
+import ballchasing
+import requests.adapters
+import aiohttp
+import asyncio
+import os
+import time
+import threading
+from email.utils import parsedate_to_datetime
+
+# MY IMPORTS
+import config
+import cache
+
+class TokenBucket():
+    '''
+    Thread safe token bucket rate limiter
+    Holds up to "capacity" tokens, refilled at "rate" tokens per second
+    '''
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate: float = rate
+        self.capacity: float = capacity
+        self.tokens: float = capacity
+        self.updated: float = time.monotonic()
+        self.paused_until: float = 0        # Set when the server tells us to back off
+        self.waiting: int = 0               # Foreground requests waiting for a token
+        self.lock = threading.Lock()
+
+    ''' Top up the tokens for the time passed since the last update (lock must be held) '''
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    ''' Block until a token is available and take it '''
+    def acquire(self, background: bool = False) -> None:
+        '''
+        Background requests give way to any foreground request that is
+        waiting, and leave config.BALLCHASING_BACKGROUND_RESERVE of the
+        bucket for the foreground, so that a long fetch can't use up the
+        whole budget while other lookups queue behind it.
+        '''
+        reserve = min(self.capacity * config.BALLCHASING_BACKGROUND_RESERVE, self.capacity - 1) if background else 0
+        counted = False
+        try:
+            while True:
+                with self.lock:
+                    now = time.monotonic()
+                    self.refill(now)
+                    if now >= self.paused_until and self.tokens >= 1 + reserve and not (background and self.waiting):
+                        self.tokens -= 1
+                        return
+                    if not background and not counted:
+                        self.waiting += 1
+                        counted = True
+                    wait = max(self.paused_until - now, (1 + reserve - self.tokens) / self.rate)
+                    if background and self.waiting:
+                        wait = max(wait, 1 / self.rate)
+                time.sleep(wait)
+        finally:
+            if counted:
+                with self.lock:
+                    self.waiting -= 1
+
+    ''' Stop handing out tokens for the given number of seconds '''
+    def pause(self, seconds: float) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self.paused_until = max(self.paused_until, now + seconds)
+
+class PooledApi(ballchasing.Api):
+    '''
+    ballchasing.Api with a pooled keep-alive session and a shared rate limiter
+    Every request waits for a token from each bucket, and a 429 response
+    pauses the buckets for as long as the server's Retry-After asks
+    '''
+    def __init__(self, auth_key: str, patron_tier: str = None) -> None:
+        # The buckets must exist before the parent class pings the API, so start on the lowest tier
+        per_second = config.BALLCHASING_RATE_LIMITS["regular"][0]
+        self.buckets: list = [TokenBucket(per_second, per_second)]
+        self.rate_limit_count: int = 0
+        super().__init__(auth_key)
+
+        # Reuse connections across threads instead of opening one per request
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=config.BALLCHASING_POOL_SIZE,
+            pool_maxsize=config.BALLCHASING_POOL_SIZE
+        )
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+        # Now that we know the account's tier, set up the proper limits
+        self.patron_tier: str = patron_tier or getattr(self, "patron_type", None) or "regular"
+        per_second, per_hour = config.BALLCHASING_RATE_LIMITS.get(self.patron_tier, config.BALLCHASING_RATE_LIMITS["regular"])
+        self.buckets = [TokenBucket(per_second, per_second)]
+        if per_hour is not None:
+            self.buckets.append(TokenBucket(per_hour / 3600, per_hour))
+        print(f" > ballchasing.com tier: {self.patron_tier} ({per_second}/s, {per_hour}/h)")
+
+    ''' A bucket for a share of the tightest rate limit, for requests that must keep within a budget (see on_budget) '''
+    def budget(self, share: float) -> TokenBucket:
+        rate = min(bucket.rate for bucket in self.buckets) * share
+        return TokenBucket(rate, max(1, rate * 60))
+
+    ''' Get one page of a replay search as it comes from the API ("list", "count" of all matches, "next") '''
+    def get_replay_page(self, **params) -> dict:
+        # get_replays() only hands out the replays, but the total is needed to scale up samples
+        return self._request("/replays", self._session.get, params=params).json()
+
+    ''' Override of ballchasing.Api._request which every API call goes through '''
+    def _request(self, url_or_endpoint: str, method, **params) -> requests.Response:
+        url = f"{self.base_url}{url_or_endpoint}" if url_or_endpoint.startswith("/") else url_or_endpoint
+        retries = 0
+        budget = current_budget()
+        while True:
+            if budget is not None:
+                budget.acquire()
+            for bucket in self.buckets:
+                bucket.acquire(is_background())
+            r = method(url, **params)
+
+            if 200 <= r.status_code < 300:
+                return r
+            elif r.status_code == 429:
+                # Rate limited: everyone backs off, not just this request
+                self.rate_limit_count += 1
+                wait = retry_after(r.headers.get("Retry-After"), 1 / self.buckets[0].rate)
+                print(f" ! ballchasing.com rate limited: waiting {wait:.1f}s")
+                for bucket in self.buckets:
+                    bucket.pause(wait)
+            elif 500 <= r.status_code < 600 and retries < config.BALLCHASING_RETRIES:
+                retries += 1
+                time.sleep(2 ** retries)
+            else:
+                raise ValueError(r, url, params)
+
+class SteamClient():
+    '''
+    Async client for the Steam Web API
+    Player summaries requested close together are coalesced into batched
+    GetPlayerSummaries calls (up to 100 steamids each), and the profile URL
+    and avatar of every steamid are kept for config.STEAM_SUMMARY_TTL seconds
+    '''
+    def __init__(self, api_key: str, loop: asyncio.AbstractEventLoop) -> None:
+        self.api_key: str = api_key
+        self.loop = loop                    # The bot's event loop, which the client lives on
+        self.session: aiohttp.ClientSession = None
+        self.summaries: dict = {}           # dict: {steamid: (expiry, summary)}
+        self.pending: dict = {}             # dict: {steamid: future} waiting for the next batch
+        self.flush_handle = None            # Timer that sends the next batch
+
+    ''' Get the HTTP session, creating it on first use '''
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36'},
+                timeout=aiohttp.ClientTimeout(total=config.STEAM_TIMEOUT)
+            )
+        return self.session
+
+    ''' Get the profile URL and avatar of a steamid, or None if Steam doesn't know it '''
+    async def get_summary(self, steamid: str) -> dict | None:
+        cached = self.summaries.get(steamid)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        # Join the next batch (or the one already waiting for this steamid)
+        future = self.pending.get(steamid)
+        if future is None:
+            future = self.loop.create_future()
+            self.pending[steamid] = future
+            if len(self.pending) >= config.STEAM_BATCH_SIZE:
+                self.flush()
+            elif self.flush_handle is None:
+                self.flush_handle = self.loop.call_later(config.STEAM_BATCH_DELAY, self.flush)
+        return await asyncio.shield(future)
+
+    ''' Send everything that is waiting as batched requests '''
+    def flush(self) -> None:
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        pending, self.pending = list(self.pending.items()), {}
+        for i in range(0, len(pending), config.STEAM_BATCH_SIZE):
+            self.loop.create_task(self.fetch_summaries(dict(pending[i:i + config.STEAM_BATCH_SIZE])))
+
+    ''' Request one batch of summaries and hand the results to whoever is waiting '''
+    async def fetch_summaries(self, batch: dict) -> None:
+        players = None
+        try:
+            async with self.get_session().get(
+                "http://api.steampowered.com/ISteamUser/GetPlayerSummaries/v0002/",
+                params={"key": self.api_key, "steamids": ",".join(batch.keys())}
+            ) as page:
+                # Page found
+                if page.status == 200:
+                    _json = await page.json(content_type=None)
+                    players = {player['steamid']: player for player in _json['response']['players']}
+        except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError) as e:
+            print(f" ! Steam GetPlayerSummaries failed: {e!r}")
+
+        expiry = time.monotonic() + config.STEAM_SUMMARY_TTL
+        for steamid, future in batch.items():
+            summary = None
+            if players is not None:
+                # Only keep what we use, and remember steamids that Steam doesn't know
+                if (player := players.get(steamid)) is not None:
+                    summary = {"profileurl": player.get('profileurl', ""), "avatarfull": player.get('avatarfull', "")}
+                self.summaries[steamid] = (expiry, summary)
+            if not future.done():
+                future.set_result(summary)
+
+    ''' Get the steamid behind a Steam vanity URL, or None if there isn't one '''
+    async def resolve_vanity(self, vanity: str) -> str | None:
+        # The same vanity can be checked twice in one lookup, and again on every repeat lookup
+        # The cache is SQLite, so it is read and written off the event loop
+        cached = await self.loop.run_in_executor(None, cache.get, "vanity", vanity, cache.MISSING)
+        if cached is not cache.MISSING:
+            return cached
+
+        try:
+            async with self.get_session().get(
+                "http://api.steampowered.com/ISteamUser/ResolveVanityURL/v0001/",
+                params={"key": self.api_key, "vanityurl": vanity}
+            ) as page:
+                # Page not found: don't cache, it may just be Steam having a moment
+                if page.status != 200:
+                    return None
+                _json = await page.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            print(f" ! Steam ResolveVanityURL failed: {e!r}")
+            return None
+
+        steam_id = _json.get('response', {}).get('steamid')
+        ttl = config.CACHE_TTL_VANITY if steam_id is not None else config.CACHE_TTL_VANITY_MISS
+        await self.loop.run_in_executor(None, cache.set, "vanity", vanity, steam_id, ttl)
+        return steam_id
+
+    ''' Run one of the coroutines above from a worker thread and wait for the result '''
+    def run_threadsafe(self, coro):
+        # Must never be called from the event loop itself, as it would wait on itself
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+## Request priority ##
+# Requests are foreground unless the thread making them is marked as background
+_priority = threading.local()
+
+''' Call func(*args) with the requests it makes from this thread marked as background '''
+def in_background(func, *args):
+    previous = is_background()
+    _priority.background = True
+    try:
+        return func(*args)
+    finally:
+        _priority.background = previous
+
+''' Are the requests made from this thread background requests? '''
+def is_background() -> bool:
+    return getattr(_priority, "background", False)
+
+''' Call func(*args) in the background, with every request it makes from this thread taking a token from budget too '''
+def on_budget(budget: TokenBucket, func, *args):
+    previous = current_budget()
+    _priority.budget = budget
+    try:
+        return in_background(func, *args)
+    finally:
+        _priority.budget = previous
+
+''' The budget the requests made from this thread have to keep within, if any '''
+def current_budget() -> TokenBucket | None:
+    return getattr(_priority, "budget", None)
+
+''' Parse a Retry-After header (seconds or HTTP date) into seconds '''
+def retry_after(header: str | None, default: float) -> float:
+    if header is None:
+        return default
+    try:
+        return max(0.0, float(header))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(header).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+## Shared clients ##
+# Created on first use, after the tokens have been loaded from the environment
+_ballchasing: PooledApi = None
+_ballchasing_lock = threading.Lock()
+
+''' Get the process wide ballchasing.com client '''
+def ballchasing_api() -> PooledApi:
+    global _ballchasing
+    with _ballchasing_lock:
+        if _ballchasing is None:
+            _ballchasing = PooledApi(os.getenv('TOKEN_BALLCHASING'), config.BALLCHASING_PATRON_TIER)
+    return _ballchasing
+
+_steam: SteamClient = None
+
+''' Get the process wide Steam client (first call must be made from the event loop) '''
+def steam_client() -> SteamClient:
+    global _steam
+    if _steam is None:
+        _steam = SteamClient(os.getenv('TOKEN_STEAM'), asyncio.get_running_loop())
+    return _steam
@@ -0,0 +1,164 @@
+'''
+Author: Kian Mortimer
+Date: 18/10/26
+
+Description:
+Background pre-warming of the caches for the most looked up players
+Lookups concentrate on a few players (pros, rivals, server regulars), so
+while the bot is idle their profiles, histories and rendered responses are
+refreshed ahead of time, within a share of the ballchasing.com budget
+'''
+
+# IMPORTS
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# MY IMPORTS
+import config
+import cache
+import network
+import rocketleague
+import history as replay_history
+
+# Scores below this are forgotten, as the player hasn't been looked up in a long time
+MIN_SCORE = 0.05
+
+class Popularity():
+    '''
+    How often each player has been looked up, with older lookups counting for less
+    A score halves every half_life seconds, so the top players follow what
+    people have been looking up lately. Scores are kept in wall clock time so
+    they can be stored and carried over a restart.
+    '''
+    def __init__(self, half_life: float) -> None:
+        self.half_life: float = half_life
+        self.scores: dict = {}              # dict: {platform:id: [score, time of score]}
+
+    ''' The score of a player as it stands now '''
+    def score(self, platform_player_id: str, now: float) -> float:
+        score, updated = self.scores.get(platform_player_id, (0.0, now))
+        return score * 0.5 ** ((now - updated) / self.half_life)
+
+    ''' Count a lookup of a player '''
+    def record(self, platform_player_id: str) -> None:
+        now = time.time()
+        self.scores[platform_player_id] = [self.score(platform_player_id, now) + 1, now]
+
+    ''' The n most popular players, most popular first (forgetting any that have faded away) '''
+    def top(self, n: int) -> list:
+        now = time.time()
+        current = {i: self.score(i, now) for i in self.scores}
+        for i, score in current.items():
+            if score < MIN_SCORE: del self.scores[i]
+        return sorted((i for i in current if current[i] >= MIN_SCORE), key=current.get, reverse=True)[:n]
+
+    ''' Convert the scores into plain data that can be stored (see cache.py) '''
+    def to_state(self) -> dict:
+        return self.scores
+
+    ''' Rebuild the scores from the output of to_state() '''
+    @classmethod
+    def from_state(cls, half_life: float, state: dict) -> 'Popularity':
+        popularity = cls(half_life)
+        popularity.scores = state
+        return popularity
+
+
+## Module interface ##
+popularity: Popularity = None
+last_lookup: float = 0.0                    # time.monotonic() of the last lookup, to tell when the bot is idle
+history_synced: dict = {}                   # dict: {platform:id: time.monotonic() of the last pre-warm sync}
+task: asyncio.Task = None
+
+# Pre-warming waits on its budget, so it gets a thread of its own rather than holding up the lookup threads
+warm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prewarm")
+
+''' Get the lookup counts, loading them from the cache the first time '''
+async def get_popularity() -> Popularity:
+    global popularity
+    if popularity is None:
+        state = await rocketleague.run_blocking(cache.get, "prewarm", "popularity", {})
+        # Another lookup may have loaded them while this one waited
+        if popularity is None:
+            popularity = Popularity.from_state(config.PREWARM_HALF_LIFE, state)
+    return popularity
+
+''' Count a lookup of a player (called by the commands) '''
+async def record(platform_player_id: str) -> None:
+    global last_lookup
+    last_lookup = time.monotonic()
+    (await get_popularity()).record(platform_player_id)
+
+''' Start pre-warming (called from on_ready, which can run again on a reconnect) '''
+def start() -> None:
+    global task
+    if config.PREWARM and (task is None or task.done()):
+        task = asyncio.get_running_loop().create_task(run())
+
+''' Has the bot been left alone long enough to spend some budget on pre-warming? '''
+def idle() -> bool:
+    if time.monotonic() - last_lookup < config.PREWARM_IDLE:
+        return False
+    # Any lookup or deep search still running
+    return not rocketleague.in_flight and not rocketleague.deep_queue.running and not rocketleague.deep_queue.waiting
+
+''' Pre-warm the most popular players every config.PREWARM_INTERVAL, for as long as the bot runs '''
+async def run() -> None:
+    # The first use of the client pings the API, so don't do it on the event loop
+    api = await rocketleague.run_blocking(network.ballchasing_api)
+    budget = api.budget(config.PREWARM_BUDGET)
+    while True:
+        await asyncio.sleep(config.PREWARM_INTERVAL)
+        lookups = await get_popularity()
+        await rocketleague.run_blocking(cache.set, "prewarm", "popularity", lookups.to_state(), None)
+        for platform_player_id in lookups.top(config.PREWARM_TOP):
+            # Stop as soon as someone needs the bot again
+            if not idle(): break
+            try:
+                await warm(platform_player_id, budget)
+            except Exception as e:
+                # Leave a player that can't be warmed to their next lookup
+                print(f" ! Pre-warming {platform_player_id} failed: {e!r}")
+
+''' Refresh whatever has expired of a player's cached profile, history and responses '''
+async def warm(platform_player_id: str, budget: network.TokenBucket) -> None:
+    '''
+    The profile fields that are still fresh are taken from the cache (see
+    Player.update_replay_object), so a player who hasn't played since the
+    last round only costs the search for their latest replay, if that.
+    '''
+    loop = asyncio.get_running_loop()
+    def on_budget(func):
+        return loop.run_in_executor(warm_executor, network.on_budget, budget, func)
+
+    print(f" > Pre-warming: {platform_player_id}")
+    player = rocketleague.Player(platform_player_id)
+    player.set_id(platform_player_id)
+    await on_budget(player.update_replay_object)
+    await player.update_links()
+    await on_budget(player.update_uploader)
+    await loop.run_in_executor(warm_executor, rocketleague.store_profile, player, rocketleague.profile_embed(player))
+
+    # Only sync a history that is stored in the current format, as a full fetch is split across
+    # other threads (outside the budget) and is what /deep is for
+    if not config.HISTORY_SYNC or ("history", platform_player_id) in rocketleague.in_flight:
+        return
+    state = await loop.run_in_executor(warm_executor, cache.get, "history", platform_player_id)
+    if state is None or state.get("version") != replay_history.STATE_VERSION:
+        return
+    if time.monotonic() - history_synced.get(platform_player_id, float("-inf")) < config.PREWARM_HISTORY_INTERVAL:
+        return
+    history_synced[platform_player_id] = time.monotonic()
+    history = await on_budget(player.fetch_history)
+    await loop.run_in_executor(warm_executor, store_deep, player, history)
+
+''' Store the /deep results of a pre-warm sync, unless a /deep has stored a newer sync of the history in the meantime '''
+def store_deep(player: rocketleague.Player, history: replay_history.History) -> None:
+    stats = rocketleague.history_stats(history, player.platform_player_id)
+    player.apply_history(history, stats)
+    embeds = rocketleague.deep_embeds(stats, f"Details for: {player.replay_object['name']}")
+    # Under the lock, so a /deep can't store its newer history between the check and the store
+    with rocketleague.history_lock:
+        if rocketleague.is_latest_history(history):
+            rocketleague.store_response("deep", player.platform_player_id, player.latest_replay_id, embeds)
@@ -7,17 +7,77 @@ Contains all the functionality associated with Rocket League
 '''
 
 # IMPORTS
-import ballchasing
 import re
-import os
-import requests
+import math
+import random
 import discord
-from datetime import datetime
-import pytz
+import asyncio
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
 # MY IMPORTS
 import config
 import actions
+import cache
+import network
+import scheduler
+import roster
+import history as replay_history
+from history import History, DUPLICATE_ALLOWANCE, replay_datetime, replay_epoch, rfc3339
+
+''' Parse the user input into a tuple in the format (<platform>, <id>) '''
+def parse_target(target: str) -> tuple | None:
+    ''' Input Parsing (Regex)
+
+    Using regular expressions, the user input can be filtered
+    into a tuple in the format (<platform>, <id>)
+
+    The more specific search terms are more efficient and therefore
+    we apply them before the more arbitrary terms.
+    e.g. steam:76561198438198955 will have a lower complexity than
+        any:joryx
+
+    We search replays with the "deep=False" parameter in the
+    ballchasing API because at this stage we don't care about receiving
+    all the stats and instead are just scouting to find the replays.
+
+    '''
+
+    target = target.strip()
+
+    # Set up account id tuple
+    account_id = ("", "")
+    # Check for steam url
+    if re.match("^.*((id)|(profiles))/[a-zA-Z0-9_-]{1,50}/*$", target) is not None:
+        link = target.replace("/", " ").strip()
+        split_link = link.split(" ")
+        account_id = ("steam", split_link[-1])
+    # Check for "platform?id" where ? is [: /]
+    elif re.match("^[a-zA-Z4]{3,5}[: /][a-zA-Z0-9_-]{1,50}$", target) is not None:
+        account_id = tuple(re.split("[: /]", target, 1))
+    # Check for ballchasing url
+    elif re.match("^.*/[a-z4]{3,5}/[a-zA-Z0-9_-]{1,50}/*$", target) is not None:
+        link = target.replace("/", " ").strip()
+        split_link = link.split(" ")
+        account_id = (split_link[-2], split_link[-1])
+    # Check for steam id
+    elif re.match("^7656[0-9]{13}$", target) is not None:
+        account_id = ("steam", target)
+    # Check for "platform?name" where ? is [: /]
+    elif re.match("^[a-zA-Z4]{3,5}[: /].{1,50}$", target) is not None:
+        account_id = tuple(re.split("[: /]", target, 1))
+    # Check for other
+    elif re.match("^.{1,50}$", target) is not None:
+        account_id = ("any", target)
+    # Does not match expected
+    else:
+        return None
+
+    # Account for user stupidity
+    return (account_id[0].strip().lower(), account_id[1].strip())
 
 class Player():
     '''
@@ -27,7 +87,8 @@ class Player():
     def __init__(self, target: str) -> None:
         # Populated from construction
         self.target: str = target.strip()
-        self.ballchasing_api = ballchasing.Api(os.getenv('TOKEN_BALLCHASING'))
+        self.ballchasing_api = network.ballchasing_api() # Shared by every lookup
+        self.steam = network.steam_client()                # Shared by every lookup
 
         # Player information
         self.player_platform_id: str = None # The key player identifier (platform:id)
@@ -36,51 +97,96 @@ class Player():
         self.replay_object: dict = {}       # Deep replay for camera settings and other
         self.links: dict = {}               # Relevant links (Steam, Ballchasing...)
         self.is_uploader: bool = False      # Does the account upload replays?
+        self.latest_replay_id: str = None   # Id of the latest replay, the version of the player's data
 
         # Player stats
+        self.history: History = None        # Raw totals the stats below are developed from
         self.replay_count: int = 0          # Number of replays excluding duplicates
         self.names_time: dict = {}          # dict: {asc(timestamp): playername}
         self.names_count: dict = {}         # dict: {playername: desc(count)}
         self.is_pro: bool = False           # Is the player listed as a pro?
         # Team stats
-        self.team_names_raw: dict = {}      # dict: {teamid: [names]}
         self.team_names: dict = {}          # dict: {teamid: name}
         self.team_count: dict = {}          # dict: {teamid: desc(count)}
         self.team_pro: dict = {}            # dict: {teamid: isPro}
         # Opponent stats
-        self.opp_names_raw: dict = {}       # dict: {oppid: [names]}
         self.opp_names: dict = {}           # dict: {oppid: name}
         self.opp_count: dict = {}           # dict: {oppid: desc(count)}
         self.opp_pro: dict = {}             # dict: {oppid: isPro}
         
     ''' Identify player from the target string '''
-    def locate_target(self) -> bool:
+    async def locate_target(self) -> bool:
+        '''
+        Identical targets looked up at the same time share one search
+        (see resolve_target).
+        '''
+
+        account_id = parse_target(self.target)
+        if account_id is None: # Does not match expected
+            return False
+
+        platform_player_id = await single_flight(("target",) + account_id, run_blocking, self.resolve_target, account_id)
+        print("   - final: " + str(platform_player_id))
+        if platform_player_id is None: # No player found
+            return False
+        self.set_id(platform_player_id)
+        return True
+
+    ''' Set the "platform:id" of the player, once it is known '''
+    def set_id(self, platform_player_id: str) -> None:
+        self.platform_player_id = platform_player_id
+        self.platform, self.player_id = platform_player_id.split(":")
+
+    ''' Find the "platform:id" of a parsed target, or None if there isn't one '''
+    def resolve_target(self, account_id: tuple) -> str | None:
         '''
         The purpose is to confirm a platform and id of the target.
         This can be achieved by first defining the search term for
         ballchasing.com using regex, and then running through a
         sequence of replay searches where the more specific search terms
         get applied first.
+
+        With config.LOCATE_CONCURRENT the searches are all started at once
+        and the highest priority search that succeeds is used, so a miss
+        costs roughly one round trip instead of ten.
+
+        Results are cached against the parsed target, including misses
+        (for a shorter time), so repeat lookups skip the searches entirely.
+
+        Pro names are found in the pro roster (see roster.py) without a
+        search, in the place of the pro name search, so the platform and
+        id searches still come first.
+        '''
+
+        target_key = account_id[0] + ":" + account_id[1]
+        cached = cache.get("target", target_key, cache.MISSING)
+        if cached is not cache.MISSING:
+            return cached
+
+        probes = self.locate_probes(account_id)
+        if config.LOCATE_CONCURRENT:
+            platform_player_id = resolve_concurrent(probes)
+        else:
+            platform_player_id = resolve_sequential(probes)
+        ttl = config.CACHE_TTL_TARGET if platform_player_id is not None else config.CACHE_TTL_TARGET_MISS
+        cache.set("target", target_key, platform_player_id, ttl)
+        return platform_player_id
+
+    ''' Build the replay searches used to locate the target, in priority order '''
+    def locate_probes(self, account_id: tuple) -> list:
+        '''
+        Each probe is a function taking a stop event and returning the
+        "platform:id" of the target, or None if the search found nothing.
+        Probes are independent of each other, which is what allows them
+        to be run concurrently. A probe should check the stop event before
+        each request so that lower priority probes can be abandoned once
+        a higher priority probe has succeeded.
         '''
 
         # Helper function for this method
         def steam_get_id_from_vanity(vanity: str) -> str | None:
-    
-            steam_api_request = f"http://api.steampowered.com/ISteamUser/ResolveVanityURL/v0001/?key={os.getenv('TOKEN_STEAM')}&vanityurl={vanity}"
-            
-            headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36'}
-            page = requests.get(steam_api_request, headers=headers)
-            
-            # Page found
-            if page.status_code == 200:
-                # Parse the json response
-                _json = page.json()
-                
-                try:
-                    return _json['response']['steamid']
-                except KeyError:
-                    return None
-            return None
+            # The probes run in worker threads, so hand the request over to the event loop
+            return self.steam.run_threadsafe(self.steam.resolve_vanity(vanity))
         
         # Helper function for this method
         def replay_check_teams_for_player(mode: int, replay: dict, account_id: tuple) -> str:
@@ -108,52 +214,10 @@ class Player():
                 platform_player_id = check_team("orange")
             return platform_player_id
 
-        ''' Input Parsing (Regex)
-
-        Using regular expressions, the user input can be filtered
-        into a tuple in the format (<platform>, <id>)
-
-        The more specific search terms are more efficient and therefore
-        we apply them before the more arbitrary terms.
-        e.g. steam:76561198438198955 will have a lower complexity than
-            any:joryx
-
-        We search replays with the "deep=False" parameter in the
-        ballchasing API because at this stage we don't care about receiving
-        all the stats and instead are just scouting to find the replays.
-
-        '''
-
-        # Set up account id tuple
-        account_id = ("", "")
-        # Check for steam url
-        if re.match("^.*((id)|(profiles))/[a-zA-Z0-9_-]{1,50}/*$", self.target) is not None:
-            link = self.target.replace("/", " ").strip()
-            split_link = link.split(" ")
-            account_id = ("steam", split_link[-1])
-        # Check for "platform?id" where ? is [: /]
-        elif re.match("^[a-zA-Z4]{3,5}[: /][a-zA-Z0-9_-]{1,50}$", self.target) is not None:
-            account_id = tuple(re.split("[: /]", self.target, 1))
-        # Check for ballchasing url
-        elif re.match("^.*/[a-z4]{3,5}/[a-zA-Z0-9_-]{1,50}/*$", self.target) is not None:
-            link = self.target.replace("/", " ").strip()
-            split_link = link.split(" ")
-            account_id = (split_link[-2], split_link[-1])
-        # Check for steam id
-        elif re.match("^7656[0-9]{13}$", self.target) is not None:
-            account_id = ("steam", self.target)
-        # Check for "platform?name" where ? is [: /]
-        elif re.match("^[a-zA-Z4]{3,5}[: /].{1,50}$", self.target) is not None:
-            account_id = tuple(re.split("[: /]", self.target, 1))
-        # Check for other
-        elif re.match("^.{1,50}$", self.target) is not None:
-            account_id = ("any", self.target)
-        # Does not match expected
-        else:
-            return False
-
-        # Account for user stupidity
-        account_id = (account_id[0].strip().lower(), account_id[1].strip())
+        # Helper function for this method
+        def first_replay(**params) -> dict | None:
+            # We only need to know whether a replay exists, so only ever ask for one
+            return next(self.ballchasing_api.get_replays(sort_by="replay-date", deep=False, count=1, **params), None)
 
         ''' Replay Searches
 
@@ -177,97 +241,128 @@ class Player():
         This should pick up all the stragglers.
         '''
 
+        probes = []
+
         # Search by player_id (platform:id)
-        self.platform_player_id = account_id[0] + ":" + account_id[1]
-        print("   - 1: " + self.platform_player_id)
-        try:
-            next(self.ballchasing_api.get_replays(player_id=self.platform_player_id, sort_by="replay-date", deep=False, count=1))
-            self.platform, self.player_id = self.platform_player_id.split(":")
-            return True
-        except StopIteration: # does not appear in any replays
-            pass
+        def probe_platform_id(stop):
+            platform_player_id = account_id[0] + ":" + account_id[1]
+            print("   - 1: " + platform_player_id)
+            if first_replay(player_id=platform_player_id) is not None:
+                return platform_player_id
+            return None
+        probes.append(probe_platform_id)
 
         # Search by name (PRO) FROM RLCS REFEREE
-        try:    
-            replay = next(self.ballchasing_api.get_replays(player_name=f'"{account_id[1]}"', uploader="76561199225615730", sort_by="replay-date", deep=False, count=1, pro="true"))
-            self.platform_player_id = replay_check_teams_for_player(1, replay, account_id)
-            print("   - 2: " + self.platform_player_id)
-            self.platform, self.player_id = self.platform_player_id.split(":")
-            return True
-        except StopIteration: # does not appear in any replays
-            pass
+        def probe_referee_name(stop):
+            if stop.is_set(): return None
+            replay = first_replay(player_name=f'"{account_id[1]}"', uploader="76561199225615730", pro="true")
+            if replay is None: return None
+            platform_player_id = replay_check_teams_for_player(1, replay, account_id)
+            print("   - 2: " + str(platform_player_id))
+            return platform_player_id
+        probes.append(probe_referee_name)
 
-        
         # If steam url
         if account_id[0] == "steam":
             # Search by Steam (we know it's a Steam account)
-            if (steam_id := steam_get_id_from_vanity(account_id[1])) is not None:
-                self.platform_player_id = "steam:" + steam_id
-                print("   - 3: " + self.platform_player_id)
-                self.platform, self.player_id = self.platform_player_id.split(":")
-                return True
-            
+            def probe_steam_vanity(stop):
+                if stop.is_set(): return None
+                if (steam_id := steam_get_id_from_vanity(account_id[1])) is not None:
+                    print("   - 3: steam:" + steam_id)
+                    return "steam:" + steam_id
+                return None
+            probes.append(probe_steam_vanity)
+
         # Search by id (w/o platform)
         if account_id[0] == "any":
             for platform in config.PLATFORMS:
-                self.platform_player_id = platform + ":" + account_id[1]
-                print("   - 4: " + self.platform_player_id)
-                try:
-                    replay = next(self.ballchasing_api.get_replays(player_id=self.platform_player_id, sort_by="replay-date", deep=False, count=1))
-                    if platform != "ps4":
-                        print("   - 5: " + self.platform_player_id)
-                        self.platform, self.player_id = self.platform_player_id.split(":")
-                        return True
-                except StopIteration: # does not appear in any replays
-                    pass
+                # A ps4 id on its own is never accepted, so there is no point searching for it
+                if platform == "ps4": continue
+                def probe_id_on_platform(stop, platform=platform):
+                    if stop.is_set(): return None
+                    platform_player_id = platform + ":" + account_id[1]
+                    print("   - 4: " + platform_player_id)
+                    if first_replay(player_id=platform_player_id) is not None:
+                        print("   - 5: " + platform_player_id)
+                        return platform_player_id
+                    return None
+                probes.append(probe_id_on_platform)
 
         # Search by name (PRO)
-        try:
-            replay = next(self.ballchasing_api.get_replays(player_name=f'"{account_id[1]}"', sort_by="replay-date", deep=False, count=1, pro="true"))
-            self.platform_player_id = replay_check_teams_for_player(1, replay, account_id)
-            print("   - 6: " + str(self.platform_player_id))
-            self.platform, self.player_id = self.platform_player_id.split(":")
-            return True
-        except StopIteration: # does not appear in any replays
-            pass
+        def probe_pro_name(stop):
+            # Any pro in the roster, whoever uploaded the replays they were seen in
+            if (platform_player_id := roster.lookup(account_id)) is not None:
+                print("   - 6: " + platform_player_id + " (roster)")
+                return platform_player_id
+            # Only pros seen since the roster was built are in it, so still search for the rest
+            if stop.is_set(): return None
+            replay = first_replay(player_name=f'"{account_id[1]}"', pro="true")
+            if replay is None: return None
+            platform_player_id = replay_check_teams_for_player(1, replay, account_id)
+            print("   - 6: " + str(platform_player_id))
+            return platform_player_id
+        probes.append(probe_pro_name)
 
         # Search by name (non PRO) (specific platform)
         if account_id[0] != "any":
-            try:    
-                replay = next(self.ballchasing_api.get_replays(player_name=f'"{account_id[1]}"', sort_by="replay-date", deep=False, count=1))
-                self.platform_player_id = replay_check_teams_for_player(2, replay, account_id)
-                print("   - 7: " + str(self.platform_player_id))
-                self.platform, self.player_id = self.platform_player_id.split(":")
-                return True
-            except StopIteration: # does not appear in any replays
-                pass
+            def probe_platform_name(stop):
+                if stop.is_set(): return None
+                replay = first_replay(player_name=f'"{account_id[1]}"')
+                if replay is None: return None
+                platform_player_id = replay_check_teams_for_player(2, replay, account_id)
+                print("   - 7: " + str(platform_player_id))
+                return platform_player_id
+            probes.append(probe_platform_name)
 
         # Search by Steam (we don't know if it's a Steam account)
-        if (steam_id := steam_get_id_from_vanity(account_id[1])) is not None:
-            try:
-                next(self.ballchasing_api.get_replays(player_name=f'"steam:{steam_id}"', sort_by="replay-date", deep=False, count=1))
-                self.platform_player_id = "steam:" + steam_id
-                print("   - 8: " + self.platform_player_id)
-                self.platform, self.player_id = self.platform_player_id.split(":")
-                return True
-            except StopIteration:
-                pass
+        def probe_steam_fallback(stop):
+            if stop.is_set(): return None
+            if (steam_id := steam_get_id_from_vanity(account_id[1])) is None: return None
+            if stop.is_set(): return None
+            if first_replay(player_name=f'"steam:{steam_id}"') is None: return None
+            print("   - 8: steam:" + steam_id)
+            return "steam:" + steam_id
+        probes.append(probe_steam_fallback)
 
         # Search by name (non PRO) ("any" platform)
-        try:
-            replay = next(self.ballchasing_api.get_replays(player_name=f'"{account_id[1]}"', sort_by="replay-date", deep=False, count=1))
-            self.platform_player_id = replay_check_teams_for_player(0, replay, account_id)
-            print("   - 9: " + str(self.platform_player_id))
-            self.platform, self.player_id = self.platform_player_id.split(":")
-            return True
-        except StopIteration: # does not appear in any replays
-            pass
-
-        # No player found
-        print("   - 10: " + str(self.platform_player_id))
-        self.platform_player_id = None
-        print("   - final: " + str(self.platform_player_id))
-        return False
+        def probe_any_name(stop):
+            if stop.is_set(): return None
+            replay = first_replay(player_name=f'"{account_id[1]}"')
+            if replay is None: return None
+            platform_player_id = replay_check_teams_for_player(0, replay, account_id)
+            print("   - 9: " + str(platform_player_id))
+            return platform_player_id
+        probes.append(probe_any_name)
+
+        return probes
+
+    ''' Get the latest replay, links and uploader status of the player '''
+    async def update_profile(self):
+        # Lookups of the same player at the same time share one set of requests
+        located = await single_flight(("profile", self.platform_player_id), self.fetch_profile)
+        self.replay_object = located.replay_object
+        self.links = located.links
+        self.is_uploader = located.is_uploader
+        self.latest_replay_id = located.latest_replay_id
+
+    ''' Run the profile lookups, returning the player they were stored on '''
+    async def fetch_profile(self) -> 'Player':
+        # The lookups are independent of each other, so run them side by side
+        await asyncio.gather(
+            run_blocking(self.update_replay_object),
+            self.update_links(),
+            run_blocking(self.update_uploader)
+        )
+        return self
+
+    ''' Get the id of the player's latest replay (or the one found by the last lookup, if it was recent) '''
+    def find_latest_replay_id(self) -> str:
+        replay_id = cache.get("profile_latest", self.platform_player_id)
+        if replay_id is None:
+            replay_id = next(self.ballchasing_api.get_replays(player_id=self.platform_player_id, playlist=config.REPLAY_PLAYLIST, sort_by="replay-date", deep=False, count=1))['id']
+            # We are not concerned with StopIteration error, as we know there will be a replay if we got this far
+            cache.set("profile_latest", self.platform_player_id, replay_id, config.CACHE_TTL_PROFILE_LATEST)
+        return replay_id
 
     ''' Get a player object by id (steam:76561198438198955) '''
     def update_replay_object(self):
@@ -282,17 +377,27 @@ class Player():
         - steering sensitivity
         - last used car
 
-        This time when we search replays, we are going to grab all
-        the information about the replay by using the "deep=True"
-        parameter in the ballchasing API. This is less efficient
-        but some of the information we require is only available
-        like this.
+        Some of the information we require is only available from the
+        full replay, which is an extra request on top of the search. The
+        player object is stored with the id of the replay it came from
+        (see config.CACHE_TTL_PROFILE_REPLAY), so a cheap search for the
+        id of the latest replay is enough to tell whether it is still
+        current, and the full replay is only fetched when it isn't.
         '''
-        
-        # Get the player's latest replay (using deep=True to get all stats)
-        replay = next(self.ballchasing_api.get_replays(player_id=self.platform_player_id, playlist=config.REPLAY_PLAYLIST, sort_by="replay-date", deep=True, count=1))
-        # We are not concerned with StopIteration error, as we know there will be a replay if we got this far
-        
+
+        replay_id = self.find_latest_replay_id()
+        self.latest_replay_id = replay_id
+
+        # No new replays since the player object was stored
+        stored = cache.get("profile_replay", self.platform_player_id)
+        if stored is not None and stored["replay_id"] == replay_id:
+            print("   - profile: cached")
+            self.replay_object = stored["player"]
+            return
+
+        # Get the full replay for all the stats
+        replay = self.ballchasing_api.get_replay(replay_id)
+
         # Find player in the replay
         target_player = None
         for player in replay['blue']['players']: # blue
@@ -310,265 +415,574 @@ class Player():
                     break
         target_player["replaydate"] = replay["date"].split("T")[0]
         self.replay_object = target_player
+        cache.set("profile_replay", self.platform_player_id, {"replay_id": replay_id, "player": target_player}, config.CACHE_TTL_PROFILE_REPLAY)
 
     ''' Update the relevant links (steam, ballchasing...) '''
-    def update_links(self):
+    async def update_links(self):
+        cached = await run_blocking(cache.get, "profile_links", self.platform_player_id)
+        if cached is not None:
+            self.links.update(cached)
+            return
+
         ballchasing_url = "https://ballchasing.com/player/{}/{}".format(self.platform, self.player_id)
 
         # Get the target's Steam link if applicable
         steam_url = "~~Steam~~"
         avatar_url = ""
+        summary = None
         if self.platform == "steam":
-
-            steam_api_request = f"http://api.steampowered.com/ISteamUser/GetPlayerSummaries/v0002/?key={os.getenv('TOKEN_STEAM')}&steamids={self.player_id}"
-            
-            headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36'}
-            page = requests.get(steam_api_request, headers=headers)
-            
-            # Page found
-            if page.status_code == 200:
-                # Parse the json response
-                _json = page.json()
-                try:
-                    steam_url = _json['response']['players'][0]['profileurl'].removesuffix("/")
-                    avatar_url = _json['response']['players'][0]['avatarfull']
-                    
-                except KeyError:
-                    pass
-        self.links.update({"Ballchasing": ballchasing_url,
+            summary = await self.steam.get_summary(self.player_id)
+            if summary is not None:
+                steam_url = summary['profileurl'].removesuffix("/")
+                avatar_url = summary['avatarfull']
+        links = {"Ballchasing": ballchasing_url,
                 "Steam": steam_url,
-                "Avatar": avatar_url})
+                "Avatar": avatar_url}
+        self.links.update(links)
+        # A missing summary may just be Steam having a moment, so try again next time
+        if self.platform != "steam" or summary is not None:
+            await run_blocking(cache.set, "profile_links", self.platform_player_id, links, config.CACHE_TTL_PROFILE_LINKS)
 
     ''' Check whether the player uploads replays to ballchasing.com '''
     def update_uploader(self):
+        cached = cache.get("profile_uploader", self.platform_player_id)
+        if cached is not None:
+            self.is_uploader = cached
+            return
+
         try:
             player_id = int(self.player_id) # Throws a ValueError if the user is not on Steam
             next(self.ballchasing_api.get_replays(uploader=player_id, sort_by="replay-date", deep=False, count=1)) # throws a StopIteration error if there are no items in the generator
             self.is_uploader = True
         except (ValueError, StopIteration): # User is not a uploader
             self.is_uploader = False
+        cache.set("profile_uploader", self.platform_player_id, self.is_uploader, config.CACHE_TTL_PROFILE_UPLOADER)
 
-    ''' Retrieve deep stats from all the replays that the target appears in '''
-    def update_history(self):
-        ''' Helper function defining how to parse the teams in a replay object '''
-        def iter_teams(replay, colour):
-            is_player_team = False
-            team_members = [] # List of players in this team
+    ''' Retrieve the history of all the replays that the target appears in '''
+    def fetch_history(self, progress: 'DeepProgress' = None) -> History:
+        '''
+        The history is stored between lookups (config.HISTORY_SYNC), so a
+        repeat /deep only has to fetch the replays uploaded since the last
+        sync and add them to the stored totals.
 
-            try:
-                # Loop through the players in this team
-                for player in (replay[colour]['players']):
-                        try:
-                            # Add the relevant player information to the team_members list
-                            team_members.append((f"{player['id']['platform']}:{player['id']['id']}", player['name'], True if "pro" in player.keys() else False))
-
-                            if player['id']['id'] == self.player_id:
-                                ''' Perform actions on TARGET '''
-                                self.names_time[replay['date']] = player['name']
-
-                                # Is the target a pro, or listed as a pro already?
-                                if not self.is_pro: self.is_pro = True if "pro" in player.keys() else False
-                                ''' End actions on TARGET '''
-
-                                # Set the flag to confirm that we are currently looping through the target's team
-                                is_player_team = True
-                                continue
-
-                        except KeyError:
-                            ''' Occasionally, a ghost player exists in a replay that does not appear in the team, 
-                            but does make the "team size" greater - often if someone spectates or changes team '''
-                            continue
-            except KeyError:
-                ''' In rare instances, there are no players present on a team
-                We need to make sure the code just skips along if this happens '''
-                return
+        A first /deep on a long history is split into date ranges that are
+        fetched side by side (config.HISTORY_PARTITIONS), so it is bounded
+        by the API rate limits rather than by one request after another.
 
-            
-            if is_player_team:
-                ''' Perform actions on TEAM '''
-                # Loop back through the players
-                for i in range(0, len(replay[colour]['players'])):
-                    try:
-                        # Skip the target player since they aren't their own teammate
-                        if team_members[i][0] == self.platform_player_id: continue
-
-                        # Initialise an empty list in case this is the player's first appearance
-                        name_list = []
-                        # Check whether the player is a pro (1) from this iteration
-                        pro = True if team_members[i][2] else False
-
-                        # Check whether the player has appeared in previous iterations
-                        if team_members[i][0] in self.team_names_raw.keys():
-                            # Add the player's name to their list of other names (duplicates allowed)
-                            name_list = self.team_names_raw[team_members[i][0]]
-                            # Check whether player is a pro (2) from previous iterations
-                            pro = True if pro or self.team_pro[team_members[i][0]] else False
-                        
-                        # Update the master lists of teammates to include the player's current appearance
-                        self.team_names_raw[team_members[i][0]] = name_list + [team_members[i][1]]
-                        self.team_pro[team_members[i][0]] = pro
-
-                    except (KeyError, IndexError):
-                        ''' Occasionally, a ghost player exists in a replay that does not appear in the team, 
-                        but does make the "team size" greater - often if someone spectates or changes team '''
-                        continue
-                ''' End actions on TEAM '''
-
-            else:
-                ''' Perform actions on OPPOSITION '''
-                # Loop back through the players
-                for i in range(0, len(replay[colour]['players'])):
-                    try:
-                        # Initialise an empty list in case this is the player's first appearance
-                        name_list = []
-                        # Check whether the player is a pro (1) from this iteration
-                        pro = True if team_members[i][2] else False
-
-                        # Check whether the player has appeared in previous iterations
-                        if team_members[i][0] in self.opp_names_raw.keys():
-                            # Add the player's name to their list of other names (duplicates allowed)
-                            name_list = self.opp_names_raw[team_members[i][0]]
-                            # Check whether player is a pro (2) from previous iterations
-                            pro = True if pro or self.opp_pro[team_members[i][0]] else False
-                        
-                        # Update the master lists of teammates to include the player's current appearance
-                        self.opp_names_raw[team_members[i][0]] = name_list + [team_members[i][1]]
-                        self.opp_pro[team_members[i][0]] = pro
-
-                    except IndexError:
-                        ''' Occasionally, a ghost player exists in a replay that does not appear in the team, 
-                        but does make the "team size" greater - often if someone spectates or changes team '''
-                        continue
-                ''' End actions on OPPOSITION '''
-                pass
-        
-        ''' Helper function to format the timestamps present in replays and check for duplicates '''
-        def is_same_time(x, y) -> bool:
-            # First replay gets caught here, other errors will be caught too
-            if x is None or y is None:
-                return False
-            
-            # Some replays are formatted with a "Z" on the end and datetime module doesn't like that
-            x = x.removesuffix("Z")
-            y = y.removesuffix("Z")
+        If a progress tracker is given, it is shown the totals as replays
+        arrive, and raises SearchCancelled (nothing is stored) if the
+        search is stopped early.
 
-            # Set the default timezone (Most OCE are in Melbourne timezone)
-            tz = pytz.timezone("Australia/Melbourne")
+        A first /deep is checkpointed as it goes (see fetch_history_range),
+        so if it is stopped, fails or the bot restarts, the next /deep of
+        the player carries on from where it got to.
+        '''
 
-            # Convert string to datetime object for calculations
-            x = datetime.fromisoformat(x)
-            y = datetime.fromisoformat(y)
+        history = None
+        if config.HISTORY_SYNC:
+            state = cache.get("history", self.platform_player_id)
+            if state is not None and state.get("version") == replay_history.STATE_VERSION:
+                history = History.from_state(state)
 
-            # Check if timezone info needs to be added and add it
-            if x.tzinfo is None or x.tzinfo.utcoffset(x) is None:
-                x = tz.localize(x)
-            if y.tzinfo is None or y.tzinfo.utcoffset(y) is None:
-                y = tz.localize(y)
+        if history is not None:
+            self.sync_history(history, progress)
+        else:
+            history = self.fetch_history_partitioned(progress)
+        print(f"   - {history.replay_count}") # Total replays parsed
 
-            # How close together replays have to be to be considered duplicates
-            # We would use the match GUID, but the simple search we're using from ballchasing doesn't include that
-            # and a deep search would take 20x as long
-            allowance = 60 # seconds
+        if config.HISTORY_SYNC:
+            store_history(history)
+
+        return history
+
+    ''' Add the replays uploaded since the history was last synced '''
+    def sync_history(self, history: History, progress: 'DeepProgress' = None):
+        # Only ask for the uploads since the last sync (if there was one)
+        search = {}
+        if history.last_created is not None:
+            search["created_after"] = history.last_created
+            print(f"   - Syncing {history.replay_count} replays from {history.last_created}")
 
-            try:
-                # Check if the times are within the allowance
-                if abs((x-y).total_seconds()) < allowance:
-                    return True # The replays have been determined to be the same match: skip this replay
-            except TypeError:
-                ''' Catches instances where either date is in an invalid format '''
-                pass
-            
-            # The replays have been determined to be separate matches: continue as normal
-            return False
-        
         # Get replays from ballchasing.com - returns a generator
-        replays = self.ballchasing_api.get_replays(player_id=self.platform_player_id, deep=False, count=50000) # count can be unlimited
-        
-        # If it's the first replay, there isn't a last replay date
-        last_replay_date = None
+        replays = self.ballchasing_api.get_replays(player_id=self.platform_player_id, deep=False, count=50000, **search) # count can be unlimited
 
         try:
             for replay in replays:
-                # Use helper func to determine whether current replay is the same match as the previous replay
-                if is_same_time(last_replay_date, replay['date']): continue
-                # Set the last replay date to this replay's date for next iteration
-                last_replay_date = replay['date']
-
-                # Print a value every 1000 replays for monitoring purposes
-                if self.replay_count % 1000 == 0: print(f"   - {self.replay_count}: {replay['date']}")
-                self.replay_count += 1
-
-                # Use helper func to iterate through the blue and orange team, getting relevant stats
-                iter_teams(replay, "blue")
-                iter_teams(replay, "orange")
+                # The upload filter may include the replays from the edge of the last sync
+                if history.is_synced(replay): continue
+                history.mark_synced(replay)
+                # Duplicates of matches from this or any previous sync are skipped by the history
+                history.add_replay(replay)
+                if progress is not None: progress.update(history)
 
         except StopIteration:
             ''' If generator object runs out of values, catch it here '''
-            print(f"   - {self.replay_count}") # Total replays parsed
             pass
-        
-        # Data transformations to develop stats profile from raw data
-
-        '''{date: name}         =>      {asc(date): name} 
-        names_time = {          =>      names_time = {
-            "date2": "name1",                "date1": "name1",
-            "date1": "name1",                "date2": "name1",
-            "date3": "name2",                "date3": "name2",
-            "date4": "name3"                 "date4"...
-        }                               }'''
-        self.names_time = dict(sorted(self.names_time.items(), key=lambda i: i, reverse=False))
-
-        '''{date: name}         =>      {name: count(names)}    =>      {name: desc(count(names))}
-        names_time = {          =>      names_count = {                 names_count = {
-            "date": "name2",                "name1": "1",                   "name2": "2",
-            "date": "name1",                "name2": "2",                   "name1": "1",
-            "date": "name2",                "name3": "1",                   "name3": "1",
-            "date": "name3"                 "name4": ...                    "name4": ...
-        }                               }                               }'''
-        # Middle is defined as = {i: list(self.names_time.values()).count(i) for i in self.names_time.values()}
-        self.names_count = dict(sorted( {i: list(self.names_time.values()).count(i) for i in self.names_time.values()}.items(), key=lambda i: i[1], reverse=True))
-
-        '''{id: [names]}                    =>      {id: popular(name)}
-        team_names_raw = {                  =>      team_names = {
-            "id": "[name1, name2, ...]",                "id": "name1",
-            "id": "[name1, name2, ...]",                "id": "name5",
-            "id": "[name1, name2, ...]",                "id": "name2",
-            "id": "[name1, name2, ...]"                 "id": ...
-        }                                           }'''
-        self.team_names = { i: max(set(self.team_names_raw[i]), key=list(self.team_names_raw[i]).count) for i in self.team_names_raw.keys()}
-
-        '''{id: [names]}                    =>      {id: count(names)}      =>      {id: desc(count(names))}
-        team_names = {                      =>      middle = {              =>     team_count = {
-            "id": "[name1, name2, ...]",                "id": "10",                     "id": "13",
-            "id": "[name1, name2, ...]",                "id": "6",                      "id": "10",
-            "id": "[name1, name2, ...]",                "id": "13",                     "id": "6",
-            "id": "[name1, name2, ...]"                 "id": ...                       "id": ...
-        }                                           }                               }'''
-        # Middle is defined as = {i: len(list(self.team_names[i])) for i in self.team_names.keys()}
-        self.team_count = dict(sorted( {i: len(list(self.team_names_raw[i])) for i in self.team_names_raw.keys()}.items(), key=lambda i: i[1], reverse=True))
-
-        '''{id: [names]}                    =>      {id: popular(name)}
-        opp_names_raw = {                   =>      opp_names = {
-            "id": "[name1, name2, ...]",                "id": "name1",
-            "id": "[name1, name2, ...]",                "id": "name5",
-            "id": "[name1, name2, ...]",                "id": "name2",
-            "id": "[name1, name2, ...]"                 "id": ...
-        }                                           }'''
-        self.opp_names = { i: max(set(self.opp_names_raw[i]), key=list(self.opp_names_raw[i]).count) for i in self.opp_names_raw.keys()}
-
-        '''{id: [names]}                    =>      {id: count(names)}      =>      {id: desc(count(names))}
-        opp_names = {                       =>      middle = {              =>     opp_count = {
-            "id": "[name1, name2, ...]",                "id": "10",                     "id": "13",
-            "id": "[name1, name2, ...]",                "id": "6",                      "id": "10",
-            "id": "[name1, name2, ...]",                "id": "13",                     "id": "6",
-            "id": "[name1, name2, ...]"                 "id": ...                       "id": ...
-        }                                           }                               }'''
-        # Middle is defined as = {i: len(list(self.opp_names[i])) for i in self.opp_names.keys()}
-        self.opp_count = dict(sorted( {i: len(list(self.opp_names_raw[i])) for i in self.opp_names_raw.keys()}.items(), key=lambda i: i[1], reverse=True))
 
+    ''' Fetch the whole history as date ranges in parallel and merge them '''
+    def fetch_history_partitioned(self, progress: 'DeepProgress' = None) -> History:
+        # A fetch that was cut short carries on with the date ranges it started with (see fetch_history_range)
+        plan = cache.get("checkpoint", self.platform_player_id)
+        if plan is not None and plan["version"] == replay_history.STATE_VERSION:
+            ranges = [tuple(bounds) for bounds in plan["ranges"]]
+            print(f"   - Resuming {len(ranges)} date ranges")
+        elif config.HISTORY_PARTITIONS > 1:
+            span = self.history_span()
+            if span is None:
+                return History(self.platform_player_id, config.HISTORY_TOP_K)
+
+            # Split the span into equal date ranges, but don't bother splitting short histories
+            start, end = span
+            count = max(1, min(config.HISTORY_PARTITIONS, int((end - start) / config.HISTORY_PARTITION_MIN_SPAN)))
+            ranges = date_ranges(start, end, count)
+            print(f"   - Fetching {count} date ranges from {rfc3339(start)} to {rfc3339(end)}")
+        else:
+            ranges = [(None, None)]
+        cache.set("checkpoint", self.platform_player_id, {"version": replay_history.STATE_VERSION, "ranges": ranges}, config.CACHE_TTL_CHECKPOINT)
+
+        partitions = partition_executor.map(lambda bounds: network.in_background(self.fetch_history_range, *bounds, progress), ranges)
+
+        # The replays on the edges of each range are only added once every range has been merged
+        history = History(self.platform_player_id, config.HISTORY_TOP_K)
+        for partition in partitions:
+            history.merge(partition)
+        history.add_held()
+
+        # The whole history is in, so there is nothing left to resume
+        for after, before in ranges:
+            cache.delete("checkpoint", checkpoint_key(self.platform_player_id, after, before))
+        cache.delete("checkpoint", self.platform_player_id)
+        return history
+
+    ''' Find the dates of the player's oldest and newest replays, or None if there are none '''
+    def history_span(self) -> tuple | None:
+        newest = next(self.ballchasing_api.get_replays(player_id=self.platform_player_id, sort_by="replay-date", sort_dir="desc", deep=False, count=1), None)
+        oldest = next(self.ballchasing_api.get_replays(player_id=self.platform_player_id, sort_by="replay-date", sort_dir="asc", deep=False, count=1), None)
+        if newest is None or oldest is None:
+            return None
+        return replay_datetime(oldest['date']), replay_datetime(newest['date'])
+
+    ''' Estimate the stats profile from a sample of replays spread over the whole history '''
+    def sample_history(self) -> dict:
+        '''
+        The history is split into config.DEEP_SAMPLE_STRATA equal date ranges,
+        and a random sample of slices of time is taken from each (see
+        sample_history_range). The counts are then scaled up range by range
+        (see history.estimate_aggregates), so a quick /deep costs a few dozen
+        requests however long the history is.
+        '''
+        span = self.history_span()
+        if span is None:
+            return replay_history.estimate_aggregates(self.platform_player_id, [])
+
+        # The slices need both ends of every range, so the open ends are closed just past the oldest and newest replays
+        ranges = [
+            (after or rfc3339(span[0] - timedelta(seconds=1)), before or rfc3339(span[1] + timedelta(seconds=1)))
+            for after, before in date_ranges(*span, config.DEEP_SAMPLE_STRATA)
+        ]
+        size = min(200, max(2, config.DEEP_SAMPLE_SIZE // config.DEEP_SAMPLE_STRATA)) # A page holds at most 200 replays
+        print(f"   - Sampling {len(ranges)} date ranges from {rfc3339(span[0])} to {rfc3339(span[1])}")
+        strata = partition_executor.map(lambda bounds: network.in_background(self.sample_history_range, *bounds, size), ranges)
+        return replay_history.estimate_aggregates(self.platform_player_id, list(strata))
+
+    ''' Sample one date range, returning (clusters, slices) for history.estimate_aggregates '''
+    def sample_history_range(self, after: str, before: str, size: int) -> tuple:
+        '''
+        The range is cut into equal slices of time of about
+        config.DEEP_SAMPLE_SLICE replays each, and enough slices for about
+        size replays are picked at random, with every replay in each of them
+        fetched. Each replay is as likely to be sampled as any other, where
+        just taking the newest replays would only tell us about the end of
+        the range. A range with no more than size replays is fetched in full.
+        clusters holds (history, fetched, total) for each slice picked.
+        '''
+        search = {"player-id": self.platform_player_id, "sort-by": "replay-date", "sort-dir": "desc"}
+        total = self.ballchasing_api.get_replay_page(**search, count=1, **{"replay-date-after": after, "replay-date-before": before}).get('count', 0)
+        if total == 0:
+            return [], 1
+        if total <= size:
+            slices, picked = 1, [(after, before)]
+        else:
+            start, end = replay_datetime(after), replay_datetime(before)
+            slices = max(2, math.ceil(total / config.DEEP_SAMPLE_SLICE))
+            bounds = [rfc3339(start + (end - start) * i / slices) for i in range(slices + 1)]
+            # At least two slices, so there is a variance between them to give the margin of error
+            chosen = random.sample(range(slices), min(slices, max(2, math.ceil(size / config.DEEP_SAMPLE_SLICE))))
+            picked = [(bounds[i], bounds[i + 1]) for i in sorted(chosen, reverse=True)]
+
+        clusters = []
+        for slice_after, slice_before in picked:
+            # A page holds at most 200 replays, so a slice busier than that is scaled up from its newest (see estimate_aggregates)
+            page = self.ballchasing_api.get_replay_page(**search, count=200, **{"replay-date-after": slice_after, "replay-date-before": slice_before})
+            history = History(self.platform_player_id)
+            replays = page.get('list', [])
+            for replay in replays:
+                history.add_replay(replay)
+            clusters.append((history, len(replays), page.get('count', len(replays))))
+        return clusters, slices
+
+    ''' Fetch the replays in one date range (newest first) '''
+    def fetch_history_range(self, after: str | None, before: str | None, progress: 'DeepProgress' = None) -> History:
+        '''
+        The totals so far are checkpointed every config.DEEP_CHECKPOINT_INTERVAL
+        replays, whenever the fetch fails or is stopped, and once it is done,
+        along with the date of the oldest replay reached (the cursor). A
+        retry carries on from the cursor instead of from the newest replay.
+        A replay at the cursor itself may be fetched twice, but the second
+        is skipped as a duplicate.
+        '''
+        key = checkpoint_key(self.platform_player_id, after, before)
+        history, cursor, done = load_checkpoint(key)
+        if done:
+            return history
+        if history is None:
+            history = History(self.platform_player_id, config.HISTORY_TOP_K)
+        else:
+            print(f"   - Resuming {history.replay_count} replays from {cursor}")
+
+        search = {}
+        if after is not None: search["replay_after"] = after
+        if cursor is not None: search["replay_before"] = cursor
+        elif before is not None: search["replay_before"] = before
+        replays = self.ballchasing_api.get_replays(player_id=self.platform_player_id, sort_by="replay-date", sort_dir="desc", deep=False, count=50000, **search)
+
+        # A replay close to the upper bound may be a duplicate of one in the next range, which we can't see yet
+        boundary = replay_epoch(before) if before is not None else None
+
+        fetched = 0
+        try:
+            for replay in replays:
+                cursor = replay['date']
+                history.mark_synced(replay)
+                epoch = replay_epoch(replay['date'])
+                if boundary is not None and epoch is not None and boundary - epoch < DUPLICATE_ALLOWANCE:
+                    history.held.append(replay)
+                    continue
+                history.add_replay(replay)
+                fetched += 1
+                if fetched % config.DEEP_CHECKPOINT_INTERVAL == 0: save_checkpoint(key, history, cursor)
+                if progress is not None: progress.update(history, (after, before))
+        except Exception:
+            save_checkpoint(key, history, cursor)
+            raise
+        save_checkpoint(key, history, cursor, done=True)
+        return history
+
+    ''' Copy the stats profile of a history (see history_stats) onto the player '''
+    def apply_history(self, history: History, aggregates: dict):
+        self.history = history
+        self.replay_count = aggregates["replay_count"]
+        self.names_time = aggregates["names_time"]
+        self.names_count = aggregates["names_count"]
+        self.is_pro = aggregates["is_pro"]
+        self.team_names = aggregates["team_names"]
+        self.team_count = aggregates["team_count"]
+        self.team_pro = aggregates["team_pro"]
+        self.opp_names = aggregates["opp_names"]
+        self.opp_count = aggregates["opp_count"]
+        self.opp_pro = aggregates["opp_pro"]
+
+
+class SearchCancelled(Exception):
+    ''' Raised in the fetch when a /deep search is stopped before it finishes '''
+
+class DeepProgress():
+    '''
+    Shows the totals of a /deep search while the history is being fetched
+    The fetch calls update() from its worker threads for every replay, and at
+    most once every config.DEEP_PROGRESS_INTERVAL seconds the totals so far are
+    handed to the "show" coroutine of everyone watching, on the event loop.
+
+    Several /deep searches for the same player watch the same fetch. Once the
+    last of them stops watching, "cancelled" is set and the next update()
+    raises SearchCancelled, which stops the fetch.
+    '''
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop                    # The bot's event loop, where the shows are run
+        self.shows: list = []               # Coroutine functions taking the totals so far (None to just wait)
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.stats: dict = {}               # dict: {date range: aggregates} latest totals of each range
+        self.due: dict = {}                 # dict: {date range: time} when each range next works out its totals
+        self.shown: float = time.monotonic() # When the totals were last handed to the shows
+        self.showing = None                 # Future of the shows in progress
+        self.ticket = None                  # Place of the fetch in the deep search queue (see scheduler.py)
+
+    ''' Start watching the fetch, returning False if it has already been stopped '''
+    def watch(self, show) -> bool:
+        with self.lock:
+            if self.cancelled.is_set():
+                return False
+            self.shows.append(show)
+            return True
+
+    ''' Stop watching the fetch, stopping it if nobody else is watching '''
+    def unwatch(self, show) -> None:
+        with self.lock:
+            self.shows.remove(show)
+            if not self.shows:
+                self.cancelled.set()
+
+    ''' Called with the history of a date range (None if unpartitioned) after every replay '''
+    def update(self, history: History, key=None) -> None:
+        if self.cancelled.is_set():
+            raise SearchCancelled()
+
+        # Each range only works out its totals once per interval, in its own thread (outside the lock)
+        now = time.monotonic()
+        with self.lock:
+            if now < self.due.get(key, self.shown + config.DEEP_PROGRESS_INTERVAL):
+                return
+            self.due[key] = now + config.DEEP_PROGRESS_INTERVAL
+            if not any(self.shows):
+                return
+        stats = history.aggregates()
+
+        with self.lock:
+            self.stats[key] = stats
+            # Don't queue edits up behind ones that Discord is slow to accept
+            if now < self.shown + config.DEEP_PROGRESS_INTERVAL or (self.showing is not None and not self.showing.done()):
+                return
+            self.shown = now
+            self.showing = asyncio.run_coroutine_threadsafe(self.show_all(merge_stats(list(self.stats.values()))), self.loop)
+
+    ''' Hand the totals to everyone watching '''
+    async def show_all(self, stats: dict) -> None:
+        await asyncio.gather(*[show(stats) for show in list(self.shows) if show is not None])
+
+    ''' Wait for the shows in progress, so that they can't land on top of the final results '''
+    async def finish(self) -> None:
+        with self.lock:
+            self.shown = float("inf")
+            showing = self.showing
+        if showing is not None:
+            await asyncio.wrap_future(showing)
+
+class StopView(discord.ui.View):
+    ''' Button under the /deep progress message for the user who ran it to stop the search '''
+    def __init__(self, user: discord.User, stop) -> None:
+        super().__init__(timeout=None)
+        self.user = user
+        self.stop_search = stop             # Called when the button is pressed
+
+    @discord.ui.button(label="Stop", style=discord.ButtonStyle.secondary)
+    async def stop_button(self, interaction: discord.Interaction, button: discord.ui.Button) -> None:
+        if interaction.user.id != self.user.id:
+            await interaction.response.send_message(" > Only the person who started this search can stop it", ephemeral=True)
+            return
+        self.stop_search()
+        await interaction.response.defer()
+
+class UpgradeView(discord.ui.View):
+    ''' Button under the results of a quick /deep to run the full search '''
+    def __init__(self, player: 'Player') -> None:
+        super().__init__(timeout=config.DEEP_UPGRADE_TIMEOUT)
+        self.player = player
+        self.message = None                 # The message the button is on, so it can be taken off when it times out
+
+    @discord.ui.button(label="Full search", style=discord.ButtonStyle.primary)
+    async def full_search(self, interaction: discord.Interaction, button: discord.ui.Button) -> None:
+        print(f" + Button: Full search {self.player.platform_player_id}")
+        print(f"   + User : {interaction.user.name}")
+        # Only one full search per quick one
+        self.stop()
+        await interaction.response.edit_message(view=None)
+        more_coming = await interaction.followup.send(" > More coming **↓** (This might take a minute)")
+        await run_deep_search(interaction, self.player, more_coming)
+
+    async def on_timeout(self) -> None:
+        if self.message is not None:
+            try:
+                await self.message.edit(view=None)
+            except discord.NotFound:
+                pass
 
 
 ## Helper functions ##
+# The ballchasing and Steam calls are all blocking, so they are run in a bounded
+# pool of worker threads to keep the event loop (gateway heartbeat etc.) responsive
+lookup_executor = ThreadPoolExecutor(max_workers=config.LOOKUP_WORKERS, thread_name_prefix="lookup")
+
+# Pool for fetching the date ranges of long histories (shared by every deep search)
+partition_executor = ThreadPoolExecutor(max_workers=config.HISTORY_PARTITION_WORKERS, thread_name_prefix="partition")
+
+# Separate pool for the locate_target searches, as they are started from inside the lookup pool
+probe_executor = ThreadPoolExecutor(max_workers=config.LOCATE_WORKERS, thread_name_prefix="probe")
+
+# Only so many history fetches run at once, and the rest wait their turn
+deep_queue = scheduler.Scheduler(config.DEEP_CONCURRENT, config.DEEP_PER_GUILD, config.DEEP_PER_USER)
+
+# Pool for the history fetches let through by the deep search queue (a thread each), so they don't hold up the lookup pool
+deep_executor = ThreadPoolExecutor(max_workers=config.DEEP_CONCURRENT, thread_name_prefix="deep")
+
+''' Run a blocking function in the lookup pool and await the result '''
+async def run_blocking(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(lookup_executor, func, *args)
+
+''' Run a history fetch in the deep pool and await the result (only once the deep search queue has let it through) '''
+async def run_deep(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(deep_executor, func, *args)
+
+''' Run the locate_target probes one after the other, stopping at the first success '''
+def resolve_sequential(probes: list) -> str | None:
+    stop = threading.Event()
+    for probe in probes:
+        if (platform_player_id := probe(stop)) is not None:
+            return platform_player_id
+    return None
+
+''' Run the locate_target probes all at once, keeping the priority order of the results '''
+def resolve_concurrent(probes: list) -> str | None:
+    '''
+    The results are collected in priority order, so a lower priority probe
+    can only win once every higher priority probe has come back empty.
+    As soon as there is a winner, probes that haven't started are cancelled
+    and the ones in flight are told to stop before their next request.
+    '''
+    stop = threading.Event()
+    futures = [probe_executor.submit(probe, stop) for probe in probes]
+    try:
+        for future in futures:
+            if (platform_player_id := future.result()) is not None:
+                return platform_player_id
+        return None
+    finally:
+        stop.set()
+        for future in futures:
+            future.cancel()
+
+## Single flight ##
+# Lookups in progress, so that identical lookups made at the same time (several people
+# checking the same player) share one set of requests instead of repeating them
+in_flight: dict = {}                        # dict: {key: asyncio.Future}
+fetching: dict = {}                         # dict: {platform:id: DeepProgress} of the history fetches in progress
+
+''' Await func(*args), or join the identical lookup (same key) already in progress '''
+async def single_flight(key: tuple, func, *args):
+    future = in_flight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(func(*args))
+        in_flight[key] = future
+        future.add_done_callback(lambda done: finish_flight(key, done))
+    # One of the lookups giving up mustn't cancel it for everyone else
+    return await asyncio.shield(future)
+
+''' Forget a finished lookup so that the next one starts afresh '''
+def finish_flight(key: tuple, future: asyncio.Future) -> None:
+    if in_flight.get(key) is future:
+        del in_flight[key]
+    # Everyone waiting gets the exception through shield(), but they may all have given up (a stopped /deep)
+    if not future.cancelled():
+        future.exception()
+
+''' Watch the history fetch in progress for a player, or queue a new one '''
+def watch_history(platform_player_id: str, show, guild_id: int | None, user_id: int) -> DeepProgress:
+    progress = fetching.get(platform_player_id)
+    if progress is None or not progress.watch(show):
+        # A fetch that has been stopped is left to wind down on its own
+        progress = DeepProgress(asyncio.get_running_loop())
+        progress.watch(show)
+        progress.ticket = deep_queue.join(guild_id, user_id)
+        fetching[platform_player_id] = progress
+        in_flight.pop(("history", platform_player_id), None)
+    return progress
+
+''' Fetch a player's history in the deep pool, once the deep search queue lets it through '''
+async def fetch_history(player: Player, progress: DeepProgress) -> History:
+    try:
+        if not await deep_queue.wait(progress.ticket):
+            raise SearchCancelled()
+        # The fetch gives way to the shallow lookups for the API rate limits
+        return await run_deep(network.in_background, player.fetch_history, progress)
+    finally:
+        # Only once the fetch has finished, so a stopped fetch still counts against the limits while it winds down
+        deep_queue.leave(progress.ticket)
+        if fetching.get(player.platform_player_id) is progress:
+            del fetching[player.platform_player_id]
+
+''' Sample a player's history (quick /deep) in the deep pool, once the deep search queue lets it through '''
+async def sample_history(player: Player, guild_id: int | None, user_id: int) -> dict:
+    ticket = deep_queue.join(guild_id, user_id)
+    try:
+        await deep_queue.wait(ticket)
+        # The sample gives way to the shallow lookups for the API rate limits
+        return await run_deep(network.in_background, player.sample_history)
+    finally:
+        deep_queue.leave(ticket)
+
+''' Split the time between two dates into equal date ranges (as rfc3339), newest first '''
+def date_ranges(start, end, count: int) -> list:
+    bounds = [rfc3339(start + (end - start) * i / count) for i in range(1, count)]
+    # The oldest and newest ranges are left open so nothing at either end is missed
+    return list(zip([None] + bounds, bounds + [None]))[::-1]
+
+## Stored histories ##
+# A pre-warm sync can run alongside a /deep of the same player, so neither may replace a newer sync with its own
+
+history_lock = threading.Lock()
+
+''' Is a history synced at least as far as the one stored for its player? '''
+def is_latest_history(history: History) -> bool:
+    stored = cache.get("history", history.platform_player_id)
+    if stored is None or stored.get("version") != replay_history.STATE_VERSION or stored["last_created"] is None:
+        return True
+    return history.last_created is not None and history.last_created >= stored["last_created"]
+
+''' Store a player's synced history, unless a newer sync of it was stored in the meantime '''
+def store_history(history: History) -> bool:
+    with history_lock:
+        if not is_latest_history(history):
+            return False
+        cache.set("history", history.platform_player_id, history.to_state(), config.CACHE_TTL_HISTORY)
+        return True
+
+## Checkpoints ##
+# Partial histories of the date ranges of a first /deep, so a fetch that is cut short can be resumed
+
+''' Cache key of the checkpoint of one date range of a player's history '''
+def checkpoint_key(platform_player_id: str, after: str | None, before: str | None) -> str:
+    return f"{platform_player_id} {after} {before}"
+
+''' Load the checkpoint of a date range: (history, cursor, done), or (None, None, False) if there isn't one '''
+def load_checkpoint(key: str) -> tuple:
+    checkpoint = cache.get("checkpoint", key)
+    if checkpoint is None or checkpoint["history"]["version"] != replay_history.STATE_VERSION:
+        return None, None, False
+    return History.from_state(checkpoint["history"]), checkpoint["cursor"], checkpoint["done"]
+
+''' Save the totals of a date range so far, and the date of the oldest replay reached '''
+def save_checkpoint(key: str, history: History, cursor: str | None, done: bool = False) -> None:
+    cache.set("checkpoint", key, {"history": history.to_state(), "cursor": cursor, "done": done}, config.CACHE_TTL_CHECKPOINT)
+
+''' Combine the aggregates of several date ranges into one set of totals (for showing progress) '''
+def merge_stats(stats: list) -> dict:
+    if len(stats) == 1:
+        return stats[0]
+    names_count, team_count, opp_count = Counter(), Counter(), Counter()
+    team_names, team_pro, opp_names, opp_pro = {}, {}, {}, {}
+    for aggregates in stats:
+        names_count.update(aggregates["names_count"])
+        team_count.update(aggregates["team_count"])
+        opp_count.update(aggregates["opp_count"])
+        # Any range's most popular name will do until the ranges are properly merged
+        team_names.update(aggregates["team_names"])
+        opp_names.update(aggregates["opp_names"])
+        for i, pro in aggregates["team_pro"].items(): team_pro[i] = pro or team_pro.get(i, False)
+        for i, pro in aggregates["opp_pro"].items(): opp_pro[i] = pro or opp_pro.get(i, False)
+    return {
+        "replay_count": sum(aggregates["replay_count"] for aggregates in stats),
+        "names_count": dict(names_count.most_common()),
+        "is_pro": any(aggregates["is_pro"] for aggregates in stats),
+        "team_names": team_names,
+        "team_count": dict(team_count.most_common()),
+        "team_pro": team_pro,
+        "opp_names": opp_names,
+        "opp_count": dict(opp_count.most_common()),
+        "opp_pro": opp_pro
+    }
+
 ''' Run the first (shallow) search to get basic info about the player '''
 async def run_shallow_search(interaction, target: str = None):
     embed = discord.Embed(
@@ -600,18 +1014,35 @@ async def run_shallow_search(interaction, target: str = None):
         return None
 
     player = Player(target)
-    located = player.locate_target()
+    located = await player.locate_target()
     if not located:
         embed.title = f"\"{target}\" not found."
         embed.color = config.RED
         await interaction.followup.send(embed=embed)
         return None
-    player.update_replay_object()
+
+    # Nothing to fetch if the player has no new replays since the last lookup
+    stored = await run_blocking(cached_profile, player)
+    if stored is not None:
+        player.replay_object = stored["replay_object"]
+        player.links = stored["links"]
+        player.is_uploader = stored["is_uploader"]
+        player.latest_replay_id = stored["version"]
+        await interaction.followup.send(embed=stored["embeds"][0])
+        return player
+
+    await player.update_profile()
+    embed = profile_embed(player)
+    await interaction.followup.send(embed=embed)
+    await run_blocking(store_profile, player, embed)
+
+    return player
+
+''' Format the profile of a located player as the /balls embed '''
+def profile_embed(player: Player) -> discord.Embed:
     date = player.replay_object["replaydate"]
     camera = player.replay_object['camera']
-    pro = False # Feature to be added during a future Liquipedia update
-    player.update_links()
-    player.update_uploader()
+    pro = roster.is_pro(player.platform_player_id)
 
     # Create the Discord embed using the gathered information
     embed = discord.Embed(
@@ -641,43 +1072,89 @@ async def run_shallow_search(interaction, target: str = None):
     embed.set_footer(
         text=config.BOT_FOOTER_TEXT
     )
-    await interaction.followup.send(embed=embed)
+    return embed
 
-    return player
+''' Store the /balls embed of a player, with the profile it was made from (see cached_response) '''
+def store_profile(player: Player, embed: discord.Embed) -> None:
+    store_response("balls", player.platform_player_id, player.latest_replay_id, [embed],
+        replay_object=player.replay_object, links=player.links, is_uploader=player.is_uploader)
 
-''' Run the second (deep) search to get the full stats from the player's entire replay history '''
-async def run_deep_search(interaction, player: Player):
+## Rendered responses ##
+# A repeat lookup of a player with no new replays gets the embeds rendered last time (see config.CACHE_TTL_EMBEDS)
 
-    # Update the player object to include the deep history
-    player.update_history()
+''' The stored /balls response of a player, if they have no new replays since it was rendered (blocking) '''
+def cached_profile(player: Player) -> dict | None:
+    '''
+    The response is kept for longer than the id of the latest replay it was
+    rendered from (config.CACHE_TTL_PROFILE_LATEST), so once the id has
+    expired one cheap search for the latest replay tells if it still holds.
+    '''
+    if cache.get("embeds_balls", player.platform_player_id) is None:
+        return None
+    return cached_response("balls", player.platform_player_id, player.find_latest_replay_id())
+
+''' The stored response of a command for a player, if it was rendered from this version of their data '''
+def cached_response(command: str, platform_player_id: str, version: str | None) -> dict | None:
+    '''
+    The version is the id of the player's latest replay. Returns the stored
+    entry, with its "embeds" turned back into discord.Embeds.
+    '''
+    if version is None:
+        return None
+    stored = cache.get(f"embeds_{command}", platform_player_id)
+    if stored is None or stored["version"] != version:
+        return None
+    print(f"   - {command}: cached")
+    stored["embeds"] = [discord.Embed.from_dict(embed) for embed in stored["embeds"]]
+    return stored
+
+''' Store the response of a command for a player, along with anything needed to use it again '''
+def store_response(command: str, platform_player_id: str, version: str | None, embeds: list, **extra) -> None:
+    if version is None:
+        return
+    cache.set(f"embeds_{command}", platform_player_id, {"version": version, "embeds": [embed.to_dict() for embed in embeds], **extra}, config.CACHE_TTL_EMBEDS)
+
+''' Total up a history into the stats profile shown by /deep, with the pros marked (slow for a long history, so run it off the event loop) '''
+def history_stats(history: History, platform_player_id: str) -> dict:
+    return roster.mark_pros(history.aggregates(), platform_player_id)
+
+''' Format a stats profile (see History.aggregates) as the /deep embeds '''
+def deep_embeds(stats: dict, footer: str) -> list:
 
     # Format the responses
 
     SUB = str.maketrans("0123456789", "₀₁₂₃₄₅₆₇₈₉")
 
-    name_string = "```" + ", ".join(list(player.names_count.keys())[:50]) + "```"
+    # Sampled stats (see history.estimate_aggregates) give each count with its margin of error
+    def count_string(counts: str, key) -> str:
+        errors = stats.get(counts.replace("_count", "_error"))
+        if errors is None:
+            return str(stats[counts][key]).translate(SUB)
+        return f"{stats[counts][key]}±{round(errors[key])}".translate(SUB)
+
+    name_string = "```" + ", ".join(list(stats['names_count'].keys())[:50]) + "```"
     name_leaderboard = ""
     count = 1
-    for name in list(player.names_count.keys())[:3]:
-        name_leaderboard = name_leaderboard + f"   {config.EMOJI_COUNT[count]} `{name}` {str(player.names_count[name]).translate(SUB)}"
+    for name in list(stats['names_count'].keys())[:3]:
+        name_leaderboard = name_leaderboard + f"   {config.EMOJI_COUNT[count]} `{name}` {count_string('names_count', name)}"
         count += 1
 
-    team_list = [list(player.team_count.keys())[:5], list(player.team_count.keys())[5:10], list(player.team_count.keys())[10:15]]
+    team_list = [list(stats['team_count'].keys())[:5], list(stats['team_count'].keys())[5:10], list(stats['team_count'].keys())[10:15]]
     team_string = ["", "", ""]
     for i in range(len(team_list)):
         for platform_player_id in team_list[i]:
-            subscript = str(player.team_count[platform_player_id]).translate(SUB)
+            subscript = count_string('team_count', platform_player_id)
             platform, player_id = platform_player_id.split(":")
-            team_string[i] = team_string[i] + f"[{player.team_names[platform_player_id]}](<https://ballchasing.com/player/{platform}/{player_id}>) {config.EMOJI_TYPE_PRO if player.team_pro[platform_player_id] else ''} {subscript} ,  "
+            team_string[i] = team_string[i] + f"[{stats['team_names'][platform_player_id]}](<https://ballchasing.com/player/{platform}/{player_id}>) {config.EMOJI_TYPE_PRO if stats['team_pro'][platform_player_id] else ''} {subscript} ,  "
         team_string[i] = team_string[i].removesuffix(" , ")
 
-    opp_list = [list(player.opp_count.keys())[:5], list(player.opp_count.keys())[5:10], list(player.opp_count.keys())[10:15]]
+    opp_list = [list(stats['opp_count'].keys())[:5], list(stats['opp_count'].keys())[5:10], list(stats['opp_count'].keys())[10:15]]
     opp_string = ["", "", ""]
     for i in range(len(opp_list)):
         for platform_player_id in opp_list[i]:
-            subscript = str(player.opp_count[platform_player_id]).translate(SUB)
+            subscript = count_string('opp_count', platform_player_id)
             platform, player_id = platform_player_id.split(":")
-            opp_string[i] = opp_string[i] + f"[{player.opp_names[platform_player_id]}](<https://ballchasing.com/player/{platform}/{player_id}>) {config.EMOJI_TYPE_PRO if player.opp_pro[platform_player_id] else ''} {subscript} ,  "
+            opp_string[i] = opp_string[i] + f"[{stats['opp_names'][platform_player_id]}](<https://ballchasing.com/player/{platform}/{player_id}>) {config.EMOJI_TYPE_PRO if stats['opp_pro'][platform_player_id] else ''} {subscript} ,  "
         opp_string[i] = opp_string[i].removesuffix(" , ")
 
     # Create the Discord embeds using the gathered information
@@ -689,12 +1166,12 @@ async def run_deep_search(interaction, player: Player):
     )
     name_embed.add_field(
         name=f"**Pro**",
-        value=f"`{player.is_pro}` {config.EMOJI_TYPE_PRO if player.is_pro else ''}",
+        value=f"`{stats['is_pro']}` {config.EMOJI_TYPE_PRO if stats['is_pro'] else ''}",
         inline=True
     )
     name_embed.add_field(
         name=f"**Replays**",
-        value=f"`{player.replay_count}`",
+        value=f"`{stats['replay_count']}`" if "sample_count" not in stats else f"`~{stats['replay_count']}` (sampled `{stats['sample_count']}`)",
         inline=True
     )
     name_embed.add_field(
@@ -709,7 +1186,7 @@ async def run_deep_search(interaction, player: Player):
         color=config.BLUE
     )
     team_embed.add_field(
-        name=f"**Friends**  `{len(list(player.team_count.keys()))}`",
+        name=f"**Friends**  `{len(list(stats['team_count'].keys()))}`",
         value=team_string[0],
         inline=False
     )
@@ -730,7 +1207,7 @@ async def run_deep_search(interaction, player: Player):
         color=config.BLUE
     )
     opp_embed.add_field(
-        name=f"**Opps**  `{len(list(player.opp_count.keys()))}`",
+        name=f"**Opps**  `{len(list(stats['opp_count'].keys()))}`",
         value=opp_string[0],
         inline=False
     )
@@ -745,8 +1222,126 @@ async def run_deep_search(interaction, player: Player):
         inline=False
     )
     opp_embed.set_footer(
-        text=f"Details for: {player.replay_object['name']}"
+        text=footer
     )
 
-    await interaction.followup.send(embeds=[name_embed, team_embed, opp_embed])
+    return [name_embed, team_embed, opp_embed]
+
+''' Run the second (deep) search to get the full stats from the player's entire replay history '''
+async def run_deep_search(interaction, player: Player, message: discord.WebhookMessage):
+    '''
+    The "More coming" message is replaced by the results once the search is done.
+    While the search waits in the deep search queue, the message shows its place,
+    and with config.DEEP_PROGRESSIVE it shows the totals so far while the history
+    is fetched. The button under it stops the search, as does deleting it, as
+    there is nobody left to show the results to.
+
+    A /deep for a player whose history is already being fetched (or queued)
+    watches that fetch instead of starting another, and the fetch is only
+    stopped once everyone watching it has stopped.
+
+    If the player has no new replays since their last /deep, the results
+    rendered then are shown straight away.
+    '''
+
+    stored = await run_blocking(cached_response, "deep", player.platform_player_id, player.latest_replay_id)
+    if stored is not None:
+        await show_results(interaction, message, stored["embeds"])
+        return
+
+    stopped = asyncio.Event()
+    show = None
+    if config.DEEP_PROGRESSIVE:
+        async def show(stats: dict):
+            try:
+                await message.edit(content=None, embeds=deep_embeds(roster.mark_pros(stats, player.platform_player_id), f"Searching: {stats['replay_count']} replays so far"), view=view)
+            except discord.NotFound:
+                stop()
+
+    def stop():
+        if not stopped.is_set():
+            stopped.set()
+            progress.unwatch(show)
+            # Nobody is watching any more, so give up the place in the queue if it hasn't started,
+            # otherwise it is given up once the fetch threads have wound down (see fetch_history)
+            if progress.cancelled.is_set(): deep_queue.withdraw(progress.ticket)
+
+    progress = watch_history(player.platform_player_id, show, interaction.guild_id, interaction.user.id)
+    fetch = asyncio.ensure_future(single_flight(("history", player.platform_player_id), fetch_history, player, progress))
+    view = StopView(interaction.user, stop)
+
+    # Wait for the history, showing the place in the queue, unless this search is stopped first
+    shown_position = None
+    waiting = asyncio.ensure_future(stopped.wait())
+    while not fetch.done() and not stopped.is_set():
+        changed = asyncio.ensure_future(deep_queue.changed.wait())
+        position = deep_queue.position(progress.ticket)
+        if position != shown_position:
+            shown_position = position
+            content = f" > Queued for a deep search: **#{position}**" if position else " > More coming **↓** (This might take a minute)"
+            try:
+                await message.edit(content=content, view=view)
+            except discord.NotFound:
+                stop()
+        await asyncio.wait([fetch, waiting, changed], return_when=asyncio.FIRST_COMPLETED)
+        changed.cancel()
+    waiting.cancel()
+
+    if stopped.is_set():
+        # Others may still be watching the fetch, so only stop waiting for it
+        if not fetch.cancel(): fetch.exception()
+        print(f"   - Stopped: {player.platform_player_id}")
+        try:
+            await message.edit(content=" > Search stopped", embeds=[], view=None)
+        except discord.NotFound:
+            pass
+        return
+
+    # Update the player object to include the deep history
+    history = fetch.result()
+    stats = await run_blocking(history_stats, history, player.platform_player_id)
+    player.apply_history(history, stats)
+
+    embeds = deep_embeds(stats, f"Details for: {player.replay_object['name']}")
+    await run_blocking(store_response, "deep", player.platform_player_id, player.latest_replay_id, embeds)
+
+    # Finalise the progress message with the results
+    await progress.finish()
+    await show_results(interaction, message, embeds)
+
+''' Replace the "More coming" message of a /deep with the results '''
+async def show_results(interaction, message: discord.WebhookMessage, embeds: list):
+    if not config.DEEP_PROGRESSIVE:
+        await interaction.followup.send(embeds=embeds)
+        await message.delete()
+        return
+    try:
+        await message.edit(content=None, embeds=embeds, view=None)
+    except discord.NotFound:
+        pass
+
+''' Run a quick deep search, estimating the stats from a sample of the player's replay history '''
+async def run_quick_deep_search(interaction, player: Player, message: discord.WebhookMessage):
+    '''
+    The "More coming" message is replaced by the estimates, with a button
+    to run the full search. If the player's history is stored already, the
+    full search only has to sync the newest uploads (or has nothing to do if
+    its results are stored too), so it is run instead.
+    '''
 
+    rendered = await run_blocking(cache.get, "embeds_deep", player.platform_player_id)
+    if config.HISTORY_SYNC and await run_blocking(cache.get, "history", player.platform_player_id) is not None \
+    or rendered is not None and rendered["version"] == player.latest_replay_id:
+        await run_deep_search(interaction, player, message)
+        return
+
+    stats = await single_flight(("sample", player.platform_player_id), sample_history, player, interaction.guild_id, interaction.user.id)
+    print(f"   - ~{stats['replay_count']} (sampled {stats['sample_count']})")
+
+    embeds = deep_embeds(roster.mark_pros(stats, player.platform_player_id), f"Estimates for: {player.replay_object['name']} (± at 95% confidence)")
+    view = UpgradeView(player)
+    try:
+        await message.edit(content=None, embeds=embeds, view=view)
+        view.message = message
+    except discord.NotFound:
+        view.stop()
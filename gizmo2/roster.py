@@ -0,0 +1,184 @@
+'''
+Author: Kian Mortimer
+Date: 18/10/26
+
+Description:
+Local index of the pro players, built from the pro replays on ballchasing.com
+Pro names are looked up far more than anyone else's, so rather than searching
+the pro replays for the name on every lookup (see Player.locate_probes) the
+names and aliases of every pro are kept here, with the account they belong to.
+The index is refreshed in the background with the pro replays uploaded since
+the last refresh, and stored in the cache so it survives a restart.
+'''
+
+# IMPORTS
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# MY IMPORTS
+import config
+import cache
+import network
+from history import replay_epoch
+
+# Bumped whenever the stored format of the index changes, so older indexes get rebuilt
+STATE_VERSION = 2
+
+class Roster():
+    '''
+    The pro players seen in pro replays, by account and by name
+    A pro can go by several names over the years, and a name can be shared
+    by more than one account, so each name keeps every account seen with it
+    and when they were last seen with it. The most recent one wins a lookup.
+    Lookups come from the probe threads while the refresh thread is adding
+    replays, so both go through the lock.
+    '''
+    def __init__(self) -> None:
+        self.players: dict = {}             # dict: {platform:id: {name: epoch last seen}}
+        self.names: dict = {}               # dict: {name: {platform:id: epoch last seen}}
+        self.newest: str = None             # Upload date of the newest replay read, where the next refresh starts
+        self.lock = threading.Lock()
+
+    ''' Add the pros of a replay (from a replay search) to the index '''
+    def add_replay(self, replay: dict) -> None:
+        epoch = replay_epoch(replay['date']) or 0
+        with self.lock:
+            for colour in ("blue", "orange"):
+                # A replay can be missing a team entirely (see History.iter_teams)
+                team = replay.get(colour)
+                if team is None: continue
+                for player in team.get('players') or []:
+                    # Only the players listed as pros, and never splitscreen
+                    if player is None or "pro" not in player or "player_number" in player['id']: continue
+                    platform_player_id = player['id']['platform'] + ":" + player['id']['id']
+                    self.see(platform_player_id, player['name'], epoch)
+
+    ''' Record a pro going by a name (lock must be held) '''
+    def see(self, platform_player_id: str, name: str, epoch: int) -> None:
+        aliases = self.players.setdefault(platform_player_id, {})
+        aliases[name] = max(epoch, aliases.get(name, 0))
+        accounts = self.names.setdefault(name, {})
+        accounts[platform_player_id] = max(epoch, accounts.get(platform_player_id, 0))
+
+    ''' Find the "platform:id" of a pro from a parsed target, or None if no pro goes by that name '''
+    def lookup(self, account_id: tuple) -> str | None:
+        with self.lock:
+            accounts = self.names.get(account_id[1])
+            if not accounts:
+                return None
+            # Same condition as the pro name searches: the platform has to match, unless it wasn't given
+            matching = {i: epoch for i, epoch in accounts.items() if account_id[0] == "any" or i.split(":")[0] == account_id[0]}
+            return max(matching, key=matching.get) if matching else None
+
+    ''' Is the account listed as a pro? '''
+    def is_pro(self, platform_player_id: str) -> bool:
+        return platform_player_id in self.players
+
+    ''' Copy of the stats of a history with the pros in the index marked as pros too '''
+    def mark_pros(self, stats: dict, platform_player_id: str) -> dict:
+        '''
+        A history only knows a player is a pro if one of its replays happens
+        to list them as one, so the index fills in the rest.
+        '''
+        stats = dict(stats)
+        stats["is_pro"] = stats["is_pro"] or self.is_pro(platform_player_id)
+        stats["team_pro"] = {i: pro or self.is_pro(i) for i, pro in stats["team_pro"].items()}
+        stats["opp_pro"] = {i: pro or self.is_pro(i) for i, pro in stats["opp_pro"].items()}
+        return stats
+
+    ''' Convert the index into plain data that can be stored (see cache.py) '''
+    def to_state(self) -> dict:
+        with self.lock:
+            return {
+                "version": STATE_VERSION,
+                "newest": self.newest,
+                "players": {i: dict(aliases) for i, aliases in self.players.items()}
+            }
+
+    ''' Rebuild the index from the output of to_state() '''
+    @classmethod
+    def from_state(cls, state: dict) -> 'Roster':
+        roster = cls()
+        if state.get("version") != STATE_VERSION:
+            return roster
+        roster.newest = state["newest"]
+        for platform_player_id, aliases in state["players"].items():
+            for name, epoch in aliases.items():
+                roster.see(platform_player_id, name, epoch)
+        return roster
+
+
+## Module interface ##
+roster: Roster = None
+roster_lock = threading.Lock() # The refresh thread and the probe threads can both be first to ask for the index
+task: asyncio.Task = None
+
+# A refresh reads pages of replays on its budget, so it gets a thread of its own rather than holding up the lookup threads
+refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="roster")
+
+''' Get the index, loading it from the cache the first time '''
+def get_roster() -> Roster:
+    global roster
+    with roster_lock:
+        if roster is None:
+            roster = Roster.from_state(cache.get("roster", "index", {}))
+        return roster
+
+''' Find the "platform:id" of a pro from a parsed target, or None (see Roster.lookup) '''
+def lookup(account_id: tuple) -> str | None:
+    return get_roster().lookup(account_id) if config.ROSTER else None
+
+''' Is the account listed as a pro in the index? '''
+def is_pro(platform_player_id: str) -> bool:
+    return config.ROSTER and get_roster().is_pro(platform_player_id)
+
+''' Mark the pros in the index as pros in the stats of a history (see Roster.mark_pros) '''
+def mark_pros(stats: dict, platform_player_id: str) -> dict:
+    return get_roster().mark_pros(stats, platform_player_id) if config.ROSTER else stats
+
+''' Start refreshing the index (called from on_ready, which can run again on a reconnect) '''
+def start() -> None:
+    global task
+    if config.ROSTER and (task is None or task.done()):
+        task = asyncio.get_running_loop().create_task(run())
+
+''' Refresh the index every config.ROSTER_INTERVAL, for as long as the bot runs '''
+async def run() -> None:
+    loop = asyncio.get_running_loop()
+    # The first use of the client pings the API, so don't do it on the event loop
+    api = await loop.run_in_executor(refresh_executor, network.ballchasing_api)
+    budget = api.budget(config.ROSTER_BUDGET)
+    while True:
+        try:
+            await loop.run_in_executor(refresh_executor, network.on_budget, budget, refresh, api)
+        except Exception as e:
+            # Whatever was read before the failure is kept, and the next refresh reads the rest again
+            print(f" ! Refreshing the pro roster failed: {e!r}")
+        await asyncio.sleep(config.ROSTER_INTERVAL)
+
+''' Add the pro replays uploaded since the last refresh to the index, and store it '''
+def refresh(api) -> None:
+    '''
+    The first refresh reads back config.ROSTER_BOOTSTRAP pro replays, and
+    every refresh after only reads the replays uploaded after the newest
+    upload it has read (as sync_history does). Pro replays are often
+    uploaded well after the match, so going by the match date would miss
+    them. The start of the next refresh only moves on once this one is done.
+    '''
+    index = get_roster()
+    search = {"created_after": index.newest} if index.newest is not None else {}
+    count = config.ROSTER_BOOTSTRAP if index.newest is None else 50000 # count can be unlimited
+    newest = index.newest
+    added = 0
+    try:
+        for replay in api.get_replays(pro="true", sort_by="created", sort_dir="desc", deep=False, count=count, **search):
+            created = replay.get('created')
+            if created is not None and (newest is None or created > newest): newest = created
+            index.add_replay(replay)
+            added += 1
+        # Reading a replay twice does no harm, so a refresh that fails starts again from the same place
+        if newest is not None: index.newest = newest
+    finally:
+        cache.set("roster", "index", index.to_state(), None)
+    print(f" > Pro roster: {added} new replays, {len(index.players)} pros")
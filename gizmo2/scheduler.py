@@ -0,0 +1,89 @@
+'''
+Author: Kian Mortimer
+Date: 18/10/26
+
+Description:
+Admission control for the long running searches (/deep)
+Searches queue for a place, so only so many run at once in total, per guild
+and per user, and one heavy user can't hold up everyone else
+'''
+
+# IMPORTS
+import asyncio
+
+class Ticket():
+    ''' A search's place in the queue '''
+    def __init__(self, guild_id: int | None, user_id: int) -> None:
+        self.guild_id: int | None = guild_id    # None in direct messages (no guild limit)
+        self.user_id: int = user_id
+
+class Scheduler():
+    '''
+    Queue of searches waiting to run, in order of arrival
+    A search is let through as soon as the limits allow, even if searches
+    ahead of it are still waiting on their guild or user limit.
+    Everything runs on the event loop, so no locking is needed.
+    '''
+    def __init__(self, limit: int, per_guild: int, per_user: int) -> None:
+        self.limit: int = limit             # Most searches running at once
+        self.per_guild: int = per_guild     # Most searches running at once from one guild
+        self.per_user: int = per_user       # Most searches running at once from one user
+        self.waiting: list = []             # Tickets waiting to run, in order of arrival
+        self.running: list = []             # Tickets running
+        self.changed = asyncio.Event()      # Set (and replaced) whenever the queue moves
+
+    ''' Join the back of the queue '''
+    def join(self, guild_id: int | None, user_id: int) -> Ticket:
+        ticket = Ticket(guild_id, user_id)
+        self.waiting.append(ticket)
+        self.admit()
+        return ticket
+
+    ''' Leave the queue, or give up a place running (safe to call more than once) '''
+    def leave(self, ticket: Ticket) -> None:
+        if ticket in self.waiting:
+            self.waiting.remove(ticket)
+        elif ticket in self.running:
+            self.running.remove(ticket)
+        else:
+            return
+        self.admit()
+
+    ''' Leave the queue if the ticket is still waiting, returning whether it was '''
+    def withdraw(self, ticket: Ticket) -> bool:
+        # A running ticket keeps its place until the search has actually stopped
+        if ticket not in self.waiting:
+            return False
+        self.leave(ticket)
+        return True
+
+    ''' Place in the queue (1 is next), or 0 if the ticket isn't waiting '''
+    def position(self, ticket: Ticket) -> int:
+        return self.waiting.index(ticket) + 1 if ticket in self.waiting else 0
+
+    ''' Wait until the ticket is let through, returning False if it left the queue instead '''
+    async def wait(self, ticket: Ticket) -> bool:
+        while ticket in self.waiting:
+            await self.changed.wait()
+        return ticket in self.running
+
+    ''' Let through every waiting ticket that the limits allow '''
+    def admit(self) -> None:
+        for ticket in list(self.waiting):
+            if self.allowed(ticket):
+                self.waiting.remove(ticket)
+                self.running.append(ticket)
+        self.notify()
+
+    ''' Could the ticket run now? '''
+    def allowed(self, ticket: Ticket) -> bool:
+        if len(self.running) >= self.limit:
+            return False
+        if ticket.guild_id is not None and sum(t.guild_id == ticket.guild_id for t in self.running) >= self.per_guild:
+            return False
+        return sum(t.user_id == ticket.user_id for t in self.running) < self.per_user
+
+    ''' Wake everyone waiting on the queue '''
+    def notify(self) -> None:
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
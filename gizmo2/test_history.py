@@ -0,0 +1,142 @@
+'''
+Author: Kian Mortimer
+Date: 18/10/26
+
+Description:
+Checks for the parts of history.py that don't need the API
+TopCounter (Space-Saving), the match fingerprints of the duplicate check
+and merging the matches of two date ranges.
+
+Usage: python -m pytest test_history.py
+'''
+
+# IMPORTS
+import random
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+# MY IMPORTS
+from history import History, TopCounter, TOP_K_MATCHES, match_fingerprint, merge_matches, match_key
+
+TARGET = "steam:76561198000000000"
+
+''' A stream of keys where a few keys are far more common than the rest '''
+def skewed_stream(n: int, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    return [f"p{int(rng.paretovariate(1.2))}" for _ in range(n)]
+
+''' Build a replay in the format of a deep=False search '''
+def make_replay(date: str, blue: list, orange: list) -> dict:
+    def team(ids):
+        return {"players": [{"id": {"platform": "steam", "id": i}, "name": f"name {i}"} for i in ids]}
+    return {"date": date, "blue": team(blue), "orange": team(orange)}
+
+## TopCounter ##
+
+def test_top_counter_exact_under_capacity():
+    stream = skewed_stream(2000)
+    top = TopCounter(len(set(stream)))
+    for key in stream: top.add(key)
+    assert top.counts == dict(Counter(stream))
+    assert set(top.certain().values()) == set(Counter(stream).values())
+
+def test_top_counter_bounds():
+    stream = skewed_stream(20000)
+    true = Counter(stream)
+    top = TopCounter(20)
+    for key in stream: top.add(key)
+
+    assert len(top.counts) == 20
+    assert top.min == min(top.counts.values())
+    # Every count is at most its error too high, and never too low
+    for key, count in top.counts.items():
+        assert count - top.errors[key] <= true[key] <= count
+    # Any key seen more than total / capacity times is tracked
+    for key, count in true.items():
+        if count > len(stream) / 20: assert key in top.counts
+
+def test_top_counter_evicts_lowest():
+    top = TopCounter(2)
+    top.add("a", 3)
+    top.add("b")
+    assert top.add("c") == "b"
+    assert top.counts == {"a": 3, "c": 2}
+    assert top.errors == {"a": 0, "c": 1}
+
+def test_top_counter_merge_bounds():
+    first, second = skewed_stream(10000, seed=1), skewed_stream(10000, seed=2)
+    true = Counter(first) + Counter(second)
+    top, other = TopCounter(20), TopCounter(20)
+    for key in first: top.add(key)
+    for key in second: other.add(key)
+
+    dropped = top.merge(other)
+    assert len(top.counts) == 20
+    assert not set(dropped) & set(top.counts)
+    for key, count in top.counts.items():
+        assert count - top.errors[key] <= true[key] <= count
+    for key, count in true.items():
+        if count > (len(first) + len(second)) / 20: assert key in top.counts
+
+def test_top_counter_state_round_trip():
+    first, second = skewed_stream(5000, seed=1), skewed_stream(5000, seed=3)
+    top = TopCounter(10)
+    for key in first: top.add(key)
+    copy = TopCounter.from_state(10, top.to_state())
+    assert (copy.counts, copy.errors, copy.min) == (top.counts, top.errors, top.min)
+    # Carries on counting within the same bounds (ties on the lowest count may be evicted in another order)
+    true = Counter(first) + Counter(second)
+    for key in second: copy.add(key)
+    assert copy.min == min(copy.counts.values())
+    for key, count in copy.counts.items():
+        assert count - copy.errors[key] <= true[key] <= count
+
+## Duplicate check ##
+
+def test_fingerprint_ignores_team_and_order():
+    first = make_replay("2024-05-01T20:31:11+10:00", ["1", "2"], ["3", "4"])
+    second = make_replay("2024-05-01T20:31:11+10:00", ["4", "3"], ["2", "1"])
+    assert match_fingerprint(first) == match_fingerprint(second)
+    assert match_fingerprint(first) != match_fingerprint(make_replay("2024-05-01T20:31:11+10:00", ["1", "2"], ["3", "5"]))
+
+def test_fingerprint_skips_ghosts_and_bad_dates():
+    replay = make_replay("2024-05-01T20:31:11+10:00", ["1"], ["2"])
+    ghost = make_replay("2024-05-01T20:31:11+10:00", ["1"], ["2"])
+    ghost["orange"]["players"].append({"name": "ghost"})
+    ghost["blue"]["players"].append(None)
+    assert match_fingerprint(ghost) == match_fingerprint(replay)
+    assert match_fingerprint(make_replay("not a date", ["1"], ["2"])) is None
+
+def test_history_skips_copies_within_allowance():
+    history = History(TARGET)
+    ids = (["76561198000000000", "2"], ["3", "4"])
+    assert history.add_replay(make_replay("2024-05-01T20:31:11+10:00", *ids))
+    assert not history.add_replay(make_replay("2024-05-01T20:31:50+10:00", *ids))
+    assert history.add_replay(make_replay("2024-05-01T20:40:00+10:00", *ids))
+    assert history.replay_count == 2
+
+def test_merge_matches_keeps_earliest():
+    matches = {match_key(1, 7): 100, match_key(2, 7): 200}
+    merge_matches(matches, {match_key(1, 7): 90, match_key(2, 7): 210, match_key(3, 7): 300})
+    assert matches == {match_key(1, 7): 90, match_key(2, 7): 200, match_key(3, 7): 300}
+
+def test_merged_ranges_skip_copies_across_the_edge():
+    ids = (["76561198000000000", "2"], ["3", "4"])
+    newer, older = History(TARGET), History(TARGET)
+    newer.add_replay(make_replay("2024-05-01T20:31:11+10:00", *ids))
+    older.add_replay(make_replay("2024-05-01T10:00:00+10:00", ["76561198000000000", "5"], ["6", "7"]))
+    newer.merge(older)
+    # A copy of the match in the other range, uploaded with a slightly different date
+    assert not newer.add_replay(make_replay("2024-05-01T20:31:40+10:00", *ids))
+    assert newer.replay_count == 2
+
+def test_top_k_bounds_the_matches_but_catches_recent_copies():
+    history = History(TARGET, top_k=50)
+    start = datetime(2024, 5, 1, tzinfo=timezone(timedelta(hours=10)))
+    for i in range(5000):
+        date = (start + timedelta(minutes=10 * i)).isoformat()
+        history.add_replay(make_replay(date, ["76561198000000000", str(i)], ["x", "y"]))
+    assert len(history.matches) <= 2 * TOP_K_MATCHES
+    assert len(history.recent) <= TOP_K_MATCHES
+    # A copy of the last match added is still caught
+    assert not history.add_replay(make_replay(date, ["76561198000000000", str(i)], ["x", "y"]))
@@ -0,0 +1,81 @@
+'''
+Author: Kian Mortimer
+Date: 18/10/26
+
+Description:
+Checks for the deep search queue (scheduler.Scheduler)
+The order searches are let through in, the overall, guild and user limits,
+and leaving the queue before or after a search is let through.
+
+Usage: python -m pytest test_scheduler.py
+'''
+
+# IMPORTS
+import asyncio
+
+# MY IMPORTS
+from scheduler import Scheduler
+
+''' Run a check that needs an event loop (the queue's Event is made on the loop) '''
+def run(check):
+    return asyncio.run(check())
+
+def test_admits_in_order_of_arrival_up_to_the_limit():
+    async def check():
+        queue = Scheduler(2, 2, 2)
+        tickets = [queue.join(guild, user) for guild, user in ((1, 1), (2, 2), (3, 3), (4, 4))]
+        assert queue.running == tickets[:2]
+        assert [queue.position(ticket) for ticket in tickets] == [0, 0, 1, 2]
+        queue.leave(tickets[0])
+        assert queue.running == [tickets[1], tickets[2]]
+        assert queue.position(tickets[3]) == 1
+    run(check)
+
+def test_skips_searches_held_up_by_their_guild_or_user():
+    async def check():
+        queue = Scheduler(4, 2, 1)
+        first = queue.join(1, 10)
+        same_user = queue.join(2, 10)       # Held up by the user limit
+        same_guild = queue.join(1, 11)
+        full_guild = queue.join(1, 12)      # Held up by the guild limit
+        direct = queue.join(None, 13)       # No guild limit in direct messages
+        assert queue.running == [first, same_guild, direct]
+        assert queue.waiting == [same_user, full_guild]
+
+        # The first to arrive goes first once both are allowed
+        queue.leave(first)
+        assert queue.running == [same_guild, direct, same_user, full_guild]
+    run(check)
+
+def test_wait_returns_once_let_through():
+    async def check():
+        queue = Scheduler(1, 1, 1)
+        first = queue.join(1, 1)
+        second = queue.join(2, 2)
+        waiter = asyncio.ensure_future(queue.wait(second))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        queue.leave(first)
+        assert await waiter
+    run(check)
+
+def test_withdraw_only_gives_up_a_waiting_place():
+    async def check():
+        queue = Scheduler(1, 1, 1)
+        first = queue.join(1, 1)
+        second = queue.join(2, 2)
+        waiter = asyncio.ensure_future(queue.wait(second))
+        await asyncio.sleep(0)
+
+        # A running search keeps its place until it has stopped
+        assert not queue.withdraw(first)
+        assert queue.running == [first]
+        assert queue.withdraw(second)
+        assert not await waiter
+        assert queue.waiting == []
+
+        # Leaving more than once is safe
+        queue.leave(first)
+        queue.leave(first)
+        assert queue.running == []
+    run(check)